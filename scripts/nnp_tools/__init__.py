@@ -0,0 +1,31 @@
+'''
+Shared helpers for the `scripts` notebooks.
+
+Import from a notebook with
+
+    import sys
+    sys.path.append('..')   # path to the `scripts` directory
+    from nnp_tools import batch_scan
+
+Modules
+-------
+- `batch_scan`. Batched multi-conformer evaluation of the deformation scans.
+- `conformers`. Vectorized conformer generation with automatic masks.
+- `cache`. Persistent energy/force cache wrapping any ASE calculator.
+- `results_store`. Columnar, memory-mappable store of scan results.
+- `sweep`. Process-pool sweep running every model in its own long-lived worker.
+- `grid_scan`. Adaptive, symmetry-aware N-D PES grid scans.
+- `registry`. Lazy, name-based model registry with TorchScript artifacts.
+- `invariance`. Batched rotation/translation/permutation invariance tests.
+- `gaussian_logs`. Streaming, parallel Gaussian log parser and DFT reference set.
+- `gaussian_jobs`. Gaussian job generation, cost packing and local/Slurm array execution.
+- `benchmark`. Cross-model inference benchmark with regression comparison.
+- `profiling`. Instrumenting calculator wrapper with Chrome-trace output.
+- `hessian`. Batched/autograd Hessians and vibrational analysis with a Hessian cache.
+- `trajectory`. Indexed random-access trajectory reader and streaming MD observables.
+- `replica_md`. Multi-replica batched Verlet/Langevin MD with a shared writer.
+- `dataset_eval`. Streaming, prefetched scoring of models on the ANI HDF5 datasets.
+- `precision`. Float32 evaluation with selective float64 re-evaluation of unresolved points.
+- `incremental`. Cluster evaluation of fragment moves, with opt-in reuse of reference results for rigid motions.
+- `server`. Shared local inference server with per-model micro-batching and a remote ASE calculator.
+'''
@@ -0,0 +1,424 @@
+'''
+Batched multi-conformer evaluation of the deformation scans.
+
+The whole conformer stack of a scan is built first and then sent to each model
+in large batches: a species/coordinates batch for the ANI models and a disjoint
+graph batch for MACE and ORB. Any other ASE calculator falls back to one call
+per conformer, so every calculator in `calculator_list` can be used.
+'''
+
+import numpy as np
+from ase import units
+
+from . import conformers
+
+
+DEFAULT_BATCH_SIZE = 64
+
+
+#=====================#
+#       BACKENDS      #
+#=====================#
+
+def get_backend(calc):
+    '''
+    Definition
+    ----------
+    Returns the batched backend used for an ASE calculator: 'ani', 'mace', 'orb'
+    or 'ase' (no batching, one call per conformer).
+    '''
+
+    module = type(calc).__module__
+    if module.startswith('torchani'):
+        return 'ani'
+    if module.startswith('mace'):
+        return 'mace'
+    if module.startswith('orb_models'):
+        return 'orb'
+    return 'ase'
+
+
+def ani_inputs(calc, atoms):
+    '''
+    Definition
+    ----------
+    Device, dtype and species tensor of a TorchANI `.ase()` calculator, or
+    None if its model cannot be used directly. Device and dtype come from the
+    model parameters (torchani 2.2 also stored them on the calculator, 2.9
+    does not); species are atomic numbers unless an old model without
+    periodic_table_index needs `species_to_tensor`.
+    '''
+
+    import torch
+
+    model = getattr(calc, 'model', None)
+    try:
+        parameter = next(model.parameters())
+    except (AttributeError, StopIteration, TypeError):
+        return None
+    device, dtype = parameter.device, parameter.dtype
+
+    periodic_table_index = getattr(calc, 'periodic_table_index', getattr(model, 'periodic_table_index', True))
+    if periodic_table_index or not hasattr(calc, 'species_to_tensor'):
+        species = torch.as_tensor(atoms.get_atomic_numbers(), dtype=torch.long, device=device)
+    else:
+        species = calc.species_to_tensor(atoms.get_chemical_symbols()).to(device)
+    return device, dtype, species
+
+
+def _evaluate_ani(calc, atoms, positions, compute_forces, batch_size):
+    '''
+    Evaluate a TorchANI `.ase()` calculator on a (species, coordinates) batch,
+    or one conformer at a time if its model is not accessible.
+    '''
+
+    import torch
+
+    inputs = ani_inputs(calc, atoms)
+    if inputs is None:
+        return _evaluate_ase(calc, atoms, positions, compute_forces)
+    device, dtype, species = inputs
+
+    pbc = torch.tensor(atoms.get_pbc(), dtype=torch.bool, device=device)
+    cell = torch.tensor(np.array(atoms.get_cell(complete=True)), dtype=dtype, device=device)
+    pbc_enabled = bool(pbc.any().item())
+    if pbc_enabled:
+        # torchani 2.9 periodic neighbor lists are only correct for the first
+        # conformer of a batch: one conformer per model call
+        batch_size = 1
+
+    energies = np.zeros(len(positions))
+    forces = np.zeros(positions.shape) if compute_forces else None
+
+    for start in range(0, len(positions), batch_size):
+        stop = min(start + batch_size, len(positions))
+        coordinates = torch.tensor(positions[start:stop], dtype=dtype, device=device)
+        coordinates.requires_grad_(compute_forces)
+        species_batch = species.unsqueeze(0).expand(stop - start, -1)
+
+        with torch.set_grad_enabled(compute_forces):
+            if pbc_enabled:
+                energy = calc.model((species_batch, coordinates), cell=cell, pbc=pbc).energies
+            else:
+                energy = calc.model((species_batch, coordinates)).energies
+            energy = energy * units.Hartree
+
+        # conformers are independent, the gradient of the sum is the gradient of each one
+        if compute_forces:
+            grad = torch.autograd.grad(energy.sum(), coordinates)[0]
+            forces[start:stop] = -grad.detach().cpu().numpy()
+        energies[start:stop] = energy.detach().cpu().numpy()
+
+    return energies, forces
+
+
+def _mace_atomic_data(calc, atoms):
+    '''
+    Convert one conformer into a MACE `AtomicData` graph, as `MACECalculator` does.
+    '''
+
+    from mace import data
+
+    # the config API changed between mace releases
+    if hasattr(data, 'KeySpecification'):
+        keyspec = data.KeySpecification(info_keys={}, arrays_keys={'charges': calc.charges_key})
+        config = data.config_from_atoms(atoms, key_specification=keyspec, head_name=getattr(calc, 'head', None))
+    else:
+        config = data.config_from_atoms(atoms, charges_key=calc.charges_key)
+
+    kwargs = {}
+    if hasattr(calc, 'available_heads'):
+        kwargs['heads'] = calc.available_heads
+    return data.AtomicData.from_config(config, z_table=calc.z_table, cutoff=calc.r_max, **kwargs)
+
+
+def _evaluate_mace(calc, atoms, positions, compute_forces, batch_size):
+    '''
+    Evaluate a `mace_mp`/`mace_off` calculator on a disjoint graph batch.
+    '''
+
+    from mace.tools import torch_geometric
+
+    conformer = atoms.copy()
+    dataset = []
+    for pos in positions:
+        conformer.positions = pos
+        dataset.append(_mace_atomic_data(calc, conformer))
+
+    data_loader = torch_geometric.dataloader.DataLoader(dataset=dataset, batch_size=batch_size, shuffle=False, drop_last=False)
+
+    n_atoms = len(atoms)
+    energies = np.zeros(len(positions))
+    forces = np.zeros(positions.shape) if compute_forces else None
+
+    start = 0
+    for batch in data_loader:
+        batch = batch.to(calc.device)
+        stop = start + batch.num_graphs
+
+        # committee models are averaged, as in MACECalculator
+        batch_energy = np.zeros(stop - start)
+        batch_forces = np.zeros((stop - start, n_atoms, 3))
+        for model in calc.models:
+            out = model(batch.to_dict(), compute_stress=False, compute_force=compute_forces, training=False)
+            batch_energy += out['energy'].detach().cpu().numpy()
+            if compute_forces:
+                batch_forces += out['forces'].detach().cpu().numpy().reshape(-1, n_atoms, 3)
+
+        energies[start:stop] = batch_energy / len(calc.models) * calc.energy_units_to_eV
+        if compute_forces:
+            forces[start:stop] = batch_forces / len(calc.models) * calc.energy_units_to_eV / calc.length_units_to_A
+        start = stop
+
+    return energies, forces
+
+
+def _evaluate_orb(calc, atoms, positions, compute_forces, batch_size):
+    '''
+    Evaluate an `ORBCalculator` on a disjoint graph batch.
+    '''
+
+    from orb_models.forcefield.atomic_system import ase_atoms_to_atom_graphs
+    from orb_models.forcefield.base import batch_graphs
+
+    n_atoms = len(atoms)
+    energies = np.zeros(len(positions))
+    forces = np.zeros(positions.shape) if compute_forces else None
+
+    conformer = atoms.copy()
+    for start in range(0, len(positions), batch_size):
+        stop = min(start + batch_size, len(positions))
+
+        graphs = []
+        for pos in positions[start:stop]:
+            conformer.positions = pos
+            graphs.append(ase_atoms_to_atom_graphs(conformer, system_config=calc.system_config, brute_force_knn=getattr(calc, 'brute_force_knn', None), device=calc.device))
+        out = calc.model.predict(batch_graphs(graphs))
+
+        # output keys were renamed in orb_models 0.4
+        energy = out['energy'] if 'energy' in out else out['graph_pred']
+        energies[start:stop] = energy.detach().cpu().numpy().reshape(-1)
+        if compute_forces:
+            force = out['forces'] if 'forces' in out else out['node_pred']
+            forces[start:stop] = force.detach().cpu().numpy().reshape(-1, n_atoms, 3)
+
+    return energies, forces
+
+
+def _evaluate_ase(calc, atoms, positions, compute_forces):
+    '''
+    Fallback for calculators without a batched backend: one call per conformer.
+    '''
+
+    conformer = atoms.copy()
+    conformer.calc = calc
+
+    energies = np.zeros(len(positions))
+    forces = np.zeros(positions.shape) if compute_forces else None
+    for i, pos in enumerate(positions):
+        conformer.positions = pos
+        energies[i] = conformer.get_potential_energy()
+        if compute_forces:
+            forces[i] = conformer.get_forces()
+
+    return energies, forces
+
+
+_BACKENDS = {
+    'ani': _evaluate_ani,
+    'mace': _evaluate_mace,
+    'orb': _evaluate_orb,
+}
+
+
+def evaluate_batch(calc, atoms, positions, compute_forces=False, batch_size=None):
+    '''
+    Definition
+    ----------
+    Evaluates one calculator on a stack of conformers of `atoms`.
+
+    positions is a (n_points x n_atoms x 3) array. Returns the energies (n_points)
+    in eV and, if compute_forces, the forces (n_points x n_atoms x 3) in eV/Å.
+    '''
+
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+    positions = np.asarray(positions, dtype=float)
+
+    # wrappers (e.g. cache.CachedCalculator) provide their own batched evaluation
+    if hasattr(calc, 'evaluate_batch'):
+        return calc.evaluate_batch(atoms, positions, compute_forces=compute_forces, batch_size=batch_size)
+
+    backend = get_backend(calc)
+    if backend == 'ase':
+        return _evaluate_ase(calc, atoms, positions, compute_forces)
+    return _BACKENDS[backend](calc, atoms, positions, compute_forces, batch_size)
+
+
+def evaluate_conformers(atoms, positions, calculator_list, calculator_names, compute_forces=False, batch_size=None, verbose=True):
+    '''
+    Definition
+    ----------
+    Evaluates every calculator on the same conformer stack.
+
+    Returns the energies (n_models x n_points), the forces (n_models x n_points x n_atoms x 3)
+    or None, and the names of the calculators that succeeded. A failing calculator
+    is reported and skipped, as in the notebook scans.
+    '''
+
+    energies = []
+    forces = []
+    succ_calcs = []
+
+    for k, calc_ in enumerate(calculator_list):
+        try:
+            calc_energies, calc_forces = evaluate_batch(calc_, atoms, positions, compute_forces=compute_forces, batch_size=batch_size)
+            energies.append(calc_energies)
+            forces.append(calc_forces)
+            succ_calcs.append(calculator_names[k])
+
+        except Exception as error:
+            print(f'calculator {calculator_names[k]} failed: {error}')
+
+    n_points = len(positions)
+    energies = np.array(energies).reshape(len(succ_calcs), n_points)
+    forces = np.array(forces) if compute_forces else None
+
+    if verbose:
+        print(f'evaluated {n_points} conformers with {len(succ_calcs)}/{len(calculator_list)} models')
+
+    return energies, forces, succ_calcs
+
+
+#=======================#
+#       CONFORMERS      #
+#=======================#
+
+def dihedral_conformers(molecule, dihedral_ids, dihedral_list, mask=None):
+    '''
+    Definition
+    ----------
+    Builds the (n_points x n_atoms x 3) conformer stack of a dihedral scan
+    (see `conformers.dihedral_scan`). If mask is None the rotating fragment is
+    found from the bond graph. The input molecule is not modified.
+    '''
+    return conformers.dihedral_scan(molecule, dihedral_ids, dihedral_list, mask=mask)
+
+
+def bond_conformers(molecule, bond_ids, dist_list, mask=None):
+    '''
+    Definition
+    ----------
+    Builds the (n_points x n_atoms x 3) conformer stack of a bond scan, the
+    first atom fixed (see `conformers.bond_scan`). If mask is None the moving
+    fragment is found from the bond graph. The input molecule is not modified.
+    '''
+    return conformers.bond_scan(molecule, bond_ids, dist_list, mask=mask)
+
+
+def angle_conformers(molecule, atom_index_list, angle_list, mask=None):
+    '''
+    Definition
+    ----------
+    Builds the (n_points x n_atoms x 3) conformer stack of an angle scan
+    (see `conformers.angle_scan`). If mask is None the rotating fragment is
+    found from the bond graph. The input molecule is not modified.
+    '''
+    return conformers.angle_scan(molecule, atom_index_list, angle_list, mask=mask)
+
+
+#==================#
+#       SCANS      #
+#==================#
+
+def evaluate_dihedral(molecule, dihedral_ids, mask, calculator_list, calculator_names, resolution=None, compute_forces=False, batch_size=None, save_path=None):
+    '''
+    Definition
+    ----------
+    Batched version of `evaluate_dihedral` (dihedrals.ipynb).
+
+    resolution in degrees, should divide 360. Returns dihedral_list, energies
+    (n_models x n_points) and the successful calculators, plus the forces if
+    compute_forces. The conformers are written to save_path (`.npz`) if given.
+    '''
+
+    if resolution is None:
+        resolution = 10
+    points = int(360 / resolution)
+    dihedral_list = np.linspace(0., 360., points+1)
+    print(f'performing {resolution} degree dihedral scan ({len(dihedral_list)} conformers)')
+
+    if mask is None:
+        mask = conformers.dihedral_mask(molecule, dihedral_ids)
+    positions = dihedral_conformers(molecule, dihedral_ids, dihedral_list, mask=mask)
+    if save_path is not None:
+        conformers.save_scan(save_path, molecule, positions, kind='dihedral', ids=dihedral_ids, values=dihedral_list, mask=mask)
+    energies, forces, succ_calcs = evaluate_conformers(molecule, positions, calculator_list, calculator_names, compute_forces=compute_forces, batch_size=batch_size)
+
+    if compute_forces:
+        return dihedral_list, energies, succ_calcs, forces
+    return dihedral_list, energies, succ_calcs
+
+
+def evaluate_bond(molecule, bond_ids, mask, calculator_list, calculator_names, search_space=None, resolution=None, compute_forces=False, batch_size=None, save_path=None):
+    '''
+    Definition
+    ----------
+    Batched version of `evaluate_bond` (distances.ipynb).
+
+    search_space in Å [a, b]. Returns dist_list, energies (n_models x n_points)
+    and the successful calculators, plus the forces if compute_forces. The
+    conformers are written to save_path (`.npz`) if given.
+    '''
+
+    if resolution is None:
+        resolution = 100
+    if search_space is None:
+        search_space = [1.0, 6.0]
+    dist_list = np.linspace(search_space[0], search_space[1], resolution)
+    print(f'computing {molecule[bond_ids[0]].symbol}{bond_ids[0]}-{molecule[bond_ids[1]].symbol}{bond_ids[1]} PES\tscan range {search_space} Å')
+
+    if mask is None:
+        mask = conformers.bond_mask(molecule, bond_ids)
+    positions = bond_conformers(molecule, bond_ids, dist_list, mask=mask)
+    if save_path is not None:
+        conformers.save_scan(save_path, molecule, positions, kind='bond', ids=bond_ids, values=dist_list, mask=mask)
+    energies, forces, succ_calcs = evaluate_conformers(molecule, positions, calculator_list, calculator_names, compute_forces=compute_forces, batch_size=batch_size)
+
+    if compute_forces:
+        return dist_list, energies, succ_calcs, forces
+    return dist_list, energies, succ_calcs
+
+
+def evaluate_angle(molecule, atom_index_list, calculator_list, calculator_names, search_space=None, resolution=None, mask=None, compute_forces=False, batch_size=None, save_path=None):
+    '''
+    Definition
+    ----------
+    Batched version of `evaluate_angle` (angles.ipynb).
+
+    search_space in deg [a, b] around the initial angle. Returns angle_list,
+    energies (n_models x n_points) and the successful calculators, plus the
+    forces if compute_forces. The conformers are written to save_path (`.npz`)
+    if given.
+    '''
+
+    if resolution is None:
+        resolution = 50
+    if search_space is None:
+        search_space = [-5., 5.]
+
+    initial_angle = molecule.get_angle(atom_index_list[0], atom_index_list[1], atom_index_list[2])
+    bounds = np.array(search_space) + initial_angle
+    angle_list = np.linspace(bounds[0], bounds[1], resolution)
+    print(f'computing {molecule[atom_index_list[0]].symbol}-{molecule[atom_index_list[1]].symbol}-{molecule[atom_index_list[2]].symbol} PES\tscan range [{bounds[0]:.2f}, {bounds[1]:.2f}] deg')
+
+    if mask is None:
+        mask = conformers.angle_mask(molecule, atom_index_list)
+    positions = angle_conformers(molecule, atom_index_list, angle_list, mask=mask)
+    if save_path is not None:
+        conformers.save_scan(save_path, molecule, positions, kind='angle', ids=atom_index_list, values=angle_list, mask=mask)
+    energies, forces, succ_calcs = evaluate_conformers(molecule, positions, calculator_list, calculator_names, compute_forces=compute_forces, batch_size=batch_size)
+
+    if compute_forces:
+        return angle_list, energies, succ_calcs, forces
+    return angle_list, energies, succ_calcs
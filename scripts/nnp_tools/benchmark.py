@@ -0,0 +1,323 @@
+'''
+Cross-model inference benchmark over the systems of the repository.
+
+Every (model, dtype, torch threads) configuration runs in a fresh spawned
+process, so the peak RSS of a model is its own and a model that fails to load
+or to evaluate a system does not stop the suite. For each system we time
+single-point calls (energy and forces) after a warm-up and report ms/call,
+atoms/s, model load time and peak RSS. Results are written to JSON and two
+runs can be compared to flag regressions:
+
+    results = run_benchmark(dtypes=['float32', 'float64'], threads=[1, 4], output='bench_new.json')
+    print_benchmark(results)
+    compare_benchmarks('bench_old.json', 'bench_new.json')
+'''
+
+import os
+import sys
+import json
+import time
+import queue
+import platform
+import traceback
+import multiprocessing as mp
+
+import numpy as np
+from ase.build import molecule
+from ase.io import read
+
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+SYSTEM_FILES = {
+    'COSAN': 'scripts/symmetry/symmetries/cosan/cosan.xyz',
+    'ACN-27': 'models/ase_introduction/acn_27mol_300K.traj',
+    'TIP3P-27': 'models/ase_orbital/tip3p_27mol_equil.traj',
+    'NaClWater': 'models/ase_orbital/NaClWater.xyz',
+}
+
+BIPHENYL_SMILES = 'C1=CC=C(C=C1)C2=CC=CC=C2'
+
+
+#=====================#
+#       SYSTEMS       #
+#=====================#
+
+def water_supercell(n_repeat, root=None):
+    '''
+    n_repeat**3 copies of the periodic TIP3P-27 water box (synthetic periodic
+    system of growing size, exercising the periodic neighbor lists).
+    '''
+
+    if root is None:
+        root = REPO_ROOT
+    box = read(os.path.join(root, SYSTEM_FILES['TIP3P-27']), index=0)
+    # the rigid-water constraints of the MD cannot be repeated and do not matter here
+    box.set_constraint()
+    return box.repeat((n_repeat, n_repeat, n_repeat))
+
+
+def repo_systems(root=None, supercell_sizes=(2, 3)):
+    '''
+    Definition
+    ----------
+    Benchmark systems: water, ethane, biphenyl (from PubChem, skipped
+    offline), the structures stored in the repository (first frame of the
+    trajectories) and n x n x n supercells of the TIP3P-27 water box for n
+    in supercell_sizes.
+    Returns a dict name -> Atoms.
+    '''
+
+    if root is None:
+        root = REPO_ROOT
+
+    systems = {'water': molecule('H2O'), 'ethane': molecule('C2H6')}
+    try:
+        from ase.data.pubchem import pubchem_atoms_search
+        systems['biphenyl'] = pubchem_atoms_search(smiles=BIPHENYL_SMILES)
+    except Exception as error:
+        print(f'skipping biphenyl: {error}')
+
+    for name, path in SYSTEM_FILES.items():
+        path = os.path.join(root, path)
+        if not os.path.isfile(path):
+            print(f'skipping {name}: {path} not found')
+            continue
+        systems[name] = read(path, index=0)
+
+    if 'TIP3P-27' in systems:
+        for n in supercell_sizes:
+            systems[f'TIP3P-{27 * n**3}'] = water_supercell(n, root)
+    return systems
+
+
+#=====================#
+#       WORKERS       #
+#=====================#
+
+def _peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+
+def time_calls(calc, atoms, n_calls=10, warmup=2, forces=True):
+    '''
+    Definition
+    ----------
+    Times n_calls single points of calc on atoms after warmup calls. Positions
+    are shifted by 1e-6 Å every call so ASE never returns cached results.
+    Returns the per-call times (s).
+    '''
+
+    atoms = atoms.copy()
+    atoms.calc = calc
+    positions = atoms.get_positions()
+    times = []
+    for k in range(warmup + n_calls):
+        atoms.positions = positions + 1e-6 * (k % 2)
+        start = time.perf_counter()
+        atoms.get_potential_energy()
+        if forces:
+            atoms.get_forces()
+        if k >= warmup:
+            times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def _bench_worker(name, factory, dtype, n_threads, systems, n_calls, warmup, forces, result_queue):
+    from .sweep import _set_torch_threads
+
+    _set_torch_threads(n_threads)
+    rss_start = _peak_rss_mb()
+    try:
+        start = time.perf_counter()
+        calc = factory(dtype=dtype)
+        load = time.perf_counter() - start
+    except Exception:
+        result_queue.put(('error', None, traceback.format_exc()))
+        return
+    result_queue.put(('loaded', None, {'load_s': load, 'rss_model_mb': _peak_rss_mb() - rss_start}))
+
+    for system, atoms in systems.items():
+        try:
+            times = time_calls(calc, atoms, n_calls=n_calls, warmup=warmup, forces=forces)
+            result_queue.put(('system', system, {
+                'n_atoms': len(atoms),
+                'ms_per_call': 1e3 * float(np.median(times)),
+                'ms_std': 1e3 * float(np.std(times)),
+                'atoms_per_s': len(atoms) / float(np.median(times)),
+                'peak_rss_mb': _peak_rss_mb(),
+            }))
+        except Exception as error:
+            result_queue.put(('system', system, {'n_atoms': len(atoms), 'error': str(error).splitlines()[0] if str(error) else type(error).__name__}))
+
+    result_queue.put(('done', None, {'peak_rss_mb': _peak_rss_mb()}))
+
+
+def _metadata():
+    meta = {
+        'date': time.strftime('%d-%m-%Y %H:%M:%S'),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+    }
+    try:
+        import torch
+        meta['torch'] = torch.__version__
+    except ImportError:
+        pass
+    return meta
+
+
+#=======================#
+#       BENCHMARK       #
+#=======================#
+
+def run_benchmark(names=None, systems=None, dtypes=('float32',), threads=(1,), factories=None, n_calls=10, warmup=2, forces=True, timeout=3600., output=None, verbose=True):
+    '''
+    Definition
+    ----------
+    Benchmarks every model (registry names, all 7 by default) for every dtype
+    and torch thread count on every system (`repo_systems()` by default).
+
+    factories is an optional dict name -> picklable callable accepting a dtype
+    keyword (default `registry.calculator_factory(name)`). A configuration that
+    cannot be built (e.g. ORB in float64) is recorded with its error.
+    Returns a dict with 'meta' and 'results' (one row per model, dtype,
+    threads and system), also written to output as JSON if given.
+    '''
+
+    from .registry import MODEL_NAMES, calculator_factory
+
+    if names is None:
+        names = MODEL_NAMES if factories is None else list(factories)
+    if systems is None:
+        systems = repo_systems()
+    if factories is None:
+        factories = {}
+
+    ctx = mp.get_context('spawn')
+    rows = []
+    for name in names:
+        factory = factories.get(name) or calculator_factory(name)
+        for dtype in dtypes:
+            for n_threads in threads:
+                config = {'model': name, 'dtype': dtype, 'threads': n_threads}
+                result_queue = ctx.Queue()
+                process = ctx.Process(target=_bench_worker, args=(name, factory, dtype, n_threads, systems, n_calls, warmup, forces, result_queue), daemon=True)
+                process.start()
+
+                start = len(rows)
+                loaded = {}
+                deadline = time.time() + timeout
+                while True:
+                    try:
+                        kind, system, payload = result_queue.get(timeout=1.)
+                    except queue.Empty:
+                        if not process.is_alive() or time.time() > deadline:
+                            rows.append({**config, 'system': None, 'error': 'worker died or timed out'})
+                            break
+                        continue
+                    if kind == 'error':
+                        rows.append({**config, 'system': None, 'error': payload.strip().splitlines()[-1]})
+                        break
+                    if kind == 'loaded':
+                        loaded = payload
+                    elif kind == 'system':
+                        rows.append({**config, 'system': system, **loaded, **payload})
+                        if verbose:
+                            print(_format_row(rows[-1]))
+                    else:
+                        break
+
+                process.join(timeout=5.)
+                if process.is_alive():
+                    process.terminate()
+                failed = [row for row in rows[start:] if row.get('system') is None]
+                if verbose and len(failed) > 0:
+                    print(f'{name} {dtype} {n_threads} threads failed: {failed[0]["error"]}')
+
+    results = {'meta': _metadata(), 'results': rows}
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def _load(results):
+    if isinstance(results, str):
+        with open(results) as f:
+            return json.load(f)
+    return results
+
+
+def _format_row(row, speedup=None):
+    line = f'{row["model"]:<12}{row["dtype"]:>9}{row["threads"]:>4}  {str(row["system"]):<14}{row.get("n_atoms", 0):>6}'
+    if 'error' in row:
+        return line + f'  failed: {row["error"]}'
+    line += f'{row["ms_per_call"]:>11.2f}{row["atoms_per_s"]:>12.0f}{row["peak_rss_mb"]:>10.0f}{row["load_s"]:>9.2f}'
+    if speedup is not None:
+        line += f'{speedup:>9.2f}'
+    return line
+
+
+def print_benchmark(results):
+    '''
+    Summary table; speedup is relative to the fewest threads of the same model, dtype and system.
+    '''
+
+    rows = _load(results)['results']
+    base = {}
+    for row in rows:
+        if 'error' in row:
+            continue
+        key = (row['model'], row['dtype'], row['system'])
+        if key not in base or row['threads'] < base[key]['threads']:
+            base[key] = row
+
+    print(f'{"model":<12}{"dtype":>9}{"thr":>4}  {"system":<14}{"atoms":>6}{"ms/call":>11}{"atoms/s":>12}{"RSS (MB)":>10}{"load (s)":>9}{"speedup":>9}')
+    for row in rows:
+        speedup = None
+        if 'error' not in row:
+            speedup = base[(row['model'], row['dtype'], row['system'])]['ms_per_call'] / row['ms_per_call']
+        print(_format_row(row, speedup))
+
+
+def compare_benchmarks(old, new, threshold=0.1, verbose=True):
+    '''
+    Definition
+    ----------
+    Compares two benchmark results (dicts or JSON paths). A configuration is
+    flagged when its ms/call or peak RSS grew by more than threshold (relative),
+    or when it ran before and fails now. Returns the list of regressions.
+    '''
+
+    def index(results):
+        return {(r['model'], r['dtype'], r['threads'], r['system']): r for r in _load(results)['results']}
+
+    old, new = index(old), index(new)
+    regressions = []
+    for key, row in new.items():
+        if key not in old or 'error' in old[key]:
+            continue
+        before = old[key]
+        if 'error' in row:
+            regressions.append({'config': key, 'metric': 'error', 'old': None, 'new': row['error']})
+            continue
+        for metric in ['ms_per_call', 'peak_rss_mb']:
+            change = row[metric] / before[metric] - 1.
+            if change > threshold:
+                regressions.append({'config': key, 'metric': metric, 'old': before[metric], 'new': row[metric], 'change': change})
+
+    if verbose:
+        print(f'{len(regressions)} regressions (threshold {100*threshold:.0f}%)')
+        for r in regressions:
+            model, dtype, n_threads, system = r['config']
+            if r['metric'] == 'error':
+                print(f'  {model} {dtype} {n_threads} threads {system}: now fails ({r["new"]})')
+            else:
+                print(f'  {model} {dtype} {n_threads} threads {system}: {r["metric"]} {r["old"]:.2f} -> {r["new"]:.2f} (+{100*r["change"]:.0f}%)')
+    return regressions
@@ -0,0 +1,330 @@
+'''
+Persistent, content-addressed energy/force cache for ASE calculators.
+
+`CachedCalculator` wraps any ASE calculator (ANI `.ase()`, `mace_mp`/`mace_off`,
+`ORBCalculator`, ...) and stores its results in a single SQLite file. The key is
+a hash of the model id and dtype, the atomic numbers, the rounded positions and
+the cell/pbc, so identical geometries are never recomputed, even across notebooks
+and kernel restarts. The file is bounded in size with least-recently-used eviction.
+'''
+
+import os
+import time
+import sqlite3
+import hashlib
+
+import numpy as np
+from ase.calculators.calculator import Calculator, all_changes
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'nnp_tools', 'calculator_cache.sqlite')
+DEFAULT_MAX_SIZE = 2**30    # 1 GB
+DEFAULT_DECIMALS = 8        # positions are rounded to 1e-8 Å
+EVICT_TARGET = 0.9          # eviction frees down to EVICT_TARGET * max_size
+ACCESS_FLUSH = 256          # pending LRU timestamps written at the latest every ACCESS_FLUSH hits
+
+
+def model_dtype(calc):
+    '''
+    Definition
+    ----------
+    Returns the floating point precision of the torch model behind an ASE
+    calculator ('float32', 'float64'), or 'unknown' if it cannot be found.
+    '''
+
+    dtype = getattr(calc, 'dtype', None)
+    if dtype is None:
+        for attr in ('model', 'models'):
+            model = getattr(calc, attr, None)
+            if isinstance(model, (list, tuple)) and len(model) > 0:
+                model = model[0]
+            try:
+                dtype = next(model.parameters()).dtype
+                break
+            except (AttributeError, StopIteration, TypeError):
+                continue
+
+    if dtype is None:
+        return 'unknown'
+    return str(dtype).replace('torch.', '')
+
+
+def geometry_key(model_id, atoms, decimals=DEFAULT_DECIMALS):
+    '''
+    Definition
+    ----------
+    Content hash of (model id + dtype, atomic numbers, rounded positions, cell, pbc).
+    '''
+
+    # adding 0. turns -0. into 0. so both round to the same bytes
+    positions = np.round(np.asarray(atoms.get_positions(), dtype=np.float64), decimals) + 0.
+    cell = np.round(np.asarray(atoms.get_cell(), dtype=np.float64), decimals) + 0.
+
+    sha = hashlib.sha256()
+    sha.update(model_id.encode())
+    sha.update(np.asarray(atoms.get_atomic_numbers(), dtype=np.int64).tobytes())
+    sha.update(positions.tobytes())
+    sha.update(cell.tobytes())
+    sha.update(np.asarray(atoms.get_pbc(), dtype=bool).tobytes())
+    return sha.hexdigest()
+
+
+class CalculatorCache:
+    '''
+    Definition
+    ----------
+    SQLite store of energies and forces indexed by `geometry_key`.
+
+    max_size bounds the stored bytes; when exceeded the least recently used
+    entries are evicted. hits, misses and evictions are counted per session.
+
+    Lookups stay off the disk: hits only queue their access time, written with
+    the next commit (a put, an eviction, stats or close), and the stored size
+    is a running total, recomputed from the file only before evicting (other
+    kernels may have written to it). Eviction frees down to 90% of max_size.
+    '''
+
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+
+        if path is None:
+            path = DEFAULT_CACHE_PATH
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # WAL keeps the commits cheap and lets several kernels share the file
+        self._db = sqlite3.connect(path, timeout=60)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            energy REAL NOT NULL,
+            forces BLOB,
+            n_atoms INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            last_access REAL NOT NULL)''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_access ON results (last_access)')
+        self._db.commit()
+
+        self._size = self.size()
+        self._pending_access = {}
+
+    def get(self, key, forces=False):
+        '''
+        Returns (energy, forces) for a key or None on a miss. When forces are
+        requested an entry stored without forces counts as a miss.
+        '''
+
+        row = self._db.execute('SELECT energy, forces, n_atoms FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None or (forces and row[1] is None):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._pending_access[key] = time.time()
+        if len(self._pending_access) >= ACCESS_FLUSH:
+            self.flush()
+
+        energy, forces_blob, n_atoms = row
+        if forces_blob is not None:
+            forces_blob = np.frombuffer(forces_blob, dtype=np.float64).reshape(n_atoms, 3).copy()
+        return energy, forces_blob
+
+    def _write_access(self):
+        if self._pending_access:
+            self._db.executemany('UPDATE results SET last_access = ? WHERE key = ?', [(t, k) for k, t in self._pending_access.items()])
+            self._pending_access = {}
+
+    def flush(self):
+        '''
+        Write the pending access times.
+        '''
+        self._write_access()
+        self._db.commit()
+
+    def _insert(self, key, energy, forces, n_atoms):
+        forces_blob = None
+        if forces is not None:
+            forces = np.ascontiguousarray(forces, dtype=np.float64)
+            n_atoms = len(forces)
+            forces_blob = forces.tobytes()
+        size = len(key) + 8 + (len(forces_blob) if forces_blob is not None else 0)
+
+        old = self._db.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+        self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                         (key, float(energy), forces_blob, n_atoms, size, time.time()))
+        self._pending_access.pop(key, None)
+        self._size += size - (old[0] if old is not None else 0)
+
+    def put(self, key, energy, forces=None, n_atoms=0):
+        '''
+        Store a result and evict old entries if the cache grew past max_size.
+        '''
+        self.put_many([(key, energy, forces, n_atoms)])
+
+    def put_many(self, entries):
+        '''
+        Store (key, energy, forces, n_atoms) entries in one transaction.
+        '''
+
+        for key, energy, forces, n_atoms in entries:
+            self._insert(key, energy, forces, n_atoms)
+        self._write_access()
+        self._db.commit()
+        if self._size > self.max_size:
+            self._evict()
+
+    def size(self):
+        '''
+        Stored bytes (payload only, without SQLite overhead).
+        '''
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def _evict(self):
+
+        self.flush()
+        self._size = self.size()
+        if self._size <= self.max_size:
+            return
+        excess = self._size - EVICT_TARGET * self.max_size
+
+        # drop the least recently used entries until we are back under the limit,
+        # with some room so that a full cache does not evict on every put
+        freed = 0
+        doomed = []
+        for key, size in self._db.execute('SELECT key, size FROM results ORDER BY last_access ASC'):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._db.executemany('DELETE FROM results WHERE key = ?', doomed)
+        self._db.commit()
+        self.evictions += len(doomed)
+        self._size -= freed
+
+    def clear(self):
+        self._pending_access = {}
+        self._db.execute('DELETE FROM results')
+        self._db.commit()
+        self._size = 0
+
+    def stats(self):
+        '''
+        Hit/miss statistics of the current session.
+        '''
+        self.flush()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.,
+            'evictions': self.evictions,
+            'entries': len(self),
+            'size': self.size(),
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f'cache {self.path}')
+        print(f'hits {s["hits"]}\tmisses {s["misses"]}\thit rate {100*s["hit_rate"]:.1f}%')
+        print(f'entries {s["entries"]}\tsize {s["size"]/2**20:.2f} MB\tevictions {s["evictions"]}')
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+
+class CachedCalculator(Calculator):
+    '''
+    Definition
+    ----------
+    ASE calculator that answers from a `CalculatorCache` and only calls the
+    wrapped calculator on a miss.
+
+    model_id should identify the model (e.g. the `calculator_names` entry,
+    'MACE-OFF'); the dtype of the model is appended automatically.
+    Several CachedCalculators can share one `CalculatorCache`.
+
+        maceoff_cached = CachedCalculator(maceoff, 'MACE-OFF')
+        molecule.calc = maceoff_cached
+    '''
+
+    implemented_properties = ['energy', 'free_energy', 'forces']
+
+    def __init__(self, calc, model_id, cache=None, decimals=DEFAULT_DECIMALS, **kwargs):
+        Calculator.__init__(self, **kwargs)
+
+        if cache is None:
+            cache = CalculatorCache()
+
+        self.calc = calc
+        self.model_id = f'{model_id}:{model_dtype(calc)}'
+        self.cache = cache
+        self.decimals = decimals
+
+    def calculate(self, atoms=None, properties=['energy'], system_changes=all_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+
+        need_forces = 'forces' in properties
+        key = geometry_key(self.model_id, self.atoms, self.decimals)
+        cached = self.cache.get(key, forces=need_forces)
+
+        if cached is None:
+            atoms_ = self.atoms.copy()
+            atoms_.calc = self.calc
+            energy = atoms_.get_potential_energy()
+            forces = atoms_.get_forces() if need_forces else None
+            self.cache.put(key, energy, forces, n_atoms=len(atoms_))
+        else:
+            energy, forces = cached
+
+        self.results['energy'] = energy
+        self.results['free_energy'] = energy
+        if forces is not None:
+            self.results['forces'] = forces
+
+    def evaluate_batch(self, atoms, positions, compute_forces=False, batch_size=None):
+        '''
+        Cached counterpart of `batch_scan.evaluate_batch`: conformers found in
+        the cache are not recomputed, the rest are sent in batches to the wrapped model.
+        '''
+
+        from .batch_scan import evaluate_batch
+
+        positions = np.asarray(positions, dtype=float)
+        energies = np.zeros(len(positions))
+        forces = np.zeros(positions.shape) if compute_forces else None
+
+        conformer = atoms.copy()
+        keys = []
+        missing = []
+        for i, pos in enumerate(positions):
+            conformer.positions = pos
+            keys.append(geometry_key(self.model_id, conformer, self.decimals))
+            cached = self.cache.get(keys[i], forces=compute_forces)
+            if cached is None:
+                missing.append(i)
+            else:
+                energies[i] = cached[0]
+                if compute_forces:
+                    forces[i] = cached[1]
+
+        if len(missing) > 0:
+            new_energies, new_forces = evaluate_batch(self.calc, atoms, positions[missing], compute_forces=compute_forces, batch_size=batch_size)
+            entries = []
+            for j, i in enumerate(missing):
+                energies[i] = new_energies[j]
+                if compute_forces:
+                    forces[i] = new_forces[j]
+                entries.append((keys[i], new_energies[j], new_forces[j] if compute_forces else None, len(atoms)))
+            self.cache.put_many(entries)
+
+        return energies, forces
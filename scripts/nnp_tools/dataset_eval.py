@@ -0,0 +1,273 @@
+'''
+Streaming evaluation of pretrained models on the ANI HDF5 datasets.
+
+The notebooks only read `ani_gdb_s01.h5`, `ani_gdb_s02.h5` and `ani-1x/sample.h5`
+through `torchani.data.load(...)`, which shuffles the whole dataset in memory.
+Here conformers are streamed molecule by molecule in chunks of at most
+chunk_size, read by prefetch threads into a bounded queue (disk reads overlap
+with model compute, memory is bounded by prefetch x chunk_size whatever the
+dataset size). Every chunk is evaluated by all models with
+`batch_scan.evaluate_batch` and the errors against the reference energies
+(and forces, when the file has them) are accumulated per molecule as running
+sums. h5py is only needed by this module.
+
+    stats = score_dataset(['ani_gdb_s01.h5', 'ani_gdb_s02.h5'], calculator_list, calculator_names, output='gdb_s02_errors.csv')
+    print_scores(stats)
+
+Reference energies are in Hartree and forces in Hartree/Å; all errors are
+reported in eV and eV/Å. Besides the absolute energy error, the error of the
+relative (conformational) energies is given, with the mean offset of each
+molecule removed, as models trained on another level of theory (MACE-MP, ORB)
+have a different energy zero.
+'''
+
+import os
+import queue
+import threading
+
+import numpy as np
+from ase import Atoms
+from ase.units import Hartree
+
+from .batch_scan import evaluate_batch
+
+
+DEFAULT_CHUNK_SIZE = 256
+
+
+#=====================#
+#       READING       #
+#=====================#
+
+def _h5py():
+    try:
+        import h5py
+    except ImportError as error:
+        raise ImportError('reading the ANI datasets needs h5py (pip install h5py)') from error
+    return h5py
+
+
+def list_molecules(paths, include_he=False):
+    '''
+    Definition
+    ----------
+    Molecule groups of one or several ANI HDF5 files (any group holding
+    `coordinates`, `energies` and `species`), read from metadata only.
+    Returns a list of (path, group, suffix, n_conformers, n_atoms); with
+    include_he, the high energy conformers of the GDB files (`coordinatesHE`)
+    are listed too, with suffix 'HE'.
+    '''
+
+    h5py = _h5py()
+    if isinstance(paths, str):
+        paths = [paths]
+
+    molecules = []
+    for path in paths:
+        with h5py.File(path, 'r') as f:
+            def visit(name, obj):
+                if isinstance(obj, h5py.Group) and 'coordinates' in obj and 'energies' in obj and 'species' in obj:
+                    n_conf, n_atoms = obj['coordinates'].shape[:2]
+                    molecules.append((path, name, '', n_conf, n_atoms))
+                    if include_he and 'coordinatesHE' in obj and obj['coordinatesHE'].shape[0] > 0:
+                        molecules.append((path, name, 'HE', obj['coordinatesHE'].shape[0], n_atoms))
+            f.visititems(visit)
+    return molecules
+
+
+def _chunk_tasks(molecules, chunk_size, max_conformers):
+    tasks = []
+    for path, group, suffix, n_conf, _ in molecules:
+        if max_conformers is not None:
+            n_conf = min(n_conf, max_conformers)
+        for start in range(0, n_conf, chunk_size):
+            tasks.append((path, group, suffix, start, min(start + chunk_size, n_conf)))
+    return tasks
+
+
+def _reader(tasks, chunks, stop):
+    '''
+    Prefetch thread: reads its chunks (with its own file handles) into the bounded queue.
+    '''
+
+    h5py = _h5py()
+    files = {}
+    try:
+        for path, group, suffix, start, end in tasks:
+            if stop.is_set():
+                break
+            if path not in files:
+                files[path] = h5py.File(path, 'r')
+            g = files[path][group]
+            species = [s.decode() if isinstance(s, bytes) else str(s) for s in g['species'][()]]
+            chunk = {
+                'molecule': f'{os.path.basename(path)}:{group}{suffix}',
+                'species': species,
+                'coordinates': np.asarray(g['coordinates' + suffix][start:end], dtype=np.float64),
+                'energies': np.asarray(g['energies' + suffix][start:end], dtype=np.float64) * Hartree,
+                'forces': None,
+            }
+            if suffix == '' and 'forces' in g:
+                chunk['forces'] = np.asarray(g['forces'][start:end], dtype=np.float64) * Hartree
+            chunks.put(chunk)
+    except Exception as error:
+        chunks.put({'error': f'{path}:{group}: {error}'})
+    finally:
+        for f in files.values():
+            f.close()
+        chunks.put(None)
+
+
+def stream_chunks(paths, chunk_size=DEFAULT_CHUNK_SIZE, n_workers=2, prefetch=4, include_he=False, max_conformers=None):
+    '''
+    Definition
+    ----------
+    Yields chunks (dict with molecule, species, coordinates, energies in eV
+    and forces in eV/Å or None) read by n_workers prefetch threads. At most
+    prefetch chunks wait in memory. Chunks of different molecules may
+    interleave; max_conformers limits the conformers read per molecule.
+    '''
+
+    molecules = list_molecules(paths, include_he=include_he)
+    tasks = _chunk_tasks(molecules, chunk_size, max_conformers)
+
+    chunks = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    n_workers = max(1, min(n_workers, len(tasks)))
+    readers = [threading.Thread(target=_reader, args=(tasks[k::n_workers], chunks, stop), daemon=True) for k in range(n_workers)]
+    for reader in readers:
+        reader.start()
+
+    finished = 0
+    try:
+        while finished < n_workers:
+            chunk = chunks.get()
+            if chunk is None:
+                finished += 1
+            elif 'error' in chunk:
+                print(f'could not read {chunk["error"]}')
+            else:
+                yield chunk
+    finally:
+        stop.set()
+        # unblock readers waiting on a full queue
+        while any(reader.is_alive() for reader in readers):
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+#=====================#
+#       SCORING       #
+#=====================#
+
+def _empty_stats(n_atoms):
+    return {'n_atoms': n_atoms, 'n': 0, 'sum_de': 0., 'sum_de2': 0., 'sum_abs_de': 0., 'n_f': 0, 'sum_df2': 0., 'sum_abs_df': 0., 'error': None}
+
+
+def _accumulate(stats, de, df):
+    stats['n'] += len(de)
+    stats['sum_de'] += de.sum()
+    stats['sum_de2'] += (de**2).sum()
+    stats['sum_abs_de'] += np.abs(de).sum()
+    if df is not None:
+        stats['n_f'] += df.size
+        stats['sum_df2'] += (df**2).sum()
+        stats['sum_abs_df'] += np.abs(df).sum()
+
+
+def finalize(stats):
+    '''
+    Error metrics (eV, eV/Å) of accumulated running sums.
+    '''
+
+    n = stats['n']
+    out = {'n_conformers': n, 'n_atoms': stats['n_atoms'], 'error': stats['error']}
+    if n == 0:
+        return out
+    mean = stats['sum_de'] / n
+    out['energy_mae'] = stats['sum_abs_de'] / n
+    out['energy_rmse'] = np.sqrt(stats['sum_de2'] / n)
+    out['energy_offset'] = mean
+    out['relative_energy_rmse'] = np.sqrt(max(stats['sum_de2'] / n - mean**2, 0.))
+    if stats['n_f'] > 0:
+        out['force_mae'] = stats['sum_abs_df'] / stats['n_f']
+        out['force_rmse'] = np.sqrt(stats['sum_df2'] / stats['n_f'])
+    return out
+
+
+def score_dataset(paths, calculator_list, calculator_names, chunk_size=DEFAULT_CHUNK_SIZE, n_workers=2, prefetch=4, compute_forces=True, batch_size=None, include_he=False, max_conformers=None, output=None, verbose=True):
+    '''
+    Definition
+    ----------
+    Scores every calculator against the reference energies (and forces) of
+    one or several ANI HDF5 files in a single streaming pass. A model that
+    fails on a molecule (e.g. unsupported element) is recorded for that
+    molecule and keeps going on the others.
+
+    Returns a dict model -> molecule -> metrics (see `finalize`), also written
+    as CSV to output if given.
+    '''
+
+    stats = {name: {} for name in calculator_names}
+    n_chunks = 0
+    for chunk in stream_chunks(paths, chunk_size=chunk_size, n_workers=n_workers, prefetch=prefetch, include_he=include_he, max_conformers=max_conformers):
+        molecule = chunk['molecule']
+        atoms = Atoms(symbols=chunk['species'])
+        forces_ref = chunk['forces'] if compute_forces else None
+
+        for calc_, name in zip(calculator_list, calculator_names):
+            entry = stats[name].setdefault(molecule, _empty_stats(len(atoms)))
+            if entry['error'] is not None:
+                continue
+            try:
+                energies, forces = evaluate_batch(calc_, atoms, chunk['coordinates'], compute_forces=forces_ref is not None, batch_size=batch_size)
+            except Exception as error:
+                entry['error'] = str(error).splitlines()[0] if str(error) else type(error).__name__
+                continue
+            _accumulate(entry, energies - chunk['energies'], None if forces_ref is None else forces - forces_ref)
+
+        n_chunks += 1
+        if verbose and n_chunks % 50 == 0:
+            print(f'{n_chunks} chunks evaluated')
+
+    results = {name: {molecule: finalize(entry) for molecule, entry in molecules.items()} for name, molecules in stats.items()}
+    if output is not None:
+        write_scores(output, results)
+    return results
+
+
+def write_scores(path, results):
+    '''
+    One CSV row per model and molecule.
+    '''
+
+    columns = ['n_conformers', 'n_atoms', 'energy_mae', 'energy_rmse', 'energy_offset', 'relative_energy_rmse', 'force_mae', 'force_rmse']
+    with open(path, 'w') as f:
+        f.write('model,molecule,' + ','.join(columns) + ',error\n')
+        for name, molecules in results.items():
+            for molecule, metrics in molecules.items():
+                values = ['' if metrics.get(c) is None else f'{metrics[c]:.6g}' for c in columns]
+                error = (metrics['error'] or '').replace(',', ';')
+                f.write(f'{name},{molecule},' + ','.join(values) + f',{error}\n')
+
+
+def print_scores(results):
+    '''
+    Conformer-weighted summary per model over all molecules it could evaluate.
+    '''
+
+    print(f'{"model":<12}{"molecules":>10}{"failed":>8}{"conformers":>12}{"E MAE (eV)":>12}{"rel. E RMSE":>13}{"F MAE (eV/Å)":>14}')
+    for name, molecules in results.items():
+        ok = [m for m in molecules.values() if m['error'] is None and m['n_conformers'] > 0]
+        failed = len(molecules) - len(ok)
+        n = sum(m['n_conformers'] for m in ok)
+        if n == 0:
+            print(f'{name:<12}{0:>10}{failed:>8}{0:>12}')
+            continue
+        e_mae = sum(m['energy_mae'] * m['n_conformers'] for m in ok) / n
+        rel = np.sqrt(sum(m['relative_energy_rmse']**2 * m['n_conformers'] for m in ok) / n)
+        with_forces = [m for m in ok if 'force_mae' in m]
+        f_mae = f'{sum(m["force_mae"] * m["n_conformers"] * m["n_atoms"] for m in with_forces) / sum(m["n_conformers"] * m["n_atoms"] for m in with_forces):>14.4f}' if with_forces else f'{"-":>14}'
+        print(f'{name:<12}{len(ok):>10}{failed:>8}{n:>12}{e_mae:>12.4f}{rel:>13.4f}{f_mae}')
@@ -0,0 +1,296 @@
+'''
+Gaussian job generation and execution for conformer sets.
+
+Replaces symmetry/symmetries/cosan_scan/cosan_job_gen.sh. Instead of editing
+every `.gjf` in place with `sed` and running all rotamers one after another
+in a single Slurm job, every conformer becomes an independent task:
+
+- the `.gjf` inputs are written directly (same layout as the COSAN-scan inputs);
+- tasks are packed by estimated cost into balanced bins, which become the
+  elements of a Slurm array job or are run by concurrent local workers;
+- the status of every task is tracked in `tasks.json`, and a task whose log
+  ends in normal termination is never run again.
+
+The local backend runs any external command as `command < task.gjf > task.log`,
+so a fake `g16` (e.g. a script writing a stub log) can be used for testing.
+
+    jobs = create_jobs('COSAN-scan', molecule, positions, name='COSAN', charge=-1)
+    run_local('COSAN-scan', n_workers=4, command='g16')
+    write_slurm_array('COSAN-scan', n_array=8)
+    status_report('COSAN-scan')
+'''
+
+import os
+import glob
+import json
+import time
+import shlex
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+TASKS_FILE = 'tasks.json'
+STATUSES = ['pending', 'running', 'done', 'failed']
+
+
+#=========================#
+#       INPUT FILES       #
+#=========================#
+
+def write_gjf(path, atoms, title, charge=0, multiplicity=1, method='wb97x/6-31g(d)', nprocshared=16, mem='2GB', chk=None):
+    '''
+    Definition
+    ----------
+    Writes a Gaussian input with the link 0 section, route, title,
+    charge/multiplicity and cartesian coordinates, as cosan_job_gen.sh produced.
+    '''
+
+    with open(path, 'w') as file:
+        file.write(f'%nprocshared={nprocshared}\n')
+        file.write(f'%mem={mem}\n')
+        if chk is not None:
+            file.write(f'%chk={chk}\n')
+        file.write(f'# {method}\n\n')
+        file.write(f'{title}\n\n')
+        file.write(f' {charge}   {multiplicity}\n')
+        for symbol, (x, y, z) in zip(atoms.get_chemical_symbols(), atoms.positions):
+            file.write(f'{symbol:<2}{x:>28.10f}{y:>20.10f}{z:>20.10f}\n')
+        file.write('\n')
+
+
+def estimate_cost(atoms, charge=0):
+    '''
+    Relative cost of a DFT calculation: cube of the number of electrons.
+    '''
+    n_electrons = int(atoms.get_atomic_numbers().sum()) - charge
+    return float(n_electrons)**3
+
+
+def pack_tasks(costs, n_bins):
+    '''
+    Definition
+    ----------
+    Splits tasks into n_bins with balanced total cost (longest task first,
+    always into the least loaded bin). Returns a list of task index lists.
+    '''
+
+    bins = [[] for _ in range(n_bins)]
+    loads = np.zeros(n_bins)
+    for i in np.argsort(costs)[::-1]:
+        k = int(np.argmin(loads))
+        bins[k].append(int(i))
+        loads[k] += costs[i]
+    return [b for b in bins if len(b) > 0]
+
+
+#===================#
+#       TASKS       #
+#===================#
+
+def _tasks_path(job_dir):
+    return os.path.join(job_dir, TASKS_FILE)
+
+
+def load_tasks(job_dir):
+    with open(_tasks_path(job_dir)) as f:
+        return json.load(f)
+
+
+def _save_tasks(job_dir, tasks):
+    # write then rename, so an interrupted run never leaves a broken file
+    path = _tasks_path(job_dir)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(tasks, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def log_finished(path):
+    '''
+    True if a Gaussian log ends in normal termination (only the tail is read).
+    '''
+
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 4096))
+        return b'Normal termination' in f.read()
+
+
+def create_jobs(job_dir, atoms, positions, name='COSAN', charge=0, multiplicity=1, method='wb97x/6-31g(d)', nprocshared=16, mem='2GB', chk_dir=None, prefix=None, cost=estimate_cost):
+    '''
+    Definition
+    ----------
+    Writes one `.gjf` per conformer (positions is n_points x n_atoms x 3, e.g.
+    from a scan) into job_dir and registers the tasks in `tasks.json`.
+    Existing tasks keep their status, so calling it again is harmless.
+    chk_dir is the directory of the `.chk` files on the machine running the jobs.
+    '''
+
+    if not os.path.isdir(job_dir):
+        os.makedirs(job_dir)
+    if prefix is None:
+        prefix = f'{name.lower()}_conf'
+
+    tasks = load_tasks(job_dir) if os.path.isfile(_tasks_path(job_dir)) else {}
+    conformer = atoms.copy()
+    n_points = len(positions)
+    for i, pos in enumerate(positions):
+        task = f'{prefix}_{i}'
+        if task in tasks:
+            continue
+        conformer.positions = pos
+        chk = None if chk_dir is None else os.path.join(chk_dir, f'{name}_{i}.chk')
+        write_gjf(os.path.join(job_dir, f'{task}.gjf'), conformer, f'{name} rotatamer scan {i} out of {n_points - 1}',
+                  charge=charge, multiplicity=multiplicity, method=method, nprocshared=nprocshared, mem=mem, chk=chk)
+        tasks[task] = {'status': 'pending', 'cost': cost(conformer, charge), 'attempts': 0, 'elapsed': None}
+
+    _save_tasks(job_dir, tasks)
+    return tasks
+
+
+def refresh_status(job_dir):
+    '''
+    Marks as done every task whose log finished normally (e.g. logs copied
+    back from the cluster) and resets stale 'running' tasks to pending.
+    '''
+
+    tasks = load_tasks(job_dir)
+    for task, entry in tasks.items():
+        if log_finished(os.path.join(job_dir, f'{task}.log')):
+            entry['status'] = 'done'
+        elif entry['status'] == 'running':
+            entry['status'] = 'pending'
+    _save_tasks(job_dir, tasks)
+    return tasks
+
+
+#=====================#
+#       BACKENDS      #
+#=====================#
+
+def run_local(job_dir, n_workers=4, command='g16', retry_failed=False, env=None, verbose=True):
+    '''
+    Definition
+    ----------
+    Runs the pending tasks with n_workers concurrent processes, most expensive
+    first, as `command < task.gjf > task.log`. command is a string or a list
+    (any program reading the input from stdin, e.g. a fake g16). Statuses are
+    written after every task; tasks already done are skipped. Returns the tasks.
+    '''
+
+    if isinstance(command, str):
+        command = shlex.split(command)
+
+    tasks = refresh_status(job_dir)
+    todo = [t for t, e in tasks.items() if e['status'] == 'pending' or (retry_failed and e['status'] == 'failed')]
+    todo.sort(key=lambda t: tasks[t]['cost'], reverse=True)
+    lock = threading.Lock()
+
+    def set_status(task, **entry):
+        with lock:
+            tasks[task].update(entry)
+            _save_tasks(job_dir, tasks)
+
+    def run(task):
+        gjf = os.path.join(job_dir, f'{task}.gjf')
+        log = os.path.join(job_dir, f'{task}.log')
+        set_status(task, status='running', attempts=tasks[task]['attempts'] + 1)
+        start = time.perf_counter()
+        try:
+            with open(gjf) as stdin, open(log, 'w') as stdout:
+                returncode = subprocess.run(command, stdin=stdin, stdout=stdout, stderr=subprocess.STDOUT, cwd=job_dir, env=env).returncode
+        except OSError as error:
+            returncode = str(error)
+        elapsed = time.perf_counter() - start
+        status = 'done' if returncode == 0 and log_finished(log) else 'failed'
+        set_status(task, status=status, elapsed=elapsed)
+        if verbose:
+            print(f'{task}: {status} ({elapsed:.1f} s)' + ('' if status == 'done' else f', return code {returncode}'))
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(run, todo))
+
+    return tasks
+
+
+_SLURM_TEMPLATE = '''#!/bin/bash
+#SBATCH -J {name}-scan
+#SBATCH -e {remote_dir}/{name}-scan.%A_%a.err
+#SBATCH -o {remote_dir}/{name}-scan.%A_%a.out
+#SBATCH -p {partition}
+#SBATCH -n 1
+#SBATCH -c {cpus}
+#SBATCH -t {time}
+#SBATCH --array=0-{last}
+# script generated automatically by nnp_tools.gaussian_jobs
+# {name} scan, one array element per bin of tasks
+
+ml {module}
+
+export GAUSS_SCRDIR=$SLURM_SUBMIT_DIR
+cd {remote_dir}
+
+for TASK in $(cat bin_$SLURM_ARRAY_TASK_ID.txt); do
+    # finished tasks are never recomputed
+    if [ -f $TASK.log ] && tail -c 4096 $TASK.log | grep -q "Normal termination"; then
+        continue
+    fi
+    printf "$TASK start: `date`\\n"
+    srun g16 < $TASK.gjf > $TASK.log
+    printf "$TASK finish: `date`\\n"
+done
+'''
+
+
+def write_slurm_array(job_dir, n_array, name='COSAN', remote_dir=None, partition='normal', cpus=16, walltime='4-02:00', module='Gaussian/16.C.02-AVX2'):
+    '''
+    Definition
+    ----------
+    Packs the unfinished tasks into n_array bins of similar cost and writes one
+    `bin_<k>.txt` task list per bin plus a Slurm array script running them.
+    remote_dir is where job_dir is copied on the cluster. Returns the script
+    path, or None (no script written) when every task is already done.
+    '''
+
+    if remote_dir is None:
+        remote_dir = f'/home/sortiz/{name}-scan'
+
+    tasks = refresh_status(job_dir)
+    todo = [t for t, e in tasks.items() if e['status'] != 'done']
+    for old in glob.glob(os.path.join(job_dir, 'bin_*.txt')):
+        os.remove(old)
+    if len(todo) == 0:
+        print(f'all {len(tasks)} tasks of {job_dir} are done, no array job written')
+        return None
+
+    # no empty bins
+    bins = pack_tasks([tasks[t]['cost'] for t in todo], min(n_array, len(todo)))
+    for k, b in enumerate(bins):
+        with open(os.path.join(job_dir, f'bin_{k}.txt'), 'w') as f:
+            f.write('\n'.join(todo[i] for i in b) + '\n')
+
+    path = os.path.join(job_dir, f'job_{name}.slm')
+    with open(path, 'w') as f:
+        f.write(_SLURM_TEMPLATE.format(name=name, remote_dir=remote_dir, partition=partition, cpus=cpus, time=walltime, last=len(bins) - 1, module=module))
+    os.chmod(path, 0o755)
+    return path
+
+
+def status_report(job_dir):
+    '''
+    Print the number of tasks per status and the time spent on the finished ones.
+    '''
+
+    tasks = load_tasks(job_dir)
+    counts = {status: 0 for status in STATUSES}
+    for entry in tasks.values():
+        counts[entry['status']] += 1
+    elapsed = [e['elapsed'] for e in tasks.values() if e['status'] == 'done' and e['elapsed'] is not None]
+    print(f'{len(tasks)} tasks: ' + ', '.join(f'{n} {status}' for status, n in counts.items()))
+    if len(elapsed) > 0:
+        print(f'run locally: {len(elapsed)} tasks, {sum(elapsed):.1f} s total, {np.mean(elapsed):.1f} s per task')
+    return counts
@@ -0,0 +1,309 @@
+'''
+Streaming, parallel parser of Gaussian `.log` files and indexed DFT reference set.
+
+Replaces `read_gaussian_output` of gaussian/gaussian_parser.ipynb. Each log is
+read once, line by line (never the whole file in memory), keeping only the
+last geometry, SCF energy, forces and convergence table, so long multi-step
+optimizations of the COSAN rotamers are parsed in constant memory. Whole
+directories are parsed in parallel and collected into one `.npz` reference set
+indexed by structure name:
+
+    reference = build_reference('gaussian/gview_molecules', 'gaussian/dft_reference.npz', xyz_dir='gaussian/xyz_structures')
+    reference = ReferenceSet('gaussian/dft_reference.npz')
+    water = reference.atoms('water_DFT_wb97xd_6-31d')   # energy/forces through a SinglePointCalculator
+
+Energies are stored in eV and forces in eV/Å. When a log has forces, the stored
+positions are the input orientation, the frame Gaussian prints the forces in.
+'''
+
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from ase import Atoms
+from ase.units import Hartree, Bohr
+from ase.calculators.singlepoint import SinglePointCalculator
+
+
+#====================#
+#       PARSER       #
+#====================#
+
+def _read_table(lines, n_header):
+    '''
+    Rows of a dashed Gaussian table: skip to the first dashes, then
+    n_header lines (column titles and second dashes), read until the closing dashes.
+    '''
+
+    for line in lines:
+        if '-----' in line:
+            break
+    for _ in range(n_header):
+        next(lines)
+
+    rows = []
+    for line in lines:
+        if '-----' in line:
+            break
+        rows.append(line.split())
+    return rows
+
+
+def _geometry(rows):
+    numbers = [int(parts[1]) for parts in rows if len(parts) >= 6]
+    positions = [[float(x) for x in parts[3:6]] for parts in rows if len(parts) >= 6]
+    return np.array(numbers, dtype=int), np.array(positions, dtype=float)
+
+
+def read_gaussian_log(path):
+    '''
+    Definition
+    ----------
+    Parses one Gaussian log in a single pass. Returns a dict with
+
+    - numbers, positions: last "Standard orientation" (as the notebook), or
+      last "Input orientation" with nosymm.
+    - input_positions: last "Input orientation", the frame of the forces.
+    - energy (eV): last "SCF Done"; scf_energies: all of them (one per step).
+    - forces (eV/Å) or None: last "Forces (Hartrees/Bohr)" block.
+    - converged: optimization completed (or single point with normal termination);
+      convergence: last table {item: (value, threshold, converged)}.
+    - normal_termination, charge, multiplicity, n_steps.
+    '''
+
+    result = {
+        'numbers': None, 'positions': None, 'input_positions': None,
+        'energy': None, 'scf_energies': [], 'forces': None,
+        'convergence': {}, 'optimization_completed': False, 'optimization': False,
+        'normal_termination': False, 'charge': 0, 'multiplicity': 1,
+    }
+
+    with open(path, 'r', errors='replace') as file:
+        lines = iter(file)
+        for line in lines:
+            if 'Standard orientation:' in line:
+                result['numbers'], result['positions'] = _geometry(_read_table(lines, 3))
+            elif 'Input orientation:' in line:
+                numbers, result['input_positions'] = _geometry(_read_table(lines, 3))
+                if result['numbers'] is None:
+                    result['numbers'] = numbers
+            elif line.startswith(' SCF Done:'):
+                energy = float(line.split('=')[1].split()[0])
+                result['scf_energies'].append(energy * Hartree)
+            elif 'Forces (Hartrees/Bohr)' in line:
+                # the title line sits inside the table header: skip to the dashes after it
+                rows = _read_table(lines, 0)
+                forces = [[float(x) for x in parts[2:5]] for parts in rows if len(parts) >= 5]
+                result['forces'] = np.array(forces) * Hartree / Bohr
+            elif 'Converged?' in line:
+                result['optimization'] = True
+                for _ in range(4):
+                    parts = next(lines).split()
+                    if len(parts) >= 5:
+                        result['convergence'][' '.join(parts[:2])] = (float(parts[2]), float(parts[3]), parts[4] == 'YES')
+            elif 'Optimization completed' in line or 'Stationary point found' in line:
+                result['optimization_completed'] = True
+            elif line.startswith(' Charge =') and 'Multiplicity' in line:
+                parts = line.split()
+                result['charge'], result['multiplicity'] = int(parts[2]), int(parts[5])
+            elif 'Normal termination of Gaussian' in line:
+                result['normal_termination'] = True
+
+    if result['numbers'] is None:
+        raise ValueError(f'no orientation section found in {path}')
+    if result['positions'] is None:
+        result['positions'] = result['input_positions']
+    if result['forces'] is not None and len(result['forces']) != len(result['numbers']):
+        raise ValueError(f'{len(result["forces"])} force rows for {len(result["numbers"])} atoms in {path}')
+
+    result['energy'] = result['scf_energies'][-1] if len(result['scf_energies']) > 0 else np.nan
+    result['n_steps'] = len(result['scf_energies'])
+    if result['optimization']:
+        result['converged'] = result['optimization_completed']
+    else:
+        result['converged'] = result['normal_termination']
+    result['name'] = os.path.splitext(os.path.basename(path))[0]
+    result['path'] = os.path.abspath(path)
+    return result
+
+
+def _safe_read(path):
+    try:
+        return read_gaussian_log(path)
+    except Exception as error:
+        return {'path': os.path.abspath(path), 'error': str(error)}
+
+
+def parse_logs(paths, n_workers=None):
+    '''
+    Definition
+    ----------
+    Parses many logs in parallel (one process per core by default, n_workers=1
+    runs serially). paths is a list of files or a directory. Returns the parsed
+    logs and a dict path -> error for the logs that could not be parsed.
+    '''
+
+    if isinstance(paths, str):
+        paths = sorted(glob.glob(os.path.join(paths, '*.log')))
+
+    if n_workers == 1 or len(paths) <= 1:
+        results = [_safe_read(p) for p in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_safe_read, paths, chunksize=max(1, len(paths) // (4 * (n_workers or os.cpu_count() or 1)))))
+
+    logs = [r for r in results if 'error' not in r]
+    errors = {r['path']: r['error'] for r in results if 'error' in r}
+    return logs, errors
+
+
+def log_to_atoms(log):
+    '''
+    Atoms of a parsed log with its DFT energy/forces attached.
+    '''
+
+    atoms = Atoms(numbers=log['numbers'], positions=log['positions'])
+    if log['forces'] is not None and log['input_positions'] is not None:
+        # forces are printed in the input orientation
+        atoms.positions = log['input_positions']
+    atoms.calc = SinglePointCalculator(atoms, energy=log['energy'], forces=log['forces'])
+    return atoms
+
+
+#=======================#
+#       REFERENCE       #
+#=======================#
+
+def write_reference(path, logs):
+    '''
+    Definition
+    ----------
+    Writes parsed logs to one `.npz` reference set. Atoms of all structures are
+    concatenated and indexed by offsets, so structures of any size share the same arrays.
+    '''
+
+    sizes = [len(log['numbers']) for log in logs]
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+    n_total = int(offsets[-1])
+
+    forces = np.full((n_total, 3), np.nan)
+    has_forces = np.zeros(len(logs), dtype=bool)
+    positions = np.zeros((n_total, 3))
+    for i, log in enumerate(logs):
+        atoms = log_to_atoms(log)
+        positions[offsets[i]:offsets[i+1]] = atoms.positions
+        if log['forces'] is not None:
+            forces[offsets[i]:offsets[i+1]] = log['forces']
+            has_forces[i] = True
+
+    np.savez_compressed(
+        path,
+        names=np.array([log['name'] for log in logs]),
+        offsets=offsets,
+        numbers=np.concatenate([log['numbers'] for log in logs]) if len(logs) > 0 else np.zeros(0, dtype=int),
+        positions=positions,
+        forces=forces,
+        has_forces=has_forces,
+        energies=np.array([log['energy'] for log in logs], dtype=float),
+        converged=np.array([log['converged'] for log in logs], dtype=bool),
+        normal_termination=np.array([log['normal_termination'] for log in logs], dtype=bool),
+        n_steps=np.array([log['n_steps'] for log in logs], dtype=int),
+        charges=np.array([log['charge'] for log in logs], dtype=int),
+        multiplicities=np.array([log['multiplicity'] for log in logs], dtype=int),
+    )
+
+
+def write_xyz_file(atoms, path):
+    '''
+    XYZ file of a structure, with the same header as the notebook.
+    '''
+    with open(path, 'w') as file:
+        file.write(f'{len(atoms)}\n')
+        file.write('Optimized structure from Gaussian output\n')
+        for symbol, (x, y, z) in zip(atoms.get_chemical_symbols(), atoms.positions):
+            file.write(f'{symbol} {x} {y} {z}\n')
+
+
+def build_reference(paths, output, n_workers=None, xyz_dir=None, verbose=True):
+    '''
+    Definition
+    ----------
+    Parses every log (directory or list of files) in parallel and writes the
+    reference set to output. With xyz_dir, the optimized structures are also
+    written there as `<name>.xyz`, as the notebook did. Returns the ReferenceSet.
+    '''
+
+    logs, errors = parse_logs(paths, n_workers=n_workers)
+    logs.sort(key=lambda log: log['name'])
+
+    write_reference(output, logs)
+
+    if xyz_dir is not None:
+        if not os.path.isdir(xyz_dir):
+            os.makedirs(xyz_dir)
+        for log in logs:
+            write_xyz_file(Atoms(numbers=log['numbers'], positions=log['positions']), os.path.join(xyz_dir, f'{log["name"]}.xyz'))
+
+    if verbose:
+        n_conv = sum(log['converged'] for log in logs)
+        print(f'{len(logs)} logs parsed ({n_conv} converged), {len(errors)} failed')
+        for path, error in errors.items():
+            print(f'  {path}: {error}')
+
+    return ReferenceSet(output)
+
+
+class ReferenceSet:
+    '''
+    Definition
+    ----------
+    Read access to a reference set written by `write_reference`: structures
+    by name or position, with their DFT energy (eV) and forces (eV/Å).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path) as data:
+            self.data = {key: data[key] for key in data.files}
+        self.names = [str(name) for name in self.data['names']]
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def _position(self, key):
+        if isinstance(key, str):
+            return self.index[key]
+        return int(key)
+
+    def __getitem__(self, key):
+        i = self._position(key)
+        start, end = self.data['offsets'][i], self.data['offsets'][i+1]
+        return {
+            'name': self.names[i],
+            'numbers': self.data['numbers'][start:end],
+            'positions': self.data['positions'][start:end],
+            'forces': self.data['forces'][start:end] if self.data['has_forces'][i] else None,
+            'energy': float(self.data['energies'][i]),
+            'converged': bool(self.data['converged'][i]),
+            'normal_termination': bool(self.data['normal_termination'][i]),
+            'n_steps': int(self.data['n_steps'][i]),
+            'charge': int(self.data['charges'][i]),
+            'multiplicity': int(self.data['multiplicities'][i]),
+        }
+
+    def atoms(self, key):
+        '''
+        Atoms of a structure with the DFT energy/forces in a SinglePointCalculator.
+        '''
+        entry = self[key]
+        atoms = Atoms(numbers=entry['numbers'], positions=entry['positions'])
+        atoms.calc = SinglePointCalculator(atoms, energy=entry['energy'], forces=entry['forces'])
+        return atoms
+
+    def energies(self):
+        return dict(zip(self.names, self.data['energies']))
@@ -0,0 +1,284 @@
+'''
+Adaptive, symmetry-aware N-dimensional PES grid scans.
+
+Generalizes the nested `distances_h x distances_v` loop of distances.ipynb to any
+set of bond/angle/dihedral coordinates. The fine grid is never evaluated in full:
+
+- declared symmetries (permutations of equivalent axes, e.g. the d_h <-> d_v
+  mirror of cyclobutadiene) map every point to one representative, which is the
+  only one evaluated;
+- a coarse grid is evaluated first and then refined level by level (halving the
+  step). A new point is evaluated only if it lies near the low-energy region
+  (minima and the saddles between them), on a steep region, or next to a point
+  where the previous level was badly interpolated (sharp features). All other
+  points are filled by multilinear interpolation.
+
+    coordinates = [('bond', bond_ids_h, mask_h), ('bond', bond_ids_v, mask_v)]
+    bounds = [[1.2, 1.8], [1.2, 1.8]]
+    result = scan_grid(molecule, coordinates, bounds, orb_calc_d3_v2, symmetries=[(1, 0)])
+    plot_pes_2d(result, mol_name, 'ORB-D3-V2', reference=(horzontal, vertical))
+'''
+
+import os
+import itertools
+
+import numpy as np
+
+from . import conformers
+from .batch_scan import evaluate_batch
+
+
+#=======================#
+#       COORDINATES     #
+#=======================#
+
+_MASKS = {
+    'bond': conformers.bond_mask,
+    'angle': conformers.angle_mask,
+    'dihedral': conformers.dihedral_mask,
+}
+
+
+def _resolve_coordinates(atoms, coordinates):
+    '''
+    Fill automatic masks: coordinates are (kind, ids) or (kind, ids, mask).
+    '''
+
+    resolved = []
+    for coordinate in coordinates:
+        kind, ids = coordinate[0], list(coordinate[1])
+        mask = coordinate[2] if len(coordinate) > 2 else None
+        if kind not in _MASKS:
+            raise ValueError(f'unknown coordinate {kind}, use bond, angle or dihedral')
+        if mask is None:
+            mask = _MASKS[kind](atoms, ids)
+        resolved.append((kind, ids, mask))
+    return resolved
+
+
+def _set_coordinate(atoms, kind, ids, mask, value):
+    if kind == 'bond':
+        atoms.set_distance(ids[0], ids[1], value, fix=0, mask=mask)
+    elif kind == 'angle':
+        atoms.set_angle(ids[0], ids[1], ids[2], value, mask=mask)
+    else:
+        atoms.set_dihedral(ids[0], ids[1], ids[2], ids[3], value, mask=mask)
+
+
+def grid_conformers(atoms, coordinates, axes, points):
+    '''
+    Definition
+    ----------
+    Conformers (n_points x n_atoms x 3) of the grid points (index tuples).
+    Coordinates are set in order, as in the notebooks.
+    '''
+
+    conformer = atoms.copy()
+    positions = np.zeros((len(points), len(atoms), 3))
+    for p, point in enumerate(points):
+        conformer.positions = atoms.positions
+        for (kind, ids, mask), axis, i in zip(coordinates, axes, point):
+            _set_coordinate(conformer, kind, ids, mask, axis[i])
+        positions[p] = conformer.positions
+    return positions
+
+
+#=====================#
+#       SYMMETRY      #
+#=====================#
+
+def _symmetry_group(symmetries, n_dim):
+    '''
+    Closure of the declared axis permutations (identity included).
+    '''
+
+    identity = tuple(range(n_dim))
+    group = {identity}
+    generators = [tuple(s) for s in symmetries]
+    frontier = [identity]
+    while len(frontier) > 0:
+        g = frontier.pop()
+        for s in generators:
+            h = tuple(g[k] for k in s)
+            if h not in group:
+                group.add(h)
+                frontier.append(h)
+    return sorted(group)
+
+
+def _canonical(point, group):
+    return min(tuple(point[k] for k in g) for g in group)
+
+
+#=================#
+#       SCAN      #
+#=================#
+
+def _parents(point, step, shape):
+    '''
+    Neighbours at ±step along the axes where the point is an odd multiple of step.
+    '''
+
+    options = []
+    for i, n in zip(point, shape):
+        if (i // step) % 2 == 1:
+            options.append([i - step, min(i + step, n - 1)])
+        else:
+            options.append([i])
+    return list(itertools.product(*options))
+
+
+def scan_grid(atoms, coordinates, bounds, calc, coarse=16, levels=2, symmetries=(), energy_window=0.5, spread_tol=None, interp_tol=0.01, batch_size=None, verbose=True):
+    '''
+    Definition
+    ----------
+    Adaptive N-D scan of one calculator.
+
+    coordinates is a list of (kind, ids[, mask]) with kind 'bond', 'angle' or
+    'dihedral' (automatic mask if not given); bounds the [min, max] of each
+    coordinate (Å or deg). The fine grid has (coarse - 1) * 2**levels + 1 points
+    per axis, of which the coarse grid is evaluated first.
+
+    symmetries are axis permutations leaving the energy invariant, e.g. (1, 0)
+    for E(x, y) = E(y, x); the permuted axes must have the same bounds.
+    On refinement a point is evaluated if its neighbours lie within
+    energy_window (eV) of the current minimum, span more than spread_tol (eV),
+    or were interpolated with an error above interp_tol (eV).
+
+    Returns a dict with the axes, the energies on the full grid, the mask of
+    evaluated points and the number of model evaluations.
+    '''
+
+    coordinates = _resolve_coordinates(atoms, coordinates)
+    n_dim = len(coordinates)
+    step = 2**levels
+    n = (coarse - 1) * step + 1
+    axes = [np.linspace(lo, hi, n) for lo, hi in bounds]
+    shape = (n,) * n_dim
+
+    group = _symmetry_group(symmetries, n_dim)
+    for g in group:
+        for k in range(n_dim):
+            if not np.allclose(axes[k], axes[g[k]]):
+                raise ValueError(f'symmetry {g} maps axes with different bounds')
+
+    energies = np.full(shape, np.nan)
+    evaluated = np.zeros(shape, dtype=bool)
+    error = np.zeros(shape)
+    n_evaluations = 0
+
+    def evaluate(points):
+        # only one representative per symmetry orbit is sent to the model
+        canonical = [p for p in sorted({_canonical(p, group) for p in points}) if not evaluated[p]]
+        if len(canonical) > 0:
+            positions = grid_conformers(atoms, coordinates, axes, canonical)
+            values, _ = evaluate_batch(calc, atoms, positions, batch_size=batch_size)
+            for p, value in zip(canonical, values):
+                energies[p] = value
+                evaluated[p] = True
+        for p in points:
+            c = _canonical(p, group)
+            energies[p] = energies[c]
+            evaluated[p] = True
+        return len(canonical)
+
+    # coarse grid
+    coarse_points = list(itertools.product(*[range(0, n, step)] * n_dim))
+    n_evaluations += evaluate(coarse_points)
+    if verbose:
+        print(f'level 0 (step {step}): {n_evaluations} evaluations')
+
+    # refinement, halving the step every level
+    while step > 1:
+        half = step // 2
+        level_points = [p for p in itertools.product(*[range(0, n, half)] * n_dim) if np.isnan(energies[p])]
+        e_min = np.nanmin(energies)
+
+        refine = []
+        for p in level_points:
+            parents = _parents(p, half, shape)
+            parent_energies = np.array([energies[q] for q in parents])
+            interpolated = parent_energies.mean()
+            near_minimum = parent_energies.min() < e_min + energy_window
+            steep = spread_tol is not None and np.ptp(parent_energies) > spread_tol
+            sharp = max(error[q] for q in parents) > interp_tol
+            if near_minimum or steep or sharp:
+                refine.append((p, interpolated))
+            else:
+                energies[p] = interpolated
+
+        new = evaluate([p for p, _ in refine])
+        n_evaluations += new
+        for p, interpolated in refine:
+            error[p] = abs(energies[p] - interpolated)
+
+        step = half
+        if verbose:
+            print(f'level {levels - int(np.log2(step))} (step {step}): {new} evaluations, {len(refine)} refined / {len(level_points)} points')
+
+    if verbose:
+        print(f'{n_evaluations} model evaluations for a {"x".join(str(s) for s in shape)} grid ({100*n_evaluations/energies.size:.1f}%)')
+
+    return {
+        'axes': axes,
+        'energies': energies,
+        'evaluated': evaluated,
+        'n_evaluations': n_evaluations,
+        'coordinates': coordinates,
+    }
+
+
+def scan_grid_models(atoms, coordinates, bounds, calculator_list, calculator_names, **kwargs):
+    '''
+    Definition
+    ----------
+    `scan_grid` for every calculator. Returns a dict name -> result for the
+    calculators that succeeded; failing ones are reported and skipped.
+    '''
+
+    results = {}
+    for calc_, name in zip(calculator_list, calculator_names):
+        try:
+            print(f'{name}')
+            results[name] = scan_grid(atoms, coordinates, bounds, calc_, **kwargs)
+        except Exception as error:
+            print(f'calculator {name} failed: {error}')
+    return results
+
+
+def plot_pes_2d(result, mol_name, calc_name, reference=None, vmax=0.7, symmetry_axis=True, work_dir=None, labels=None):
+    '''
+    Definition
+    ----------
+    Contour plot of a 2D scan relative to its minimum, as in distances.ipynb.
+    reference is the (x, y) DFT geometry; with symmetry_axis its mirror image
+    and the x = y axis are drawn too.
+    '''
+
+    import matplotlib.pyplot as plt
+
+    if work_dir is None:
+        work_dir = os.path.join(os.curdir, 'PES_distances', mol_name)
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    if labels is None:
+        labels = ['horizontal distance (Å)', 'vertical distance (Å)']
+
+    x, y = result['axes']
+    corrected_energy_matrix = result['energies'] - np.nanmin(result['energies'])
+
+    fig, ax = plt.subplots()
+    # energies are indexed [x, y], pcolormesh expects [y, x]
+    im = ax.pcolormesh(x, y, corrected_energy_matrix.T, vmax=vmax, cmap='BuPu_r')
+    if reference is not None:
+        ax.scatter(reference[0], reference[1], color='red', marker='x', label=r'$\textnormal{DFT reference}$', s=60)
+        if symmetry_axis:
+            ax.scatter(reference[1], reference[0], color='red', marker='x', s=60)
+    if symmetry_axis:
+        ax.plot(x, x, ls=':', color='black', label=r'$\textnormal{symmetry axis}$')
+    ax.set(xlabel=r'$\textnormal{' + labels[0] + r'}$', ylabel=r'$\textnormal{' + labels[1] + r'}$')
+
+    ax.legend(loc='best', title=f'{mol_name}', title_fontsize='large')
+    fig.colorbar(im, ax=ax, label=r'$\textnormal{Potential energy (eV)}\quad\textnormal{\textbf{'+f'{calc_name}'+r'}}$')
+    fig.savefig(os.path.join(work_dir, f'{mol_name}_{calc_name}'+'_2D_PES.png'), dpi=400)
+    return fig, ax
@@ -0,0 +1,266 @@
+'''
+Batched Hessians and vibrational analysis.
+
+`ase.vibrations.Vibrations(..., nfree=2)` (models/ase_ani/ase_ani.ipynb) runs
+6N + 1 separate single points and writes one JSON file per displacement. Here
+all displaced geometries are built at once and evaluated in batches with
+`batch_scan.evaluate_batch`, or, for the ANI models, the Hessian is obtained
+from autograd second derivatives. Hessians are stored in one SQLite file keyed
+by model and geometry, and returned as `ase.vibrations.VibrationsData`, so the
+usual frequencies, `tabulate()` summary and mode animations are available.
+
+    vib = vibrations(H2O, ani2x.ase(), model_id='ANI-2x')
+    print_summary(vib)
+    write_mode_trajectories(vib, 'vib-h2o')
+'''
+
+import os
+import time
+import sqlite3
+
+import numpy as np
+from ase import units
+from ase.io import Trajectory
+from ase.vibrations import VibrationsData
+
+from .batch_scan import ani_inputs, evaluate_batch, get_backend
+from .cache import geometry_key, model_dtype
+
+
+DEFAULT_HESSIAN_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'nnp_tools', 'hessian_cache.sqlite')
+
+
+#=====================#
+#       HESSIANS      #
+#=====================#
+
+def displaced_positions(atoms, delta=0.01, nfree=2, indices=None):
+    '''
+    Definition
+    ----------
+    All finite-difference displacements at once: for every atom in indices and
+    every cartesian direction, ±delta (nfree=2) or ±delta, ±2 delta (nfree=4).
+    Returns (n_displacements x n_atoms x 3) ordered as
+    [atom, direction, step] with steps (-, +) or (-, +, --, ++).
+    '''
+
+    if indices is None:
+        indices = range(len(atoms))
+    steps = [-1, 1] if nfree == 2 else [-1, 1, -2, 2]
+
+    positions = atoms.get_positions()
+    displaced = []
+    for a in indices:
+        for i in range(3):
+            for step in steps:
+                pos = positions.copy()
+                pos[a, i] += step * delta
+                displaced.append(pos)
+    return np.array(displaced)
+
+
+def hessian_fd(atoms, calc, delta=0.01, nfree=2, indices=None, batch_size=None):
+    '''
+    Definition
+    ----------
+    Finite-difference Hessian (3n x 3n, eV/Å², n = len(indices)) from one
+    batched force evaluation of all displacements, with the same central
+    difference formulas as `ase.vibrations.Vibrations`.
+    '''
+
+    if nfree not in (2, 4):
+        raise ValueError('nfree must be 2 or 4')
+    if indices is None:
+        indices = list(range(len(atoms)))
+
+    positions = displaced_positions(atoms, delta=delta, nfree=nfree, indices=indices)
+    _, forces = evaluate_batch(calc, atoms, positions, compute_forces=True, batch_size=batch_size)
+    forces = forces[:, indices].reshape(len(indices) * 3, nfree, -1)
+
+    if nfree == 2:
+        hessian = (forces[:, 0] - forces[:, 1]) / (2 * delta)
+    else:
+        hessian = (-forces[:, 2] + 8 * forces[:, 0] - 8 * forces[:, 1] + forces[:, 3]) / (12 * delta)
+
+    return 0.5 * (hessian + hessian.T)
+
+
+def hessian_ani(atoms, calc):
+    '''
+    Definition
+    ----------
+    Analytical Hessian (3N x 3N, eV/Å²) of a TorchANI `.ase()` calculator from
+    autograd second derivatives, as in the TorchANI vibration analysis example.
+    '''
+
+    import torch
+
+    inputs = ani_inputs(calc, atoms)
+    if inputs is None:
+        raise ValueError('the torch model of this ANI calculator is not accessible')
+    device, dtype, species = inputs
+    species = species.unsqueeze(0)
+
+    coordinates = torch.tensor(atoms.get_positions(), dtype=dtype, device=device).unsqueeze(0).requires_grad_(True)
+    if atoms.pbc.any():
+        cell = torch.tensor(np.array(atoms.get_cell(complete=True)), dtype=dtype, device=device)
+        pbc = torch.tensor(atoms.get_pbc(), dtype=torch.bool, device=device)
+        energy = calc.model((species, coordinates), cell=cell, pbc=pbc).energies
+    else:
+        energy = calc.model((species, coordinates)).energies
+
+    gradient = torch.autograd.grad(energy.sum(), coordinates, create_graph=True)[0].flatten()
+    rows = [torch.autograd.grad(g, coordinates, retain_graph=True)[0].flatten() for g in gradient]
+    hessian = torch.stack(rows).detach().cpu().numpy().astype(np.float64) * units.Hartree
+    return 0.5 * (hessian + hessian.T)
+
+
+def hessian(atoms, calc, method='auto', delta=0.01, nfree=2, indices=None, batch_size=None):
+    '''
+    Definition
+    ----------
+    Hessian (eV/Å²) with method 'autograd' (ANI models, all atoms only), 'fd'
+    (batched finite differences, any calculator) or 'auto' (autograd when
+    supported, finite differences otherwise). Returns the Hessian and the method used.
+    '''
+
+    if method == 'auto':
+        method = 'autograd' if get_backend(calc) == 'ani' and indices is None else 'fd'
+    if method == 'autograd':
+        if get_backend(calc) != 'ani':
+            raise ValueError('autograd Hessians are only available for the ANI models')
+        return hessian_ani(atoms, calc), method
+    return hessian_fd(atoms, calc, delta=delta, nfree=nfree, indices=indices, batch_size=batch_size), method
+
+
+#==================#
+#       CACHE      #
+#==================#
+
+class HessianCache:
+    '''
+    Definition
+    ----------
+    Single SQLite file of Hessians keyed by model, method and geometry
+    (`cache.geometry_key`), stored as raw float64 blobs.
+    '''
+
+    def __init__(self, path=None):
+        if path is None:
+            path = DEFAULT_HESSIAN_CACHE
+        if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(path, timeout=60)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS hessians (
+            key TEXT PRIMARY KEY,
+            n_dof INTEGER NOT NULL,
+            indices BLOB NOT NULL,
+            hessian BLOB NOT NULL,
+            created REAL NOT NULL)''')
+        self._db.commit()
+
+    @staticmethod
+    def key(model_id, atoms, method, delta, nfree):
+        if method == 'autograd':
+            return geometry_key(f'{model_id}|hessian|autograd', atoms)
+        return geometry_key(f'{model_id}|hessian|fd|{delta}|{nfree}', atoms)
+
+    def get(self, key):
+        row = self._db.execute('SELECT n_dof, indices, hessian FROM hessians WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        n_dof, indices, blob = row
+        return np.frombuffer(indices, dtype=np.int64).copy(), np.frombuffer(blob, dtype=np.float64).reshape(n_dof, n_dof).copy()
+
+    def put(self, key, indices, hessian):
+        hessian = np.ascontiguousarray(hessian, dtype=np.float64)
+        self._db.execute('INSERT OR REPLACE INTO hessians VALUES (?, ?, ?, ?, ?)',
+                         (key, len(hessian), np.asarray(indices, dtype=np.int64).tobytes(), hessian.tobytes(), time.time()))
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM hessians').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+#========================#
+#       VIBRATIONS       #
+#========================#
+
+def vibrations(atoms, calc, model_id=None, cache=None, method='auto', delta=0.01, nfree=2, indices=None, batch_size=None):
+    '''
+    Definition
+    ----------
+    Vibrational analysis of atoms (already optimized) with one calculator.
+    With a HessianCache (and model_id, the name of the model) the Hessian is
+    looked up first and stored after computation. Returns a VibrationsData.
+    '''
+
+    if indices is None:
+        indices = list(range(len(atoms)))
+    whole = len(indices) == len(atoms)
+
+    if method == 'auto':
+        method = 'autograd' if get_backend(calc) == 'ani' and whole else 'fd'
+
+    key = None
+    if cache is not None and model_id is not None:
+        key = HessianCache.key(f'{model_id}|{model_dtype(calc)}', atoms, method, delta, nfree)
+        entry = cache.get(key)
+        if entry is not None and list(entry[0]) == list(indices):
+            return VibrationsData.from_2d(atoms, entry[1], indices=indices)
+
+    H, _ = hessian(atoms, calc, method=method, delta=delta, nfree=nfree, indices=None if whole else indices, batch_size=batch_size)
+    if key is not None:
+        cache.put(key, indices, H)
+    return VibrationsData.from_2d(atoms, H, indices=indices)
+
+
+def vibrations_models(atoms, calculator_list, calculator_names, cache=None, **kwargs):
+    '''
+    Definition
+    ----------
+    `vibrations` for every calculator. Returns a dict name -> VibrationsData;
+    failing calculators are reported and skipped.
+    '''
+
+    results = {}
+    for calc_, name in zip(calculator_list, calculator_names):
+        try:
+            results[name] = vibrations(atoms, calc_, model_id=name, cache=cache, **kwargs)
+        except Exception as error:
+            print(f'calculator {name} failed: {error}')
+    return results
+
+
+def print_summary(vib):
+    '''
+    Frequency table and zero-point energy, as `Vibrations.summary()`.
+    '''
+    print(vib.tabulate())
+
+
+def write_mode_trajectories(vib, name, modes=None, temperature=300, frames=30):
+    '''
+    Definition
+    ----------
+    Writes `<name>.<mode>.traj` animations of the normal modes (all by
+    default), as `Vibrations.write_mode` did in the notebook.
+    '''
+
+    if modes is None:
+        modes = range(3 * len(vib.get_indices()))
+    for mode in modes:
+        with Trajectory(f'{name}.{mode}.traj', 'w') as traj:
+            for image in vib.iter_animated_mode(mode, temperature=units.kB * temperature, frames=frames):
+                traj.write(image)
@@ -0,0 +1,274 @@
+'''
+Incremental evaluation of rigid-body and fragment moves.
+
+In `evaluate_rotation` and the translation tests the whole molecule moves
+rigidly, and in the COSAN `group=[...]` scans and the masked dihedral, angle
+and bond scans only one fragment moves, yet every point is evaluated from
+scratch. `IncrementalCalculator` keeps a reference geometry with its energy
+and forces and compares every new geometry with it:
+
+- identical: the reference results are returned;
+- fragment move: only the atoms within twice the receptive field R of the
+  moved atoms (old or new positions) are evaluated, as a cluster, before and
+  after the move. For a model made of atomic contributions of range R
+  (ANI: cutoff; MACE: cutoff x message passing layers) the difference of
+  the two cluster results is exactly the change of the full system:
+  E = E_ref + E_S(new) - E_S(old), F = F_ref + F_S(new) - F_S(old) on the
+  cluster atoms;
+- anything else: full evaluation.
+
+Clusters ("regions") are cached per set of moved atoms and built with a skin,
+so consecutive points of a scan whose moved atoms stay within the skin reuse
+the same atom list and old-cluster results. Models whose energy is not a
+sum of finite-range atomic contributions (ORB-V2 reads the energy out of a
+mean-aggregated graph, ORB-D3 adds D3 dispersion) are always evaluated in full.
+
+Rigid motions of the whole system are evaluated by the model, so symmetry
+tests still measure its output. Only with assume_invariant=True (for models
+known to be exactly invariant) is the reference energy reused and the
+reference forces rotated.
+
+    calc = IncrementalCalculator(maceoff, receptive_field=RECEPTIVE_FIELDS['MACE-OFF'])
+    angles, energies, succ = batch_scan.evaluate_dihedral(COSAN, ids, mask, [calc], ['MACE-OFF'])
+    calc.print_stats()
+'''
+
+import numpy as np
+from ase.calculators.calculator import Calculator, all_changes
+
+from .batch_scan import evaluate_batch
+
+
+# range (Å) of the atomic contributions (cutoff x number of message passing layers),
+# None for models whose energy is not atom-additive
+RECEPTIVE_FIELDS = {
+    'ANI-1x': 5.2,
+    'ANI-1ccx': 5.2,
+    'ANI-2x': 5.1,
+    'MACE-MP': 12.,
+    'MACE-OFF': 10.,
+    'ORB-V2': None,
+    'ORB-D3-V2': None,
+}
+
+DEFAULT_SKIN = 1.       # Å
+DEFAULT_MOVE_TOL = 1e-10
+DEFAULT_RIGID_TOL = 1e-8
+MAX_REGIONS = 64
+
+KINDS = ['identical', 'rigid', 'fragment', 'full']
+
+
+#=======================#
+#       GEOMETRY        #
+#=======================#
+
+def rigid_transform(reference, positions, tol=DEFAULT_RIGID_TOL):
+    '''
+    Definition
+    ----------
+    Rotation R (3x3) such that positions = reference @ R.T + t for some
+    translation t (Kabsch alignment), or None if positions is not a rigid
+    motion of reference within tol (Å, largest atomic deviation).
+    '''
+
+    ref_c = reference - reference.mean(axis=0)
+    pos_c = positions - positions.mean(axis=0)
+    u, _, vt = np.linalg.svd(pos_c.T @ ref_c)
+    d = np.sign(np.linalg.det(u @ vt))
+    rotation = u @ np.diag([1., 1., d]) @ vt
+    if np.abs(ref_c @ rotation.T - pos_c).max() > tol:
+        return None
+    return rotation
+
+
+def _within(positions, centers, radius):
+    '''
+    Mask of positions within radius of any of centers.
+    '''
+    within = np.zeros(len(positions), dtype=bool)
+    for center in centers:
+        within |= ((positions - center)**2).sum(axis=1) <= radius**2
+    return within
+
+
+#========================#
+#       CALCULATOR       #
+#========================#
+
+class IncrementalCalculator(Calculator):
+    '''
+    Definition
+    ----------
+    ASE calculator reusing the results of a reference geometry for rigid and
+    fragment moves (see the module docstring). receptive_field (Å) enables
+    fragment moves, None disables them. A fragment move is only evaluated
+    incrementally if its cluster has less than max_fraction of the atoms.
+    assume_invariant reuses the reference results for rigid motions (off by
+    default: rigid motions are evaluated by the model).
+
+    The reference is the first geometry evaluated, or the one passed to
+    `set_reference`; it is replaced when the atoms or the cell change.
+    `stats` counts the points of each kind and the atoms actually evaluated.
+    '''
+
+    implemented_properties = ['energy', 'free_energy', 'forces']
+
+    def __init__(self, calc, receptive_field=None, skin=DEFAULT_SKIN, max_fraction=0.5, assume_invariant=False, move_tol=DEFAULT_MOVE_TOL, rigid_tol=DEFAULT_RIGID_TOL, batch_size=None, **kwargs):
+        Calculator.__init__(self, **kwargs)
+        self.calc = calc
+        self.receptive_field = receptive_field
+        self.skin = skin
+        self.max_fraction = max_fraction
+        self.move_tol = move_tol
+        self.rigid_tol = rigid_tol
+        self.assume_invariant = assume_invariant
+        self.batch_size = batch_size
+        self.reference = None
+        self.regions = {}
+        self.stats = {**{kind: 0 for kind in KINDS}, 'regions_built': 0, 'atoms_evaluated': 0, 'atoms_full': 0}
+
+    #=======================#
+    #       REFERENCE       #
+    #=======================#
+
+    def set_reference(self, atoms):
+        '''
+        Full evaluation (energy and forces) of the reference geometry.
+        '''
+
+        energies, forces = evaluate_batch(self.calc, atoms, atoms.get_positions()[None], compute_forces=True, batch_size=self.batch_size)
+        self.reference = {
+            'atoms': atoms.copy(),
+            'positions': atoms.get_positions().copy(),
+            'energy': energies[0],
+            'forces': forces[0],
+        }
+        self.regions = {}
+        self.stats['full'] += 1
+        self.stats['atoms_evaluated'] += len(atoms)
+        self.stats['atoms_full'] += len(atoms)
+
+    def _matches_reference(self, atoms):
+        if self.reference is None:
+            return False
+        ref = self.reference['atoms']
+        return (len(ref) == len(atoms) and np.array_equal(ref.numbers, atoms.numbers)
+                and np.allclose(ref.cell, atoms.cell) and np.array_equal(ref.pbc, atoms.pbc))
+
+    #=====================#
+    #       REGIONS       #
+    #=====================#
+
+    def _region(self, moved, positions):
+        '''
+        Cached cluster around the moved atoms valid for these positions, or a new one.
+        '''
+
+        key = moved.tobytes()
+        for region in self.regions.get(key, []):
+            if np.abs(positions[moved] - region['anchor']).max() < self.skin:
+                return region, False
+
+        radius = 2 * self.receptive_field + self.skin
+        ref_positions = self.reference['positions']
+        selection = _within(ref_positions, ref_positions[moved], radius) | _within(ref_positions, positions[moved], radius)
+        selection[moved] = True
+        region = {'indices': np.flatnonzero(selection), 'anchor': positions[moved].copy(), 'energy': None, 'forces': None}
+
+        if sum(len(regions) for regions in self.regions.values()) >= MAX_REGIONS:
+            self.regions = {}
+        self.regions.setdefault(key, []).append(region)
+        self.stats['regions_built'] += 1
+        return region, True
+
+    def _classify(self, positions):
+        '''
+        Kind of move of one geometry relative to the reference: (kind, data).
+        '''
+
+        ref_positions = self.reference['positions']
+        moved = np.flatnonzero(np.abs(positions - ref_positions).max(axis=1) > self.move_tol)
+        if len(moved) == 0:
+            return 'identical', None
+
+        if self.assume_invariant and not self.reference['atoms'].pbc.any():
+            rotation = rigid_transform(ref_positions, positions, tol=self.rigid_tol)
+            if rotation is not None:
+                return 'rigid', rotation
+
+        # a cluster is never smaller than the moved atoms
+        if self.receptive_field is not None and not self.reference['atoms'].pbc.any() and len(moved) < self.max_fraction * len(positions):
+            region, _ = self._region(moved, positions)
+            if len(region['indices']) < self.max_fraction * len(positions):
+                return 'fragment', region
+        return 'full', None
+
+    #=====================#
+    #       EVALUATE      #
+    #=====================#
+
+    def evaluate_batch(self, atoms, positions, compute_forces=False, batch_size=None):
+        '''
+        Incremental counterpart of `batch_scan.evaluate_batch`: points of the
+        same cluster are evaluated together, full points in one batch.
+        '''
+
+        positions = np.asarray(positions, dtype=float)
+        batch_size = self.batch_size if batch_size is None else batch_size
+        if not self._matches_reference(atoms):
+            self.set_reference(atoms)
+        ref = self.reference
+
+        n_points = len(positions)
+        energies = np.full(n_points, ref['energy'])
+        forces = np.repeat(ref['forces'][None], n_points, axis=0)
+
+        full = []
+        regions = {}
+        for i, pos in enumerate(positions):
+            kind, data = self._classify(pos)
+            self.stats[kind] += 1
+            self.stats['atoms_full'] += len(atoms)
+            if kind == 'rigid':
+                forces[i] = ref['forces'] @ data.T
+            elif kind == 'fragment':
+                regions.setdefault(id(data), (data, []))[1].append(i)
+            elif kind == 'full':
+                full.append(i)
+
+        if len(full) > 0:
+            e, f = evaluate_batch(self.calc, ref['atoms'], positions[full], compute_forces=True, batch_size=batch_size)
+            energies[full] = e
+            forces[full] = f
+            self.stats['atoms_evaluated'] += len(full) * len(atoms)
+
+        for region, points in regions.values():
+            indices = region['indices']
+            cluster = ref['atoms'][indices]
+            stack = positions[points][:, indices]
+            new_region = region['energy'] is None
+            if new_region:
+                stack = np.concatenate([ref['positions'][indices][None], stack])
+            e, f = evaluate_batch(self.calc, cluster, stack, compute_forces=True, batch_size=batch_size)
+            if new_region:
+                region['energy'], region['forces'] = e[0], f[0]
+                e, f = e[1:], f[1:]
+            energies[points] += e - region['energy']
+            forces[np.ix_(points, indices)] += f - region['forces']
+            self.stats['atoms_evaluated'] += len(stack) * len(indices)
+
+        return energies, (forces if compute_forces else None)
+
+    def calculate(self, atoms=None, properties=['energy'], system_changes=all_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+
+        energies, forces = self.evaluate_batch(self.atoms, self.atoms.get_positions()[None], compute_forces=True)
+        self.results['energy'] = energies[0]
+        self.results['free_energy'] = energies[0]
+        self.results['forces'] = forces[0]
+
+    def print_stats(self):
+        counts = ', '.join(f'{kind} {self.stats[kind]}' for kind in KINDS)
+        saved = 1. - self.stats['atoms_evaluated'] / self.stats['atoms_full'] if self.stats['atoms_full'] > 0 else 0.
+        print(f'{counts}; {self.stats["regions_built"]} regions built, {100 * saved:.1f}% of the atom evaluations saved')
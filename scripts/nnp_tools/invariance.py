@@ -0,0 +1,244 @@
+'''
+Batched SO(3), translation and permutation invariance tests.
+
+Instead of rotating one molecule about a single axis in fixed steps (as
+`evaluate_rotation` in cosan_scan.ipynb does), many random rigid rotations,
+translations or permutations of identical atoms are generated at once and
+evaluated in batches with `batch_scan.evaluate_batch`. For every sample we
+measure
+
+- the energy deviation |E - E_ref|,
+- the force equivariance error max|F - T(F_ref)|, with T the same transformation,
+- the net force |sum F| and the net torque |sum r x F| (zero for a model that
+  respects translational and rotational invariance).
+
+Samples are drawn in rounds and the test stops as soon as every metric's
+confidence interval lies entirely below (invariant) or above (violated) its
+tolerance, so clearly (non-)invariant models are resolved in one or two batches.
+'''
+
+from statistics import NormalDist
+
+import numpy as np
+
+from .batch_scan import evaluate_batch
+
+
+TRANSFORMS = ['rotation', 'translation', 'permutation']
+
+DEFAULT_TOLERANCES = {
+    'energy': 1e-4,         # eV
+    'force_error': 1e-3,    # eV/Å
+    'net_force': 1e-3,      # eV/Å
+    'net_torque': 1e-3,     # eV
+}
+
+
+#========================#
+#       TRANSFORMS       #
+#========================#
+
+def random_rotations(n, rng):
+    '''
+    Definition
+    ----------
+    n uniformly distributed rotation matrices (n x 3 x 3), from random unit quaternions.
+    '''
+
+    q = rng.normal(size=(n, 4))
+    q /= np.linalg.norm(q, axis=1)[:, None]
+    w, x, y, z = q.T
+    return np.stack([
+        np.stack([1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)], axis=-1),
+        np.stack([2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)], axis=-1),
+        np.stack([2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)], axis=-1),
+    ], axis=1)
+
+
+def random_translations(n, max_translation, rng):
+    '''
+    n random rigid translations (n x 3) of length up to max_translation (Å).
+    '''
+    directions = rng.normal(size=(n, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    return directions * rng.uniform(0., max_translation, size=(n, 1))
+
+
+def random_permutations(numbers, n, rng):
+    '''
+    n random permutations (n x n_atoms) that only exchange atoms of the same element.
+    '''
+
+    numbers = np.asarray(numbers)
+    permutations = np.tile(np.arange(len(numbers)), (n, 1))
+    for z in np.unique(numbers):
+        idx = np.flatnonzero(numbers == z)
+        if len(idx) < 2:
+            continue
+        for k in range(n):
+            permutations[k, idx] = rng.permutation(idx)
+    return permutations
+
+
+def _transform(positions, transform, n, rng, numbers, max_translation):
+    '''
+    Returns the transformed positions (n x n_atoms x 3) and a function that maps
+    the reference forces to the expected forces of each sample.
+    '''
+
+    center = positions.mean(axis=0)
+
+    if transform == 'rotation':
+        rotations = random_rotations(n, rng)
+        new = np.einsum('kij,aj->kai', rotations, positions - center) + center
+        return new, lambda f: np.einsum('kij,aj->kai', rotations, f)
+
+    if transform == 'translation':
+        shifts = random_translations(n, max_translation, rng)
+        new = positions[None, :, :] + shifts[:, None, :]
+        return new, lambda f: np.repeat(f[None], n, axis=0)
+
+    if transform == 'permutation':
+        permutations = random_permutations(numbers, n, rng)
+        # sample k places the atom perm[i] at position i: same species order, relabelled geometry
+        new = positions[permutations]
+        return new, lambda f: f[permutations]
+
+    raise ValueError(f'unknown transform {transform}, use one of {TRANSFORMS}')
+
+
+#=====================#
+#       METRICS       #
+#=====================#
+
+def _metrics(positions, energies, forces, e_ref, expected_forces):
+    '''
+    Per-sample violation metrics.
+    '''
+
+    center = positions.mean(axis=1, keepdims=True)
+    net_force = forces.sum(axis=1)
+    net_torque = np.cross(positions - center, forces).sum(axis=1)
+    return {
+        'energy': np.abs(energies - e_ref),
+        'force_error': np.abs(forces - expected_forces).max(axis=(1, 2)),
+        'net_force': np.linalg.norm(net_force, axis=1),
+        'net_torque': np.linalg.norm(net_torque, axis=1),
+    }
+
+
+def _interval(values, z):
+    mean = values.mean()
+    if len(values) < 2:
+        return mean, np.inf
+    return mean, z * values.std(ddof=1) / np.sqrt(len(values))
+
+
+def check_invariance(atoms, calc, transform='rotation', tolerances=None, confidence=0.95, batch_size=32, max_samples=512, max_translation=10., seed=0, verbose=False):
+    '''
+    Definition
+    ----------
+    Tests one calculator against random transforms ('rotation', 'translation'
+    or 'permutation') of atoms, in rounds of batch_size samples, until every
+    metric is statistically resolved against its tolerance or max_samples is reached.
+
+    Returns a dict metric -> {'mean', 'ci' (half width), 'max', 'verdict'} with
+    verdict 'invariant', 'violated' or 'unresolved', plus 'n_samples' and the
+    spread (max - min) of the sampled energies.
+    '''
+
+    if tolerances is None:
+        tolerances = DEFAULT_TOLERANCES
+    z = NormalDist().inv_cdf(0.5 + confidence / 2.)
+    rng = np.random.default_rng(seed)
+
+    positions = atoms.get_positions()
+    numbers = atoms.get_atomic_numbers()
+
+    # reference geometry
+    e_ref, f_ref = evaluate_batch(calc, atoms, positions[None], compute_forces=True)
+    e_ref, f_ref = e_ref[0], f_ref[0]
+
+    samples = {key: [] for key in tolerances}
+    sampled_energies = [e_ref]
+    n_samples = 0
+    verdicts = {}
+
+    while n_samples < max_samples:
+        n = min(batch_size, max_samples - n_samples)
+        new_positions, expected = _transform(positions, transform, n, rng, numbers, max_translation)
+        energies, forces = evaluate_batch(calc, atoms, new_positions, compute_forces=True, batch_size=batch_size)
+        metrics = _metrics(new_positions, energies, forces, e_ref, expected(f_ref))
+        for key in samples:
+            samples[key].append(metrics[key])
+        sampled_energies.extend(energies)
+        n_samples += n
+
+        # stop once every confidence interval is on one side of its tolerance
+        verdicts = {}
+        for key, tol in tolerances.items():
+            mean, half = _interval(np.concatenate(samples[key]), z)
+            if mean + half < tol:
+                verdicts[key] = 'invariant'
+            elif mean - half > tol:
+                verdicts[key] = 'violated'
+            else:
+                verdicts[key] = 'unresolved'
+        if verbose:
+            print(f'{n_samples} samples: {verdicts}')
+        if 'unresolved' not in verdicts.values():
+            break
+
+    result = {'transform': transform, 'n_samples': n_samples, 'energy_spread': float(np.ptp(sampled_energies))}
+    for key, tol in tolerances.items():
+        values = np.concatenate(samples[key])
+        mean, half = _interval(values, z)
+        result[key] = {'mean': float(mean), 'ci': float(half), 'max': float(values.max()), 'tolerance': tol, 'verdict': verdicts[key]}
+    return result
+
+
+def screen_models(molecules, calculator_list, calculator_names, transforms=None, **kwargs):
+    '''
+    Definition
+    ----------
+    Runs `check_invariance` for every molecule (dict name -> Atoms), model and
+    transform. Failing calculators are reported and skipped. Returns a list of
+    result dicts with 'molecule' and 'model' keys added.
+    '''
+
+    if transforms is None:
+        transforms = TRANSFORMS
+
+    rows = []
+    for mol_name, atoms in molecules.items():
+        for calc_, name in zip(calculator_list, calculator_names):
+            for transform in transforms:
+                try:
+                    result = check_invariance(atoms, calc_, transform=transform, **kwargs)
+                except Exception as error:
+                    print(f'calculator {name} failed on {mol_name} ({transform}): {error}')
+                    break
+                result['molecule'] = mol_name
+                result['model'] = name
+                rows.append(result)
+    return rows
+
+
+def print_screen(rows):
+    '''
+    Summary table of `screen_models`: mean ± CI of every metric and its verdict.
+    '''
+
+    keys = list(DEFAULT_TOLERANCES)
+    header = f'{"molecule":<12}{"model":<12}{"transform":<13}{"n":>5}' + ''.join(f'{k:>26}' for k in keys)
+    print(header)
+    for row in rows:
+        line = f'{row["molecule"]:<12}{row["model"]:<12}{row["transform"]:<13}{row["n_samples"]:>5}'
+        for k in keys:
+            if k not in row:
+                line += f'{"-":>26}'
+                continue
+            m = row[k]
+            cell = f'{m["mean"]:.1e}±{m["ci"]:.0e} {m["verdict"][:3]}'
+            line += f'{cell:>26}'
+        print(line)
@@ -0,0 +1,207 @@
+'''
+Precision-adaptive evaluation: float32 everywhere, float64 where it matters.
+
+The notebooks build MACE with `default_dtype="float32"` and dihedrals.ipynb
+rebuilds `mace_off(..., default_dtype='float64')` by hand for the shallow
+torsional barriers. `AdaptivePrecisionCalculator` keeps both precision
+variants of a model loaded, evaluates the whole scan with the float32 one and
+re-evaluates in float64 only the points where float32 cannot resolve the PES:
+
+- energy differences within float32 noise between points `window` apart;
+- force norms below force_tol (near stationary points, where forces are
+  sums of large cancelling contributions), when forces are requested;
+- optionally (curvature=True), second differences of the energy with the
+  same stencil within float32 noise.
+
+The float32 noise of an energy E is taken as noise_factor * eps32 * |E|
+(eps32 = 1.2e-7), i.e. a few float32 roundings of the total energy.
+Differences between neighbours of a fine scan shrink with the spacing, so
+the stencil grows with it: by default window = n_points / 36 (one step of
+the 10 degree dihedral scans), and a 1 degree scan is promoted like a
+10 degree one instead of almost entirely.
+
+    calc = adaptive_calculator('MACE-OFF')
+    angles, energies, succ = batch_scan.evaluate_dihedral(molecule, ids, mask, [calc], ['MACE-OFF'], resolution=5)
+    calc.print_report()
+'''
+
+import numpy as np
+from ase.calculators.calculator import Calculator, all_changes
+
+from .batch_scan import evaluate_batch
+
+
+EPS32 = float(np.finfo(np.float32).eps)
+DEFAULT_NOISE_FACTOR = 8.
+DEFAULT_FORCE_TOL = 5e-3    # eV/Å
+REFERENCE_POINTS = 36       # scan points of one stencil step
+
+REASONS = ['energy_difference', 'curvature', 'force']
+
+
+#=======================#
+#       PROMOTION       #
+#=======================#
+
+def energy_noise(energies, noise_factor=DEFAULT_NOISE_FACTOR):
+    '''
+    Float32 noise (eV) of each energy.
+    '''
+    return noise_factor * EPS32 * np.abs(energies)
+
+
+def default_window(n_points):
+    '''
+    Stencil (in points) of the energy criteria for a scan of n_points.
+    '''
+    return max(1, int(round(n_points / REFERENCE_POINTS)))
+
+
+def promotion_mask(energies, forces=None, ordered=True, noise_factor=DEFAULT_NOISE_FACTOR, force_tol=DEFAULT_FORCE_TOL, window=None, curvature=False):
+    '''
+    Definition
+    ----------
+    Points of a float32 evaluation that need float64. energies (n_points) and
+    forces (n_points x n_atoms x 3 or None) come from the float32 model;
+    ordered means the points follow a scan coordinate, so energy differences
+    (and curvature, if enabled) between points window apart are meaningful.
+    window defaults to `default_window(n_points)`.
+
+    Returns the boolean mask of promoted points and a dict reason -> mask.
+    '''
+
+    energies = np.asarray(energies, dtype=float)
+    n = len(energies)
+    noise = energy_noise(energies, noise_factor)
+    reasons = {reason: np.zeros(n, dtype=bool) for reason in REASONS}
+
+    w = default_window(n) if window is None else window
+    if ordered and n > w:
+        # both ends of an unresolved difference
+        diff = np.abs(energies[w:] - energies[:-w]) < np.maximum(noise[w:], noise[:-w])
+        reasons['energy_difference'][w:] |= diff
+        reasons['energy_difference'][:-w] |= diff
+    if ordered and curvature and n > 2 * w:
+        # E[i-w] - 2 E[i] + E[i+w] carries ~2 noise units
+        second = np.abs(energies[:-2 * w] - 2 * energies[w:-w] + energies[2 * w:])
+        reasons['curvature'][w:-w] = second < 2 * noise[w:-w]
+    if forces is not None:
+        reasons['force'] = np.linalg.norm(forces, axis=2).max(axis=1) < force_tol
+
+    mask = np.zeros(n, dtype=bool)
+    for reason_mask in reasons.values():
+        mask |= reason_mask
+    return mask, reasons
+
+
+#========================#
+#       CALCULATOR       #
+#========================#
+
+class AdaptivePrecisionCalculator(Calculator):
+    '''
+    Definition
+    ----------
+    ASE calculator holding the float32 and float64 variants of one model.
+    Batched evaluations (`batch_scan` scans, through `evaluate_batch`) run in
+    float32 and promote the points selected by `promotion_mask`; single
+    `get_potential_energy`/`get_forces` calls apply the force criterion and
+    the energy difference with the previous call.
+
+    `stats` counts evaluated and promoted points (per reason);
+    `last_promoted` holds the indices promoted in the last batch.
+    '''
+
+    implemented_properties = ['energy', 'free_energy', 'forces']
+
+    def __init__(self, calc32, calc64, ordered=True, noise_factor=DEFAULT_NOISE_FACTOR, force_tol=DEFAULT_FORCE_TOL, window=None, curvature=False, **kwargs):
+        Calculator.__init__(self, **kwargs)
+        self.calc32 = calc32
+        self.calc64 = calc64
+        self.ordered = ordered
+        self.noise_factor = noise_factor
+        self.force_tol = force_tol
+        self.window = window
+        self.curvature = curvature
+        self.last_promoted = np.zeros(0, dtype=int)
+        self._previous_energy = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'points': 0, 'promoted': 0, **{reason: 0 for reason in REASONS}}
+
+    def _count(self, n_points, reasons):
+        self.stats['points'] += n_points
+        promoted = np.zeros(n_points, dtype=bool)
+        for reason, reason_mask in reasons.items():
+            self.stats[reason] += int(reason_mask.sum())
+            promoted |= reason_mask
+        self.stats['promoted'] += int(promoted.sum())
+        return promoted
+
+    def calculate(self, atoms=None, properties=['energy'], system_changes=all_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+
+        need_forces = 'forces' in properties
+        energies, forces = evaluate_batch(self.calc32, self.atoms, self.atoms.get_positions()[None], compute_forces=need_forces)
+
+        reasons = {reason: np.zeros(1, dtype=bool) for reason in REASONS}
+        noise = energy_noise(energies[0], self.noise_factor)
+        if self.ordered and self._previous_energy is not None:
+            reasons['energy_difference'][0] = abs(energies[0] - self._previous_energy) < noise
+        if need_forces:
+            reasons['force'][0] = np.linalg.norm(forces[0], axis=1).max() < self.force_tol
+        self._previous_energy = energies[0]
+
+        if self._count(1, reasons)[0]:
+            energies, forces = evaluate_batch(self.calc64, self.atoms, self.atoms.get_positions()[None], compute_forces=need_forces)
+
+        self.results['energy'] = energies[0]
+        self.results['free_energy'] = energies[0]
+        if need_forces:
+            self.results['forces'] = forces[0]
+
+    def evaluate_batch(self, atoms, positions, compute_forces=False, batch_size=None):
+        '''
+        Adaptive counterpart of `batch_scan.evaluate_batch`: all conformers in
+        float32, then the promoted ones again in float64.
+        '''
+
+        positions = np.asarray(positions, dtype=float)
+        energies, forces = evaluate_batch(self.calc32, atoms, positions, compute_forces=compute_forces, batch_size=batch_size)
+
+        _, reasons = promotion_mask(energies, forces, ordered=self.ordered, noise_factor=self.noise_factor, force_tol=self.force_tol, window=self.window, curvature=self.curvature)
+        promoted = np.flatnonzero(self._count(len(positions), reasons))
+        self.last_promoted = promoted
+        if len(promoted) > 0.5 * len(positions):
+            print(f'{len(promoted)}/{len(positions)} points promoted to float64: float32 cannot resolve this scan, '
+                  f'consider the float64 model directly')
+
+        if len(promoted) > 0:
+            energies64, forces64 = evaluate_batch(self.calc64, atoms, positions[promoted], compute_forces=compute_forces, batch_size=batch_size)
+            energies[promoted] = energies64
+            if compute_forces:
+                forces[promoted] = forces64
+        return energies, forces
+
+    def print_report(self):
+        n, promoted = self.stats['points'], self.stats['promoted']
+        fraction = promoted / n if n > 0 else 0.
+        reasons = ', '.join(f'{reason} {self.stats[reason]}' for reason in REASONS)
+        print(f'{promoted}/{n} points promoted to float64 ({100 * fraction:.1f}%): {reasons}')
+
+
+def adaptive_calculator(name, device='cpu', use_artifacts=True, **kwargs):
+    '''
+    Definition
+    ----------
+    AdaptivePrecisionCalculator of a registered model, with both precision
+    variants taken from the registry (and kept in its session cache).
+    Models only available in float32 (ORB) raise a ValueError.
+    '''
+
+    from .registry import get_calculator
+
+    calc32 = get_calculator(name, device=device, dtype='float32', use_artifacts=use_artifacts)
+    calc64 = get_calculator(name, device=device, dtype='float64', use_artifacts=use_artifacts)
+    return AdaptivePrecisionCalculator(calc32, calc64, **kwargs)
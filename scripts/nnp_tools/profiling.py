@@ -0,0 +1,341 @@
+'''
+Hot-path instrumentation of ASE calculators.
+
+`InstrumentedCalculator` wraps any calculator of the project (the torchani
+`.ase()` calculators, `mace_mp`/`mace_off`, `ORBCalculator`) and records, per call,
+
+- the time spent in `check_state` and in the wrapped `calculate`, and how many
+  `calculate` calls recomputed a geometry that was just computed (e.g. energy
+  and forces requested separately);
+- the forward pass of the torch model and of each of its submodules (ANI
+  neighbor list, AEV computer and networks; MACE embeddings, interactions and
+  readouts; ORB encoder and GNN stacks), with the size of the tensors they return;
+- force autograd (`torch.autograd.grad`) and, when the packages are loaded,
+  MACE neighbor lists and ORB graph construction;
+- any user phase, e.g. trajectory writes through `instrument_writer`.
+
+Events are kept in a `Tracer` that prints a summary table and writes JSON or a
+Chrome trace (open in chrome://tracing or https://ui.perfetto.dev). When the
+instrumentation is disabled no hook is installed and every property request
+goes straight to the wrapped calculator.
+
+    tracer = Tracer()
+    molecule.calc = InstrumentedCalculator(ani2x.ase(), tracer)
+    ... scan or MD ...
+    tracer.print_summary()
+    tracer.to_chrome_trace('scan_trace.json')
+'''
+
+import sys
+import json
+import time
+import threading
+from contextlib import nullcontext
+
+import numpy as np
+from ase.calculators.calculator import Calculator, all_changes
+
+
+_NULL = nullcontext()
+
+# (module, function, phase) patched while an instrumented call runs, if the module is loaded
+FUNCTION_PHASES = [
+    ('torch.autograd', 'grad', 'autograd'),
+    ('mace.data.atomic_data', 'get_neighborhood', 'neighbor_list'),
+    ('orb_models.forcefield.calculator', 'ase_atoms_to_atom_graphs', 'graph_build'),
+]
+
+
+#===================#
+#       TRACER      #
+#===================#
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer, self.name, self.cat, self.args = tracer, name, cat, args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add_event(self.name, self.cat, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+
+class Tracer:
+    '''
+    Definition
+    ----------
+    Collects timed events (name, category, start, duration, args) and counters.
+    `span(name)` is a context manager timing a phase; when disabled it returns
+    a shared no-op context.
+    '''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.events = []
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+
+    def span(self, name, cat='calc', **args):
+        if not self.enabled:
+            return _NULL
+        return _Span(self, name, cat, args)
+
+    def add_event(self, name, cat, start, duration, args=None):
+        with self._lock:
+            self.events.append((name, cat, start, duration, threading.get_ident(), args or {}))
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        self.events = []
+        self.counters = {}
+        self._origin = time.perf_counter_ns()
+
+    def summary(self):
+        '''
+        Per phase: number of calls, total, mean and max time (ms) and total tensor bytes.
+        '''
+
+        phases = {}
+        for name, cat, _, duration, _, args in self.events:
+            entry = phases.setdefault(name, {'cat': cat, 'calls': 0, 'total_ms': 0., 'max_ms': 0., 'bytes': 0})
+            entry['calls'] += 1
+            entry['total_ms'] += duration / 1e6
+            entry['max_ms'] = max(entry['max_ms'], duration / 1e6)
+            entry['bytes'] += args.get('bytes', 0)
+        for entry in phases.values():
+            entry['mean_ms'] = entry['total_ms'] / entry['calls']
+        return phases
+
+    def print_summary(self):
+        phases = self.summary()
+        print(f'{"phase":<40}{"calls":>8}{"total (ms)":>13}{"mean (ms)":>12}{"max (ms)":>11}{"MB out":>10}')
+        for name, e in sorted(phases.items(), key=lambda item: -item[1]['total_ms']):
+            print(f'{name:<40}{e["calls"]:>8}{e["total_ms"]:>13.2f}{e["mean_ms"]:>12.3f}{e["max_ms"]:>11.3f}{e["bytes"]/1024**2:>10.2f}')
+        for name, value in self.counters.items():
+            print(f'{name}: {value}')
+
+    def to_json(self, path):
+        '''
+        Structured trace: summary, counters and raw events (times in µs).
+        '''
+        events = [{'name': n, 'cat': c, 'ts': (s - self._origin) / 1e3, 'dur': d / 1e3, 'tid': t, 'args': a} for n, c, s, d, t, a in self.events]
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'counters': self.counters, 'events': events}, f, indent=1)
+
+    def to_chrome_trace(self, path):
+        '''
+        Chrome trace event format (complete events), nested phases shown as a flame graph.
+        '''
+        events = [{'name': n, 'cat': c, 'ph': 'X', 'ts': (s - self._origin) / 1e3, 'dur': d / 1e3, 'pid': 0, 'tid': t, 'args': a} for n, c, s, d, t, a in self.events]
+        for name, value in self.counters.items():
+            events.append({'name': name, 'ph': 'C', 'ts': 0, 'pid': 0, 'args': {name: value}})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def _tensor_bytes(obj):
+    if hasattr(obj, 'element_size') and hasattr(obj, 'numel'):
+        return obj.element_size() * obj.numel()
+    if isinstance(obj, (tuple, list)):
+        return sum(_tensor_bytes(o) for o in obj)
+    if isinstance(obj, dict):
+        return sum(_tensor_bytes(o) for o in obj.values())
+    return 0
+
+
+#==========================#
+#       INSTRUMENTED       #
+#==========================#
+
+def _torch_modules(calc):
+    '''
+    Root torch modules of a calculator: `model` (ANI, ORB) or `models` (MACE).
+    '''
+
+    try:
+        import torch
+    except ImportError:
+        return []
+
+    roots = []
+    for attr in ['model', 'models']:
+        value = getattr(calc, attr, None)
+        values = value if isinstance(value, (list, tuple)) else [value]
+        roots.extend((f'{attr}[{i}]' if len(values) > 1 else attr, v) for i, v in enumerate(values) if isinstance(v, torch.nn.Module))
+    return roots
+
+
+def _geometry_key(atoms):
+    return (atoms.numbers.tobytes(), atoms.positions.tobytes(), np.asarray(atoms.cell).tobytes(), atoms.pbc.tobytes())
+
+
+class InstrumentedCalculator(Calculator):
+    '''
+    Definition
+    ----------
+    Wraps an ASE calculator and records its hot path in a Tracer (a new one
+    if not given). module_depth sets how deep torch submodules are timed
+    (1: direct children of the model). `enable()`/`disable()` switch the
+    instrumentation on and off.
+    '''
+
+    def __init__(self, calc, tracer=None, enabled=True, module_depth=1, **kwargs):
+        Calculator.__init__(self, **kwargs)
+        self.calc = calc
+        self.implemented_properties = list(calc.implemented_properties)
+        self.tracer = Tracer(enabled) if tracer is None else tracer
+        self.module_depth = module_depth
+        self.enabled = False
+        self._handles = []
+        self._last_key = None
+        if enabled:
+            self.enable()
+
+    #========================#
+    #       INSTALLING       #
+    #========================#
+
+    def _hook_modules(self):
+        tracer = self.tracer
+        starts = {}
+
+        def pre_hook(name):
+            def hook(module, inputs):
+                starts.setdefault(name, []).append(time.perf_counter_ns())
+            return hook
+
+        def post_hook(name):
+            def hook(module, inputs, output):
+                start = starts[name].pop()
+                tracer.add_event(name, 'forward', start, time.perf_counter_ns() - start, {'bytes': _tensor_bytes(output)})
+            return hook
+
+        for root_name, root in _torch_modules(self.calc):
+            modules = [(f'forward/{root_name}', root)]
+            for child_name, child in root.named_modules():
+                if child_name != '' and child_name.count('.') < self.module_depth:
+                    modules.append((f'forward/{root_name}.{child_name}', child))
+            for name, module in modules:
+                self._handles.append(module.register_forward_pre_hook(pre_hook(name)))
+                self._handles.append(module.register_forward_hook(post_hook(name)))
+
+    def _patch_methods(self):
+        '''
+        Time the check_state and calculate of the wrapped calculator (instance attributes).
+        '''
+
+        calc, tracer = self.calc, self.tracer
+        check_state, calculate = calc.check_state, calc.calculate
+
+        def timed_check_state(atoms, tol=1e-15):
+            with tracer.span('check_state'):
+                return check_state(atoms, tol)
+
+        def timed_calculate(atoms=None, properties=['energy'], system_changes=all_changes):
+            key = _geometry_key(atoms) if atoms is not None else None
+            redundant = key is not None and key == self._last_key
+            if redundant:
+                tracer.count('redundant_recomputes')
+            tracer.count('calculate_calls')
+            with tracer.span('calculate', properties=list(properties), n_atoms=len(atoms) if atoms is not None else 0, redundant=redundant):
+                calculate(atoms, properties, system_changes)
+            self._last_key = key
+
+        calc.check_state = timed_check_state
+        calc.calculate = timed_calculate
+
+    def _patch_functions(self):
+        patched = []
+        for module_name, attr, phase in FUNCTION_PHASES:
+            module = sys.modules.get(module_name)
+            original = getattr(module, attr, None) if module is not None else None
+            if original is None:
+                continue
+
+            def timed(*args, _original=original, _phase=phase, **kwargs):
+                with self.tracer.span(_phase):
+                    return _original(*args, **kwargs)
+
+            setattr(module, attr, timed)
+            patched.append((module, attr, original))
+        return patched
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.tracer.enabled = True
+        self._hook_modules()
+        self._patch_methods()
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.tracer.enabled = False
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        for attr in ['check_state', 'calculate']:
+            self.calc.__dict__.pop(attr, None)
+
+    #=====================#
+    #       CALCULATE     #
+    #=====================#
+
+    # the wrapper is a proxy: state and results live in the wrapped calculator,
+    # so a disabled wrapper only adds one function call per property
+
+    def check_state(self, atoms, tol=1e-15):
+        return self.calc.check_state(atoms, tol)
+
+    def get_property(self, name, atoms=None, allow_calculation=True):
+        # reads without calculation (e.g. trajectory writers) are not traced
+        if not self.enabled or not allow_calculation:
+            value = self.calc.get_property(name, atoms, allow_calculation)
+        else:
+            self.tracer.count('calls')
+            patched = self._patch_functions()
+            try:
+                with self.tracer.span('call', property=name):
+                    value = self.calc.get_property(name, atoms, allow_calculation)
+            finally:
+                for module, attr, original in patched:
+                    setattr(module, attr, original)
+
+        self.atoms = self.calc.atoms
+        self.results = self.calc.results
+        return value
+
+    def calculate(self, atoms=None, properties=['energy'], system_changes=all_changes):
+        for name in properties:
+            self.get_property(name, atoms)
+
+    def reset(self):
+        Calculator.reset(self)
+        if hasattr(self, 'calc'):
+            self.calc.reset()
+
+
+def instrument_writer(writer, tracer, name='io/trajectory'):
+    '''
+    Times the `write` method of a writer (e.g. `ase.io.Trajectory` attached to an MD run).
+    '''
+
+    write = writer.write
+
+    def timed_write(*args, **kwargs):
+        with tracer.span(name, cat='io'):
+            return write(*args, **kwargs)
+
+    writer.write = timed_write
+    return writer
@@ -0,0 +1,189 @@
+'''
+Lazy, name-based registry of the models used in the project.
+
+Names match the `color_dict` keys of the notebooks. A model is only imported
+and built the first time it is requested and is then kept for the rest of the
+session, so `get_calculator('MACE-OFF')` does not pay for the ANI or ORB imports.
+
+The ANI models are additionally stored as TorchScript artifacts (see
+models/ase_ani/test_notebooks/jit.ipynb): later startups load the compiled
+model instead of rebuilding the ensemble from the NeuroChem files. MACE and ORB
+already load a serialized checkpoint from their own download cache, so there
+is nothing to gain from a second artifact.
+
+    calculator_list, calculator_names = get_calculators(['ANI-2x', 'MACE-OFF'])
+    startup_report()
+'''
+
+import os
+import time
+from functools import partial
+
+
+MODEL_NAMES = ['ANI-1x', 'ANI-1ccx', 'ANI-2x', 'MACE-MP', 'MACE-OFF', 'ORB-V2', 'ORB-D3-V2']
+
+COLOR_DICT = {
+    'ANI-1x': 'darkviolet',
+    'ANI-1ccx': 'crimson',
+    'ANI-2x': 'deeppink',
+    'MACE-MP': 'darkgreen',
+    'MACE-OFF':  'mediumseagreen',
+    'ORB-V2': 'royalblue',
+    'ORB-D3-V2': 'darkblue',
+}
+
+DEFAULT_ARTIFACT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'nnp_tools', 'artifacts')
+
+# built calculators and startup times of the current session
+_SESSION = {}
+STARTUP_TIMES = {}
+
+
+#=====================#
+#       BUILDERS      #
+#=====================#
+
+def _ani_model(name):
+    from torchani.models import ANI1x, ANI1ccx, ANI2x
+
+    model_cls = {'ANI-1x': ANI1x, 'ANI-1ccx': ANI1ccx, 'ANI-2x': ANI2x}[name]
+    return model_cls(periodic_table_index=True)
+
+
+def _build_ani(name, device, dtype, artifact_dir):
+    '''
+    Build an ANI calculator, going through a TorchScript artifact when possible.
+    Returns the calculator and 'artifact' or 'built'.
+    '''
+
+    import torch
+    from torchani.ase import Calculator
+
+    torch_dtype = getattr(torch, dtype)
+    artifact = None
+    if artifact_dir is not None:
+        artifact = os.path.join(artifact_dir, f'{name}_{dtype}.pt')
+
+    if artifact is not None and os.path.isfile(artifact):
+        try:
+            # the scripted model keeps its symbols and periodic_table_index
+            return Calculator(torch.jit.load(artifact, map_location=device)), 'artifact'
+        except Exception as error:
+            print(f'could not load {artifact}, rebuilding {name}: {error}')
+
+    model = _ani_model(name).to(device).to(torch_dtype)
+
+    if artifact is not None:
+        try:
+            if not os.path.isdir(artifact_dir):
+                os.makedirs(artifact_dir)
+            torch.jit.save(torch.jit.script(model), artifact)
+        except Exception as error:
+            print(f'could not store a TorchScript artifact for {name}: {error}')
+
+    return model.ase(), 'built'
+
+
+def _build_mace(name, device, dtype):
+    from mace.calculators import mace_mp, mace_off
+
+    if name == 'MACE-MP':
+        return mace_mp(model='medium', dispersion=False, default_dtype=dtype, device=device)
+    return mace_off(model='medium', default_dtype=dtype, device=device)
+
+
+def _build_orb(name, device, dtype):
+    from orb_models.forcefield.pretrained import orb_v2, orb_d3_v2
+    from orb_models.forcefield.calculator import ORBCalculator
+
+    if dtype != 'float32':
+        raise ValueError(f'{name} is only available in float32')
+
+    model = orb_v2(device=device) if name == 'ORB-V2' else orb_d3_v2(device=device)
+    return ORBCalculator(model, device=device)
+
+
+#=====================#
+#       REGISTRY      #
+#=====================#
+
+def available_models():
+    return list(MODEL_NAMES)
+
+
+def get_calculator(name, device='cpu', dtype='float32', use_artifacts=True, artifact_dir=None):
+    '''
+    Definition
+    ----------
+    Returns the ASE calculator of a registered model, building it on first use.
+
+    Calculators are cached per (name, device, dtype) for the session. The time
+    spent to obtain the calculator is stored in STARTUP_TIMES.
+    '''
+
+    if name not in MODEL_NAMES:
+        raise KeyError(f'unknown model {name}, available: {MODEL_NAMES}')
+
+    key = (name, device, dtype)
+    if key in _SESSION:
+        return _SESSION[key]
+
+    if artifact_dir is None and use_artifacts:
+        artifact_dir = DEFAULT_ARTIFACT_DIR
+
+    start = time.perf_counter()
+    if name.startswith('ANI'):
+        calc, source = _build_ani(name, device, dtype, artifact_dir if use_artifacts else None)
+    elif name.startswith('MACE'):
+        calc, source = _build_mace(name, device, dtype), 'built'
+    else:
+        calc, source = _build_orb(name, device, dtype), 'built'
+    elapsed = time.perf_counter() - start
+
+    _SESSION[key] = calc
+    STARTUP_TIMES[key] = {'time': elapsed, 'source': source}
+    return calc
+
+
+def get_calculators(names=None, device='cpu', dtype='float32', use_artifacts=True):
+    '''
+    Definition
+    ----------
+    Returns calculator_list and calculator_names for the requested models (all
+    by default), in the same form as the notebooks define them.
+    '''
+
+    if names is None:
+        names = MODEL_NAMES
+    calculator_list = [get_calculator(name, device=device, dtype=dtype, use_artifacts=use_artifacts) for name in names]
+    return calculator_list, list(names)
+
+
+def calculator_factory(name, device='cpu', dtype='float32', use_artifacts=True):
+    '''
+    Definition
+    ----------
+    Picklable factory of a registered model, e.g. for `sweep.ModelSweep`.
+    '''
+
+    if name not in MODEL_NAMES:
+        raise KeyError(f'unknown model {name}, available: {MODEL_NAMES}')
+    return partial(get_calculator, name, device=device, dtype=dtype, use_artifacts=use_artifacts)
+
+
+def clear_session():
+    '''
+    Forget the calculators built in this session (artifacts on disk are kept).
+    '''
+    _SESSION.clear()
+    STARTUP_TIMES.clear()
+
+
+def startup_report():
+    '''
+    Print the startup time of every model built in this session.
+    '''
+
+    print(f'{"model":<12}{"device":>8}{"dtype":>10}{"source":>10}{"startup (s)":>13}')
+    for (name, device, dtype), entry in STARTUP_TIMES.items():
+        print(f'{name:<12}{device:>8}{dtype:>10}{entry["source"]:>10}{entry["time"]:>13.2f}')
@@ -0,0 +1,350 @@
+'''
+Multi-replica batched molecular dynamics.
+
+`run_md_simulation` (models/ase_orbital/ase_orbital.ipynb) and the Langevin runs
+of the ANI/MACE notebooks advance one system through one model per step.
+`ReplicaMD` advances N replicas of the same system together (temperature
+ladders, different seeds, or the same box under different models): the
+coordinates of all replicas sharing a calculator are stacked into one
+`batch_scan.evaluate_batch` call per step, and the integrator works on the
+(n_replicas x n_atoms x 3) arrays at once:
+
+- friction=None: velocity Verlet (NVE);
+- friction > 0: Langevin (BAOAB splitting), one temperature per replica.
+
+Constraints of the atoms (e.g. the rigid waters of the TIP3P boxes) are
+applied to every replica as in ASE's VelocityVerlet/Langevin: positions after
+each drift (RATTLE, with the matching momentum correction) and momenta after
+each kick and thermostat step.
+
+Frames of all replicas are appended through one `ReplicaWriter`, and the run
+reports the aggregate ns/day over all replicas.
+
+    md = ReplicaMD(atoms, orb_calc, n_replicas=32, temperatures=300, timestep=0.5 * units.fs, friction=0.01 / units.fs)
+    md.attach_writer('NaClWater_replicas', interval=5)
+    md.run(100)
+    replica_0 = read_replica('NaClWater_replicas', 0)
+'''
+
+import os
+import json
+import time
+
+import numpy as np
+from ase import Atoms, units
+
+from .batch_scan import evaluate_batch
+
+
+#===================#
+#       WRITER      #
+#===================#
+
+class ReplicaWriter:
+    '''
+    Definition
+    ----------
+    Shared writer of all replicas: every frame appends the positions
+    (n_replicas x n_atoms x 3) and the potential/kinetic energies and
+    temperatures of all replicas to flat binary files in one directory,
+    described by a `manifest.json`. Read back with `read_replicas`.
+    '''
+
+    def __init__(self, directory, atoms, n_replicas, labels=None):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.manifest = {
+            'numbers': [int(z) for z in atoms.get_atomic_numbers()],
+            'cell': np.array(atoms.get_cell()).tolist(),
+            'pbc': [bool(p) for p in atoms.get_pbc()],
+            'n_replicas': n_replicas,
+            'labels': labels if labels is not None else [str(r) for r in range(n_replicas)],
+            'n_frames': 0,
+            'steps': [],
+        }
+        self._positions = open(os.path.join(directory, 'positions.bin'), 'wb')
+        self._energies = open(os.path.join(directory, 'energies.bin'), 'wb')
+
+    def write(self, step, positions, epot, ekin, temperatures):
+        self._positions.write(np.ascontiguousarray(positions, dtype=np.float64).tobytes())
+        self._energies.write(np.stack([epot, ekin, temperatures], axis=1).astype(np.float64).tobytes())
+        self.manifest['n_frames'] += 1
+        self.manifest['steps'].append(int(step))
+
+    def flush(self):
+        self._positions.flush()
+        self._energies.flush()
+        path = os.path.join(self.directory, 'manifest.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        self.flush()
+        self._positions.close()
+        self._energies.close()
+
+
+def read_replicas(directory):
+    '''
+    Definition
+    ----------
+    Memory-mapped frames of a ReplicaWriter directory: dict with the manifest,
+    positions (n_frames x n_replicas x n_atoms x 3) and energies
+    (n_frames x n_replicas x 3: potential, kinetic, temperature).
+    '''
+
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    n_frames, n_rep, n_atoms = manifest['n_frames'], manifest['n_replicas'], len(manifest['numbers'])
+    positions = np.memmap(os.path.join(directory, 'positions.bin'), dtype=np.float64, mode='r', shape=(n_frames, n_rep, n_atoms, 3))
+    energies = np.memmap(os.path.join(directory, 'energies.bin'), dtype=np.float64, mode='r', shape=(n_frames, n_rep, 3))
+    return {'manifest': manifest, 'positions': positions, 'energies': energies}
+
+
+def read_replica(directory, replica):
+    '''
+    List of Atoms of one replica (e.g. for `ase.visualize.view` or `ase.io.write`).
+    '''
+
+    data = read_replicas(directory)
+    manifest = data['manifest']
+    return [Atoms(numbers=manifest['numbers'], positions=pos[replica], cell=manifest['cell'], pbc=manifest['pbc']) for pos in data['positions']]
+
+
+#===================#
+#       DRIVER      #
+#===================#
+
+class ReplicaMD:
+    '''
+    Definition
+    ----------
+    N replicas of one system integrated together.
+
+    atoms is one Atoms (copied n_replicas times, by default one per
+    calculator) or a list of Atoms with the same atoms and cell. calculators
+    is one calculator for all replicas or one per replica; replicas sharing a
+    calculator are evaluated in one batch.
+    temperatures (K) is a scalar or one value per replica; initial velocities
+    are Maxwell-Boltzmann at that temperature (one seed per replica) unless
+    the atoms already carry momenta. timestep and friction are in ASE units,
+    as in the notebooks (0.5 * units.fs, 0.01 / units.fs).
+    The constraints of each replica are kept and applied during the run.
+    '''
+
+    def __init__(self, atoms, calculators, n_replicas=None, temperatures=300., timestep=0.5 * units.fs, friction=None, fixcm=True, seed=0, batch_size=None, labels=None):
+
+        if isinstance(atoms, Atoms):
+            if n_replicas is None:
+                n_replicas = len(calculators) if isinstance(calculators, (list, tuple)) else 1
+            atoms = [atoms.copy() for _ in range(n_replicas)]
+        n_replicas = len(atoms)
+        self.template = atoms[0].copy()
+        self.n_dof = self.template.get_number_of_degrees_of_freedom()
+        # the replicas keep the constraints, evaluations and frames use the bare atoms
+        self.constrained = [a.copy() for a in atoms] if any(a.constraints for a in atoms) else None
+        self.template.set_constraint()
+        for a in atoms[1:]:
+            if not np.array_equal(a.numbers, self.template.numbers) or not np.allclose(a.cell, self.template.cell):
+                raise ValueError('all replicas must have the same atoms and cell')
+
+        if not isinstance(calculators, (list, tuple)):
+            calculators = [calculators] * n_replicas
+        if len(calculators) != n_replicas:
+            raise ValueError(f'{len(calculators)} calculators for {n_replicas} replicas')
+
+        # replicas sharing a calculator are evaluated together
+        self.groups = {}
+        for r, calc in enumerate(calculators):
+            self.groups.setdefault(id(calc), (calc, []))[1].append(r)
+
+        self.n_replicas = n_replicas
+        self.labels = labels
+        self.temperatures = np.broadcast_to(np.asarray(temperatures, dtype=float), (n_replicas,)).copy()
+        self.dt = timestep
+        self.friction = friction
+        self.fixcm = fixcm
+        self.batch_size = batch_size
+        self.rng = [np.random.default_rng(seed + r) for r in range(n_replicas)]
+
+        self.masses = self.template.get_masses()[None, :, None]
+        self.positions = np.array([a.get_positions() for a in atoms])
+        self.momenta = np.zeros_like(self.positions)
+        for r, a in enumerate(atoms):
+            if a.has('momenta') and np.any(a.get_momenta()):
+                self.momenta[r] = a.get_momenta()
+            else:
+                self.momenta[r] = self._maxwell_boltzmann(r)
+        if fixcm:
+            self._remove_com_momentum()
+        self._constrain_momenta()
+
+        self.nsteps = 0
+        self.writer = None
+        self.interval = 1
+        self.observers = []
+        self.timings = {'forces': 0., 'integrate': 0., 'write': 0.}
+
+        self.energies, self.forces = self._compute_forces()
+
+    #=====================#
+    #       HELPERS       #
+    #=====================#
+
+    def _maxwell_boltzmann(self, r):
+        kT = units.kB * self.temperatures[r]
+        return self.rng[r].normal(size=self.positions[r].shape) * np.sqrt(self.masses[0] * kT)
+
+    def _remove_com_momentum(self):
+        total = self.momenta.sum(axis=1, keepdims=True)
+        self.momenta -= self.masses * total / self.masses.sum()
+
+    def _compute_forces(self):
+        start = time.perf_counter()
+        energies = np.zeros(self.n_replicas)
+        forces = np.zeros_like(self.positions)
+        for calc, replicas in self.groups.values():
+            e, f = evaluate_batch(calc, self.template, self.positions[replicas], compute_forces=True, batch_size=self.batch_size)
+            energies[replicas] = e
+            forces[replicas] = f
+
+        if self.constrained is not None:
+            # as Atoms.get_forces(md=True): holonomic constraints act on the momenta
+            for r, atoms in enumerate(self.constrained):
+                atoms.positions = self.positions[r]
+                for constraint in atoms.constraints:
+                    if hasattr(constraint, 'redistribute_forces_md'):
+                        constraint.redistribute_forces_md(atoms, forces[r])
+                    if hasattr(constraint, 'adjust_potential_energy'):
+                        constraint.adjust_forces(atoms, forces[r])
+        self.timings['forces'] += time.perf_counter() - start
+        return energies, forces
+
+    def _drift(self, dt):
+        new = self.positions + dt * self.momenta / self.masses
+        if self.constrained is not None:
+            # first half of RATTLE: constrain the new positions, momenta follow the constrained move
+            for r, atoms in enumerate(self.constrained):
+                atoms.positions = self.positions[r]
+                atoms.set_positions(new[r])
+                new[r] = atoms.positions
+            self.momenta = (new - self.positions) * self.masses / dt
+        self.positions = new
+
+    def _constrain_momenta(self):
+        if self.constrained is None:
+            return
+        # second half of RATTLE
+        for r, atoms in enumerate(self.constrained):
+            atoms.positions = self.positions[r]
+            atoms.set_momenta(self.momenta[r])
+            self.momenta[r] = atoms.get_momenta()
+
+    def kinetic_energies(self):
+        return 0.5 * (self.momenta**2 / self.masses).sum(axis=(1, 2))
+
+    def instantaneous_temperatures(self):
+        return 2. * self.kinetic_energies() / (self.n_dof * units.kB)
+
+    def get_atoms(self, replica):
+        '''
+        Current state of one replica as Atoms (with momenta).
+        '''
+        atoms = self.template.copy() if self.constrained is None else self.constrained[replica].copy()
+        atoms.positions = self.positions[replica]
+        atoms.set_momenta(self.momenta[replica], apply_constraint=False)
+        return atoms
+
+    def attach_writer(self, directory, interval=1):
+        self.writer = ReplicaWriter(directory, self.template, self.n_replicas, labels=self.labels)
+        self.interval = interval
+        return self.writer
+
+    def attach(self, function, interval=1):
+        '''
+        Call function(md) every interval steps (logging, observables, ...).
+        '''
+        self.observers.append((function, interval))
+
+    def _write(self):
+        start = time.perf_counter()
+        self.writer.write(self.nsteps, self.positions, self.energies, self.kinetic_energies(), self.instantaneous_temperatures())
+        self.timings['write'] += time.perf_counter() - start
+
+    #========================#
+    #       INTEGRATION      #
+    #========================#
+
+    def _ornstein_uhlenbeck(self, dt):
+        c1 = np.exp(-self.friction * dt)
+        kT = units.kB * self.temperatures[:, None, None]
+        noise = np.stack([rng.normal(size=self.positions.shape[1:]) for rng in self.rng])
+        self.momenta = c1 * self.momenta + np.sqrt((1. - c1**2) * self.masses * kT) * noise
+        if self.fixcm:
+            self._remove_com_momentum()
+        self._constrain_momenta()
+
+    def step(self):
+        dt = self.dt
+        start = time.perf_counter()
+        self.momenta += 0.5 * dt * self.forces
+        if self.friction is None:
+            self._drift(dt)
+        else:
+            # BAOAB: half drift, thermostat, half drift
+            self._drift(0.5 * dt)
+            self._ornstein_uhlenbeck(dt)
+            self._drift(0.5 * dt)
+        self.timings['integrate'] += time.perf_counter() - start
+
+        self.energies, self.forces = self._compute_forces()
+
+        start = time.perf_counter()
+        self.momenta += 0.5 * dt * self.forces
+        self._constrain_momenta()
+        self.timings['integrate'] += time.perf_counter() - start
+        self.nsteps += 1
+
+    def run(self, steps, verbose=True):
+        '''
+        Definition
+        ----------
+        Advances all replicas by steps. Returns a dict with the wall time, the
+        simulated time per replica (ps) and the aggregate ns/day.
+        '''
+
+        if self.writer is not None and self.nsteps == 0:
+            self._write()
+
+        start = time.perf_counter()
+        for _ in range(steps):
+            self.step()
+            if self.writer is not None and self.nsteps % self.interval == 0:
+                self._write()
+            for function, interval in self.observers:
+                if self.nsteps % interval == 0:
+                    function(self)
+        wall = time.perf_counter() - start
+
+        if self.writer is not None:
+            self.writer.flush()
+
+        simulated_ns = steps * self.dt / (1000 * units.fs) * 1e-3
+        report = {
+            'wall_s': wall,
+            'ps_per_replica': simulated_ns * 1e3,
+            'ns_per_day': self.n_replicas * simulated_ns / wall * 86400 if wall > 0 else np.inf,
+            'ns_per_day_per_replica': simulated_ns / wall * 86400 if wall > 0 else np.inf,
+            **{f'{k}_s': v for k, v in self.timings.items()},
+        }
+        if verbose:
+            temperatures = self.instantaneous_temperatures()
+            print(f'{self.n_replicas} replicas x {steps} steps in {wall:.1f} s: {report["ns_per_day"]:.3f} ns/day aggregate '
+                  f'({report["ns_per_day_per_replica"]:.3f} per replica), T = {temperatures.mean():.0f} ± {temperatures.std():.0f} K')
+        return report
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
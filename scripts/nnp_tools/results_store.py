@@ -0,0 +1,260 @@
+'''
+Columnar, memory-mappable store for scan results.
+
+Every scan is a directory holding the conformers and one set of columns per
+model, all as `.npy` files plus a small `manifest.json`:
+
+    <root>/<scan_id>/manifest.json
+    <root>/<scan_id>/numbers.npy, positions.npy, values.npy
+    <root>/<scan_id>/<model>/energies.npy, forces.npy, timings.npy, done.npy
+
+Columns are preallocated and written in place as results come in (append as
+you go, so an interrupted sweep keeps what it computed), and read back
+memory-mapped, so a finished 7-model sweep is reloaded instantly for
+`plot_dihedral`/`plot_bond`/`plot_diatomics` without recomputation.
+'''
+
+import os
+import json
+import time
+
+import numpy as np
+from ase import Atoms
+
+
+class ResultsStore:
+    '''
+    Definition
+    ----------
+    Results of all models x all scan points, indexed by (scan id, model, point).
+
+        store = ResultsStore('./results')
+        store.create_scan('biphenyl_dihedral', molecule, positions, kind='dihedral', ids=dihedral_ids, values=dihedral_list)
+        evaluate_to_store(store, 'biphenyl_dihedral', calculator_list, calculator_names)
+        dihedral_list, energies, succ_calcs = store.load_energies('biphenyl_dihedral')
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    #===================#
+    #       LAYOUT      #
+    #===================#
+
+    def _scan_dir(self, scan_id):
+        return os.path.join(self.root, scan_id)
+
+    def _model_dir(self, scan_id, model):
+        return os.path.join(self.root, scan_id, model)
+
+    def _manifest_path(self, scan_id):
+        return os.path.join(self._scan_dir(scan_id), 'manifest.json')
+
+    def manifest(self, scan_id):
+        with open(self._manifest_path(scan_id)) as f:
+            return json.load(f)
+
+    def _write_manifest(self, scan_id, manifest):
+        # write then rename, so readers never see a half written manifest
+        path = self._manifest_path(scan_id)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def scans(self):
+        return sorted(d for d in os.listdir(self.root) if os.path.isfile(self._manifest_path(d)))
+
+    def models(self, scan_id):
+        return list(self.manifest(scan_id)['models'])
+
+    #===================#
+    #       WRITE       #
+    #===================#
+
+    def create_scan(self, scan_id, atoms, positions, kind='', ids=(), values=None, forces=True, overwrite=False, **metadata):
+        '''
+        Definition
+        ----------
+        Registers a scan: stores the conformers (n_points x n_atoms x 3) and
+        the scanned coordinate values. Existing scans are kept unless overwrite.
+        '''
+
+        scan_dir = self._scan_dir(scan_id)
+        if os.path.isfile(self._manifest_path(scan_id)) and not overwrite:
+            manifest = self.manifest(scan_id)
+            if manifest['n_points'] != len(positions):
+                raise ValueError(f'scan {scan_id} already exists with {manifest["n_points"]} points')
+            return manifest
+        if not os.path.isdir(scan_dir):
+            os.makedirs(scan_dir)
+
+        positions = np.asarray(positions, dtype=float)
+        if values is None:
+            values = np.arange(len(positions), dtype=float)
+
+        np.save(os.path.join(scan_dir, 'numbers.npy'), atoms.get_atomic_numbers())
+        np.save(os.path.join(scan_dir, 'positions.npy'), positions)
+        np.save(os.path.join(scan_dir, 'values.npy'), np.asarray(values, dtype=float))
+
+        manifest = {
+            'scan_id': scan_id,
+            'kind': kind,
+            'ids': [int(i) for i in ids],
+            'n_points': int(positions.shape[0]),
+            'n_atoms': int(positions.shape[1]),
+            'cell': np.array(atoms.get_cell()).tolist(),
+            'pbc': [bool(p) for p in atoms.get_pbc()],
+            'forces': bool(forces),
+            'models': [],
+            'created': time.strftime('%d-%m-%Y %H:%M:%S'),
+            'metadata': metadata,
+        }
+        self._write_manifest(scan_id, manifest)
+        return manifest
+
+    def add_model(self, scan_id, model):
+        '''
+        Preallocate the columns of a model (NaN energies, nothing done).
+        '''
+
+        manifest = self.manifest(scan_id)
+        if model in manifest['models']:
+            return
+
+        model_dir = self._model_dir(scan_id, model)
+        if not os.path.isdir(model_dir):
+            os.makedirs(model_dir)
+
+        n_points, n_atoms = manifest['n_points'], manifest['n_atoms']
+        columns = {'energies': (n_points,), 'timings': (n_points,)}
+        if manifest['forces']:
+            columns['forces'] = (n_points, n_atoms, 3)
+        for name, shape in columns.items():
+            column = np.lib.format.open_memmap(os.path.join(model_dir, f'{name}.npy'), mode='w+', dtype=np.float64, shape=shape)
+            column[:] = np.nan
+            column.flush()
+        done = np.lib.format.open_memmap(os.path.join(model_dir, 'done.npy'), mode='w+', dtype=bool, shape=(n_points,))
+        done.flush()
+
+        manifest['models'].append(model)
+        self._write_manifest(scan_id, manifest)
+
+    def write(self, scan_id, model, points, energies, forces=None, timings=None):
+        '''
+        Definition
+        ----------
+        Writes the results of `points` (index, slice or index array) of a model
+        in place. The model columns are created on first write.
+        '''
+
+        self.add_model(scan_id, model)
+        model_dir = self._model_dir(scan_id, model)
+
+        columns = {'energies': energies, 'forces': forces, 'timings': timings}
+        for name, value in columns.items():
+            # forces are dropped for scans created with forces=False
+            path = os.path.join(model_dir, f'{name}.npy')
+            if value is None or not os.path.isfile(path):
+                continue
+            column = np.load(path, mmap_mode='r+')
+            column[points] = value
+            column.flush()
+
+        done = np.load(os.path.join(model_dir, 'done.npy'), mmap_mode='r+')
+        done[points] = True
+        done.flush()
+
+    #==================#
+    #       READ       #
+    #==================#
+
+    def _column(self, scan_id, model, name):
+        return np.load(os.path.join(self._model_dir(scan_id, model), f'{name}.npy'), mmap_mode='r')
+
+    def positions(self, scan_id):
+        return np.load(os.path.join(self._scan_dir(scan_id), 'positions.npy'), mmap_mode='r')
+
+    def values(self, scan_id):
+        return np.load(os.path.join(self._scan_dir(scan_id), 'values.npy'), mmap_mode='r')
+
+    def energies(self, scan_id, model):
+        return self._column(scan_id, model, 'energies')
+
+    def forces(self, scan_id, model):
+        return self._column(scan_id, model, 'forces')
+
+    def timings(self, scan_id, model):
+        return self._column(scan_id, model, 'timings')
+
+    def done(self, scan_id, model):
+        if model not in self.models(scan_id):
+            return np.zeros(self.manifest(scan_id)['n_points'], dtype=bool)
+        return self._column(scan_id, model, 'done')
+
+    def atoms(self, scan_id, point=0):
+        '''
+        Atoms of one point of the scan.
+        '''
+        manifest = self.manifest(scan_id)
+        numbers = np.load(os.path.join(self._scan_dir(scan_id), 'numbers.npy'))
+        return Atoms(numbers=numbers, positions=self.positions(scan_id)[point], cell=manifest['cell'], pbc=manifest['pbc'])
+
+    def load_energies(self, scan_id, models=None, complete=True):
+        '''
+        Definition
+        ----------
+        Returns values, energies (n_models x n_points) and model names, ready
+        for the plotting functions of the notebooks. With complete, models
+        with missing points are left out.
+        '''
+
+        if models is None:
+            models = self.models(scan_id)
+
+        energies = []
+        names = []
+        for model in models:
+            if complete and not np.all(self.done(scan_id, model)):
+                continue
+            energies.append(self.energies(scan_id, model))
+            names.append(model)
+
+        return self.values(scan_id), energies, names
+
+
+def evaluate_to_store(store, scan_id, calculator_list, calculator_names, compute_forces=None, batch_size=None, chunk_size=64):
+    '''
+    Definition
+    ----------
+    Evaluates every calculator on the conformers of a stored scan, writing each
+    chunk as soon as it is computed. Points already done are skipped, so an
+    interrupted sweep resumes where it stopped. Failing calculators are reported
+    and skipped. Returns the names of the calculators that completed the scan.
+    '''
+
+    from .batch_scan import evaluate_batch
+
+    manifest = store.manifest(scan_id)
+    if compute_forces is None:
+        compute_forces = manifest['forces']
+    atoms = store.atoms(scan_id)
+    positions = store.positions(scan_id)
+
+    succ_calcs = []
+    for calc_, name in zip(calculator_list, calculator_names):
+        todo = np.flatnonzero(~np.asarray(store.done(scan_id, name)))
+        try:
+            for start in range(0, len(todo), chunk_size):
+                points = todo[start:start+chunk_size]
+                t0 = time.perf_counter()
+                energies, forces = evaluate_batch(calc_, atoms, positions[points], compute_forces=compute_forces, batch_size=batch_size)
+                elapsed = time.perf_counter() - t0
+                store.write(scan_id, name, points, energies, forces=forces, timings=np.full(len(points), elapsed / len(points)))
+            succ_calcs.append(name)
+
+        except Exception as error:
+            print(f'calculator {name} failed: {error}')
+
+    return succ_calcs
@@ -0,0 +1,538 @@
+'''
+Shared local inference server.
+
+Every deformation and symmetry notebook loads its own copy of the models.
+`InferenceServer` keeps the registered models warm in one long-running process
+and answers energy/force requests from any number of clients over a Unix
+socket (`multiprocessing.connection`). The socket is bound with a 0077 umask
+(the default one inside a private 0700 directory), and every server generates
+a random authentication key, written to a 0600 `<socket>.key` file that
+clients read. Each model has one worker thread: concurrent requests for the
+same model are merged into micro-batches (up to max_batch conformers or
+max_wait seconds) and evaluated with `batch_scan.evaluate_batch`, one call per
+distinct system in the batch.
+
+Clients use `RemoteCalculator`, a drop-in ASE calculator; whole scans are sent
+in one request through its `evaluate_batch`, so `batch_scan` works unchanged.
+The server reports queue depth, batch sizes and latency percentiles per model.
+
+Start the server once (terminal or notebook)
+
+    python -m nnp_tools.server --models ANI-2x MACE-OFF ORB-V2
+
+or `launch_server(['ANI-2x', 'MACE-OFF'])` from Python, then in every notebook
+
+    calculator_list = [RemoteCalculator(name) for name in ['ANI-2x', 'MACE-OFF']]
+    print_stats(InferenceClient().stats())
+'''
+
+import os
+import sys
+import time
+import queue
+import tempfile
+import argparse
+import threading
+import subprocess
+from collections import deque
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+from ase import Atoms
+from ase.calculators.calculator import Calculator, all_changes
+
+from .batch_scan import evaluate_batch
+
+
+DEFAULT_SOCKET_DIR = os.path.join(tempfile.gettempdir(), f'nnp_tools_{os.getuid()}')
+DEFAULT_SOCKET = os.path.join(DEFAULT_SOCKET_DIR, 'inference.sock')
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_WAIT = 0.005    # s
+LATENCY_WINDOW = 10000
+
+
+def _private_dir(directory):
+    '''
+    Create directory (0700) or check that an existing one is ours and private.
+    '''
+
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    stat = os.stat(directory)
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise PermissionError(f'{directory} must be owned by the current user with mode 0700')
+
+
+def key_path(socket_path):
+    return socket_path + '.key'
+
+
+def read_authkey(socket_path):
+    '''
+    Authentication key of the server listening on socket_path.
+    '''
+    with open(key_path(socket_path), 'rb') as f:
+        return f.read()
+
+
+#=====================#
+#       REQUESTS      #
+#=====================#
+
+class _Request:
+    __slots__ = ('numbers', 'positions', 'cell', 'pbc', 'forces', 'submitted', 'done', 'result')
+
+    def __init__(self, numbers, positions, cell, pbc, forces):
+        self.numbers = np.asarray(numbers, dtype=np.int64)
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, len(self.numbers), 3)
+        self.cell = np.asarray(cell, dtype=np.float64)
+        self.pbc = np.asarray(pbc, dtype=bool)
+        self.forces = forces
+        self.submitted = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+
+    def system_key(self):
+        return (self.numbers.tobytes(), self.cell.tobytes(), self.pbc.tobytes())
+
+
+class _ModelWorker:
+    '''
+    One thread per model: collects requests into micro-batches and evaluates them.
+    '''
+
+    def __init__(self, name, calc, max_batch, max_wait, batch_size):
+        self.name = name
+        self.calc = calc
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.stats = {'requests': 0, 'points': 0, 'batches': 0, 'max_queue_depth': 0, 'busy_s': 0., 'errors': 0}
+        self.batch_requests = deque(maxlen=LATENCY_WINDOW)
+        self.batch_points = deque(maxlen=LATENCY_WINDOW)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.thread = threading.Thread(target=self._loop, name=f'model-{name}', daemon=True)
+        self.thread.start()
+
+    def submit(self, request):
+        self.queue.put(request)
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.queue.qsize())
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        if batch[0] is None:
+            return None
+        n_points = len(batch[0].positions)
+        deadline = time.perf_counter() + self.max_wait
+        while n_points < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None)
+                break
+            batch.append(request)
+            n_points += len(request.positions)
+        return batch
+
+    def _evaluate(self, requests):
+        first = requests[0]
+        template = Atoms(numbers=first.numbers, cell=first.cell, pbc=first.pbc)
+        positions = np.concatenate([r.positions for r in requests])
+        compute_forces = any(r.forces for r in requests)
+        try:
+            energies, forces = evaluate_batch(self.calc, template, positions, compute_forces=compute_forces, batch_size=self.batch_size)
+        except Exception as error:
+            self.stats['errors'] += 1
+            for r in requests:
+                r.result = {'error': f'{self.name}: {error}'}
+            return
+
+        start = 0
+        for r in requests:
+            stop = start + len(r.positions)
+            r.result = {'energies': energies[start:stop], 'forces': forces[start:stop] if r.forces else None}
+            start = stop
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+
+            start = time.perf_counter()
+            # one evaluate_batch call per distinct system of the micro-batch
+            systems = {}
+            for r in batch:
+                systems.setdefault(r.system_key(), []).append(r)
+            for requests in systems.values():
+                self._evaluate(requests)
+            done = time.perf_counter()
+
+            self.stats['busy_s'] += done - start
+            self.stats['batches'] += 1
+            self.stats['requests'] += len(batch)
+            n_points = sum(len(r.positions) for r in batch)
+            self.stats['points'] += n_points
+            self.batch_requests.append(len(batch))
+            self.batch_points.append(n_points)
+            for r in batch:
+                self.latencies.append(done - r.submitted)
+                r.done.set()
+
+    def report(self):
+        out = dict(self.stats)
+        out['queue_depth'] = self.queue.qsize()
+        if self.batch_points:
+            out['mean_batch_requests'] = float(np.mean(self.batch_requests))
+            out['mean_batch_points'] = float(np.mean(self.batch_points))
+            out['max_batch_points'] = int(np.max(self.batch_points))
+        if self.latencies:
+            p50, p90, p99 = np.percentile(np.array(self.latencies) * 1e3, [50, 90, 99])
+            out.update({'latency_p50_ms': p50, 'latency_p90_ms': p90, 'latency_p99_ms': p99})
+        return out
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+#===================#
+#       SERVER      #
+#===================#
+
+class InferenceServer:
+    '''
+    Definition
+    ----------
+    Long-running inference server on a Unix socket.
+
+    models is a list of registered model names (built with
+    `registry.get_calculator` on device/dtype) or a dict name -> calculator or
+    factory. Models are built at startup if preload, otherwise on first
+    request; other registered names are also built on first request.
+    `serve_forever()` blocks, `start()` serves from a background thread.
+    '''
+
+    def __init__(self, socket_path=None, models=None, device='cpu', dtype='float32', max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT, batch_size=None, authkey=None, preload=True):
+        self.socket_path = DEFAULT_SOCKET if socket_path is None else socket_path
+        self.device = device
+        self.dtype = dtype
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batch_size = batch_size
+        self.authkey = os.urandom(32) if authkey is None else authkey
+        self.sources = dict(models) if isinstance(models, dict) else {name: None for name in (models or [])}
+        self.workers = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._loading = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.listener = None
+
+        if preload:
+            for name in self.sources:
+                try:
+                    self._worker(name)
+                except Exception as error:
+                    print(f'calculator {name} failed: {error}')
+
+    def _worker(self, name):
+        # the global lock only guards the dicts: building one model (tens of
+        # seconds) must not block the requests for the models already warm
+        with self._lock:
+            if name in self.workers:
+                return self.workers[name]
+            loading = self._loading.setdefault(name, threading.Lock())
+
+        with loading:
+            with self._lock:
+                if name in self.workers:
+                    return self.workers[name]
+                source = self.sources.get(name)
+
+            start = time.perf_counter()
+            if source is None:
+                from .registry import get_calculator
+                calc = get_calculator(name, device=self.device, dtype=self.dtype)
+            elif isinstance(source, type) or not hasattr(source, 'get_potential_energy'):
+                calc = source()
+            else:
+                calc = source
+            print(f'{name} ready in {time.perf_counter() - start:.1f} s')
+            worker = _ModelWorker(name, calc, self.max_batch, self.max_wait, self.batch_size)
+
+            with self._lock:
+                self.workers[name] = worker
+            return worker
+
+    #======================#
+    #       MESSAGES       #
+    #======================#
+
+    def _handle(self, message):
+        op = message.get('op')
+        if op == 'evaluate':
+            worker = self._worker(message['model'])
+            request = _Request(message['numbers'], message['positions'], message['cell'], message['pbc'], message.get('forces', False))
+            worker.submit(request)
+            request.done.wait()
+            return request.result
+        if op == 'stats':
+            return self.stats()
+        if op == 'models':
+            with self._lock:
+                return {'loaded': list(self.workers), 'configured': list(self.sources)}
+        if op == 'ping':
+            return {'ok': True}
+        raise ValueError(f'unknown operation {op}')
+
+    def _serve_client(self, conn):
+        with conn:
+            while not self._stop.is_set():
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    break
+                if message.get('op') == 'shutdown':
+                    conn.send({'ok': True})
+                    self.shutdown()
+                    break
+                try:
+                    reply = self._handle(message)
+                except Exception as error:
+                    reply = {'error': str(error)}
+                try:
+                    conn.send(reply)
+                except OSError:
+                    break
+
+    def serve_forever(self):
+        directory = os.path.dirname(os.path.abspath(self.socket_path))
+        if directory == os.path.abspath(DEFAULT_SOCKET_DIR):
+            _private_dir(directory)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        # socket and key file are created owner-only, with no window where they are not
+        umask = os.umask(0o077)
+        try:
+            fd = os.open(key_path(self.socket_path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.authkey)
+            self.listener = Listener(self.socket_path, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        print(f'serving {list(self.sources)} on {self.socket_path}')
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn = self.listener.accept()
+                except Exception:
+                    if self._stop.is_set():
+                        break
+                    continue
+                threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+        finally:
+            self.listener.close()
+            for worker in self.workers.values():
+                worker.stop()
+            for path in [self.socket_path, key_path(self.socket_path)]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='inference-server', daemon=True)
+        self._thread.start()
+        while self.listener is None or not os.path.exists(self.socket_path):
+            time.sleep(0.01)
+        return self
+
+    def shutdown(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        # wake up the blocking accept()
+        try:
+            Client(self.socket_path, family='AF_UNIX', authkey=self.authkey).close()
+        except Exception:
+            pass
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            workers = dict(self.workers)
+        return {'uptime_s': time.time() - self.started, 'models': {name: worker.report() for name, worker in workers.items()}}
+
+
+def print_stats(stats):
+    '''
+    Queue depth, batch sizes and latency percentiles per model.
+    '''
+
+    print(f'uptime {stats["uptime_s"]:.0f} s')
+    print(f'{"model":<12}{"requests":>10}{"points":>9}{"batches":>9}{"req/batch":>11}{"pts/batch":>11}{"queue":>7}{"max q":>7}{"p50 (ms)":>10}{"p90 (ms)":>10}{"p99 (ms)":>10}')
+    for name, s in stats['models'].items():
+        print(f'{name:<12}{s["requests"]:>10}{s["points"]:>9}{s["batches"]:>9}{s.get("mean_batch_requests", 0.):>11.2f}{s.get("mean_batch_points", 0.):>11.1f}'
+              f'{s["queue_depth"]:>7}{s["max_queue_depth"]:>7}{s.get("latency_p50_ms", np.nan):>10.2f}{s.get("latency_p90_ms", np.nan):>10.2f}{s.get("latency_p99_ms", np.nan):>10.2f}')
+
+
+def launch_server(models, socket_path=None, device='cpu', dtype='float32', max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT, timeout=600):
+    '''
+    Definition
+    ----------
+    Starts `python -m nnp_tools.server` as a separate process (it outlives
+    the calling notebook until shut down) and waits until it answers.
+    Returns the Popen of the server.
+    '''
+
+    socket_path = DEFAULT_SOCKET if socket_path is None else socket_path
+    scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([scripts_dir, os.environ.get('PYTHONPATH', '')]))
+    command = [sys.executable, '-m', 'nnp_tools.server', '--socket', socket_path, '--device', device, '--dtype', dtype,
+               '--max-batch', str(max_batch), '--max-wait', str(max_wait), '--models', *models]
+    process = subprocess.Popen(command, env=env, start_new_session=True)
+
+    client = InferenceClient(socket_path)
+    start = time.perf_counter()
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f'inference server exited with code {process.returncode}')
+        try:
+            client.request({'op': 'ping'})
+            client.close()
+            return process
+        except (OSError, EOFError):
+            if time.perf_counter() - start > timeout:
+                process.terminate()
+                raise TimeoutError(f'inference server not ready after {timeout} s')
+            time.sleep(0.2)
+
+
+#===================#
+#       CLIENT      #
+#===================#
+
+class InferenceClient:
+    '''
+    Definition
+    ----------
+    Connection to an InferenceServer (opened on first request). The key is
+    read from `<socket>.key` unless given. Thread safe: requests of one
+    client are sent one at a time.
+    '''
+
+    def __init__(self, socket_path=None, authkey=None):
+        self.socket_path = DEFAULT_SOCKET if socket_path is None else socket_path
+        self.authkey = authkey
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def request(self, message):
+        with self._lock:
+            if self._conn is None:
+                authkey = read_authkey(self.socket_path) if self.authkey is None else self.authkey
+                self._conn = Client(self.socket_path, family='AF_UNIX', authkey=authkey)
+            try:
+                self._conn.send(message)
+                reply = self._conn.recv()
+            except (OSError, EOFError):
+                self._conn = None
+                raise
+        if isinstance(reply, dict) and 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply
+
+    def evaluate(self, model, atoms, positions=None, compute_forces=False):
+        '''
+        Energies (n_points) and forces (or None) of a conformer stack of atoms
+        (its current positions if positions is None).
+        '''
+
+        if positions is None:
+            positions = atoms.get_positions()[None]
+        reply = self.request({
+            'op': 'evaluate',
+            'model': model,
+            'numbers': atoms.get_atomic_numbers(),
+            'positions': np.asarray(positions, dtype=np.float64),
+            'cell': np.array(atoms.get_cell(complete=True)),
+            'pbc': atoms.get_pbc(),
+            'forces': compute_forces,
+        })
+        return reply['energies'], reply['forces']
+
+    def stats(self):
+        return self.request({'op': 'stats'})
+
+    def models(self):
+        return self.request({'op': 'models'})
+
+    def shutdown(self):
+        try:
+            self.request({'op': 'shutdown'})
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RemoteCalculator(Calculator):
+    '''
+    Definition
+    ----------
+    ASE calculator evaluated by an InferenceServer. Drop-in replacement of
+    the local calculators, e.g. `RemoteCalculator('MACE-OFF')` for `maceoff`.
+    '''
+
+    implemented_properties = ['energy', 'free_energy', 'forces']
+
+    def __init__(self, model, socket_path=None, authkey=None, client=None, **kwargs):
+        Calculator.__init__(self, **kwargs)
+        self.model = model
+        self.client = InferenceClient(socket_path, authkey) if client is None else client
+
+    def calculate(self, atoms=None, properties=['energy'], system_changes=all_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+
+        need_forces = 'forces' in properties
+        energies, forces = self.client.evaluate(self.model, self.atoms, compute_forces=need_forces)
+        self.results['energy'] = energies[0]
+        self.results['free_energy'] = energies[0]
+        if need_forces:
+            self.results['forces'] = forces[0]
+
+    def evaluate_batch(self, atoms, positions, compute_forces=False, batch_size=None):
+        '''
+        Remote counterpart of `batch_scan.evaluate_batch`: the whole stack in one request.
+        '''
+        return self.client.evaluate(self.model, atoms, positions, compute_forces=compute_forces)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared local inference server of the registered models.')
+    parser.add_argument('--models', nargs='+', required=True)
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--dtype', default='float32')
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument('--max-wait', type=float, default=DEFAULT_MAX_WAIT)
+    args = parser.parse_args()
+
+    server = InferenceServer(args.socket, args.models, device=args.device, dtype=args.dtype, max_batch=args.max_batch, max_wait=args.max_wait)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+'''
+Process-pool model sweep: every calculator runs in its own long-lived worker.
+
+Instead of `for calc_ in calculator_list:` in one process, `ModelSweep` spawns
+one worker per model (or several per model, each with its own torch thread
+budget). Each worker builds its model exactly once from a factory and then
+evaluates the conformer chunks it receives with `batch_scan.evaluate_batch`.
+Results are gathered back in model order. A model that fails to load or to
+evaluate is reported and dropped, the rest of the sweep goes on.
+
+Factories must be picklable (workers are spawned), e.g.
+
+    from functools import partial
+    from mace.calculators import mace_off
+
+    factories = [partial(mace_off, model='medium', device='cpu', default_dtype='float32')]
+    with ModelSweep(factories, ['MACE-OFF']) as sweep:
+        energies, forces, succ_calcs = sweep.evaluate(molecule, positions)
+    sweep.print_report()
+'''
+
+import os
+import time
+import queue
+import traceback
+import multiprocessing as mp
+
+import numpy as np
+
+
+DEFAULT_CHUNK_SIZE = 64
+
+
+def _set_torch_threads(n_threads):
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(n_threads)
+
+
+def _worker(name, factory, n_threads, batch_size, task_queue, result_queue):
+    '''
+    Worker loop: build the model once, then evaluate chunks until a None task arrives.
+    '''
+
+    _set_torch_threads(n_threads)
+
+    try:
+        start = time.perf_counter()
+        calc = factory()
+        result_queue.put(('ready', name, None, time.perf_counter() - start))
+    except Exception:
+        result_queue.put(('error', name, None, traceback.format_exc()))
+        return
+
+    from .batch_scan import evaluate_batch
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        job_id, chunk_start, atoms, positions, compute_forces = task
+        try:
+            start = time.perf_counter()
+            energies, forces = evaluate_batch(calc, atoms, positions, compute_forces=compute_forces, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+            result_queue.put(('result', name, job_id, (chunk_start, energies, forces, elapsed)))
+        except Exception:
+            result_queue.put(('error', name, job_id, traceback.format_exc()))
+            break
+
+
+class ModelSweep:
+    '''
+    Definition
+    ----------
+    Pool of long-lived model workers.
+
+    calculator_factories are picklable callables returning an ASE calculator,
+    one per entry of calculator_names, or None to build the models of
+    calculator_names from `registry`. workers_per_model workers are started for
+    each model, each limited to torch_threads threads (default: the cores split
+    evenly among all workers).
+    '''
+
+    def __init__(self, calculator_factories, calculator_names, workers_per_model=1, torch_threads=None, batch_size=None, chunk_size=None):
+
+        # registered models can be given by name only
+        if calculator_factories is None:
+            from .registry import calculator_factory
+            calculator_factories = [calculator_factory(name) for name in calculator_names]
+
+        if len(calculator_factories) != len(calculator_names):
+            raise ValueError('one factory per calculator name is required')
+
+        n_workers = workers_per_model * len(calculator_names)
+        if torch_threads is None:
+            torch_threads = max(1, (os.cpu_count() or 1) // n_workers)
+        if chunk_size is None:
+            chunk_size = DEFAULT_CHUNK_SIZE
+
+        self.calculator_factories = list(calculator_factories)
+        self.calculator_names = list(calculator_names)
+        self.workers_per_model = workers_per_model
+        self.torch_threads = torch_threads
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+
+        self.failed = {}
+        self.report = {name: {'load_time': None, 'points': 0, 'compute_time': 0., 'wall_time': 0.} for name in calculator_names}
+
+        self._ctx = mp.get_context('spawn')
+        self._result_queue = self._ctx.Queue()
+        self._task_queues = {}
+        self._processes = {}
+        self._job_id = 0
+        self._started = False
+
+    def start(self):
+        '''
+        Spawn the workers. Called automatically by `evaluate` and by `with`.
+        '''
+
+        if self._started:
+            return
+        for name, factory in zip(self.calculator_names, self.calculator_factories):
+            self._task_queues[name] = self._ctx.Queue()
+            self._processes[name] = []
+            for _ in range(self.workers_per_model):
+                process = self._ctx.Process(target=_worker, args=(name, factory, self.torch_threads, self.batch_size, self._task_queues[name], self._result_queue), daemon=True)
+                process.start()
+                self._processes[name].append(process)
+        self._started = True
+
+    def _fail(self, name, message):
+        if name not in self.failed:
+            self.failed[name] = message
+            print(f'calculator {name} failed\n{message}')
+
+    def _handle(self, message, job_id, pending, results, job_start):
+
+        kind, name, msg_job, payload = message
+        if kind == 'ready':
+            self.report[name]['load_time'] = payload
+        elif kind == 'error':
+            self._fail(name, payload)
+            pending.pop(name, None)
+        elif kind == 'result' and msg_job == job_id and name in pending:
+            chunk_start, energies, forces, elapsed = payload
+            results[name].append((chunk_start, energies, forces))
+            self.report[name]['points'] += len(energies)
+            self.report[name]['compute_time'] += elapsed
+            pending[name] -= 1
+            if pending[name] == 0:
+                self.report[name]['wall_time'] += time.perf_counter() - job_start
+                del pending[name]
+
+    def evaluate(self, atoms, positions, compute_forces=False):
+        '''
+        Definition
+        ----------
+        Evaluates every live model on the (n_points x n_atoms x 3) conformer stack.
+
+        Returns the energies (n_models x n_points), the forces or None and the
+        names of the calculators that succeeded, in the order of calculator_names.
+        '''
+
+        self.start()
+        self._job_id += 1
+        job_id = self._job_id
+        job_start = time.perf_counter()
+
+        positions = np.asarray(positions, dtype=float)
+        chunks = range(0, len(positions), self.chunk_size)
+
+        # stream the conformer chunks to every live model
+        live = [name for name in self.calculator_names if name not in self.failed]
+        pending = {}
+        results = {}
+        for name in live:
+            for chunk_start in chunks:
+                chunk = positions[chunk_start:chunk_start+self.chunk_size]
+                self._task_queues[name].put((job_id, chunk_start, atoms, chunk, compute_forces))
+            results[name] = []
+            if len(chunks) > 0:
+                pending[name] = len(chunks)
+
+        while len(pending) > 0:
+            try:
+                message = self._result_queue.get(timeout=1.)
+            except queue.Empty:
+                # a worker killed without reporting (e.g. out of memory)
+                for name in list(pending):
+                    if not any(p.is_alive() for p in self._processes[name]):
+                        self._fail(name, 'worker process died')
+                        pending.pop(name)
+                continue
+            self._handle(message, job_id, pending, results, job_start)
+
+        # gather in model order
+        energies = []
+        forces = []
+        succ_calcs = []
+        for name in live:
+            if name in self.failed:
+                continue
+            chunk_results = sorted(results[name], key=lambda r: r[0])
+            energies.append(np.concatenate([r[1] for r in chunk_results]))
+            if compute_forces:
+                forces.append(np.concatenate([r[2] for r in chunk_results]))
+            succ_calcs.append(name)
+
+        energies = np.array(energies).reshape(len(succ_calcs), len(positions))
+        forces = np.array(forces) if compute_forces else None
+        return energies, forces, succ_calcs
+
+    def print_report(self):
+        '''
+        Per-model load time and throughput.
+        '''
+
+        print(f'{"model":<12}{"load (s)":>10}{"points":>10}{"compute (s)":>14}{"wall (s)":>11}{"conf/s/worker":>15}')
+        for name in self.calculator_names:
+            r = self.report[name]
+            if name in self.failed:
+                print(f'{name:<12}{"failed":>10}')
+                continue
+            load = f'{r["load_time"]:.2f}' if r['load_time'] is not None else '-'
+            rate = r['points'] / r['compute_time'] if r['compute_time'] > 0 else 0.
+            print(f'{name:<12}{load:>10}{r["points"]:>10}{r["compute_time"]:>14.2f}{r["wall_time"]:>11.2f}{rate:>15.1f}')
+
+    def close(self):
+        '''
+        Stop the workers.
+        '''
+
+        if not self._started:
+            return
+        for name in self.calculator_names:
+            for _ in self._processes[name]:
+                self._task_queues[name].put(None)
+        for name in self.calculator_names:
+            for process in self._processes[name]:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+        self._started = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def run_sweep(atoms, positions, calculator_factories, calculator_names, compute_forces=False, workers_per_model=1, torch_threads=None, batch_size=None, chunk_size=None, verbose=True):
+    '''
+    Definition
+    ----------
+    One-shot sweep: starts the workers, evaluates the conformer stack and stops them.
+    Returns energies, forces (or None) and the successful calculators.
+    '''
+
+    with ModelSweep(calculator_factories, calculator_names, workers_per_model=workers_per_model, torch_threads=torch_threads, batch_size=batch_size, chunk_size=chunk_size) as sweep:
+        energies, forces, succ_calcs = sweep.evaluate(atoms, positions, compute_forces=compute_forces)
+    if verbose:
+        sweep.print_report()
+    return energies, forces, succ_calcs
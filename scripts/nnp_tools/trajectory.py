@@ -0,0 +1,364 @@
+'''
+Indexed random-access trajectories and streaming MD observables.
+
+`extract_frame` (models/ase_orbital/ase_orbital.ipynb) reads the whole `.xyz`
+with `readlines()` to get one frame. `TrajectoryReader` scans an `.xyz` file
+once, stores the byte offset of every frame in a small sidecar index
+(`<file>.idx.npz`, rebuilt when the file changes) and then seeks directly to
+any frame. `.traj` files already store their frame offsets (ASE ULM format),
+so they are read through `ase.io.Trajectory` with the same interface.
+
+Observables (`EnergyDrift`, `Temperature`, `RDF`, `MSD`) are updated frame by
+frame and keep only running sums, so arbitrarily long runs are analysed in
+constant memory. They can also be attached to a running MD instead of the
+energy lists of the notebooks, e.g. `dyn.attach(lambda: drift.update(atoms))`.
+
+    reader = TrajectoryReader('NaClWaterMD.xyz')
+    frame = reader[3]
+    results = analyse(reader, [EnergyDrift(), Temperature(), RDF(6., elements=('O', 'O')), MSD()], step=2)
+'''
+
+import os
+from io import StringIO
+
+import numpy as np
+from ase.io import read, Trajectory
+from ase.neighborlist import neighbor_list
+
+
+#===================#
+#       READER      #
+#===================#
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def build_xyz_index(path):
+    '''
+    Definition
+    ----------
+    Byte offsets of the frames of an (ext)xyz file, found in one pass reading
+    only the atom count line of every frame. Returns offsets of length
+    n_frames + 1 (the last one is the file size).
+    '''
+
+    offsets = []
+    with open(path, 'rb') as f:
+        while True:
+            start = f.tell()
+            line = f.readline()
+            if not line.strip():
+                break
+            offsets.append(start)
+            n_atoms = int(line)
+            for _ in range(n_atoms + 1):
+                f.readline()
+        offsets.append(f.tell() if not line else start)
+    return np.array(offsets, dtype=np.int64)
+
+
+def load_xyz_index(path, index_path=None):
+    '''
+    Frame offsets of an xyz file from its sidecar index, rebuilt and saved if
+    missing or outdated (file size or modification time changed).
+    '''
+
+    if index_path is None:
+        index_path = path + '.idx.npz'
+    signature = _file_signature(path)
+    if os.path.isfile(index_path):
+        with np.load(index_path) as data:
+            if np.array_equal(data['signature'], signature):
+                return data['offsets']
+
+    offsets = build_xyz_index(path)
+    try:
+        np.savez(index_path, offsets=offsets, signature=signature)
+    except OSError as error:
+        print(f'could not save the frame index {index_path}: {error}')
+    return offsets
+
+
+class TrajectoryReader:
+    '''
+    Definition
+    ----------
+    Random access to the frames of an `.xyz`/`.extxyz` or `.traj` file without
+    loading it: `len(reader)`, `reader[i]` (Atoms), `reader[start:stop:step]`
+    (iterator) and `reader.frame_text(i)` (raw xyz block, e.g. for py3Dmol).
+    '''
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.format = 'traj' if path.endswith('.traj') else 'xyz'
+        if self.format == 'traj':
+            self._traj = Trajectory(path)
+            self.offsets = None
+        else:
+            self._traj = None
+            self.offsets = load_xyz_index(path, index_path)
+            self._file = open(path, 'rb')
+
+    def __len__(self):
+        if self._traj is not None:
+            return len(self._traj)
+        return len(self.offsets) - 1
+
+    def _frame_bytes(self, i):
+        self._file.seek(self.offsets[i])
+        return self._file.read(self.offsets[i + 1] - self.offsets[i])
+
+    def frame_text(self, i):
+        '''
+        Raw text of frame i of an xyz file.
+        '''
+        if self._traj is not None:
+            raise ValueError('frame_text is only available for xyz files')
+        return self._frame_bytes(self._check(i)).decode()
+
+    def _check(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(f'frame {i} out of range ({n} frames)')
+        return i
+
+    def get_frame(self, i):
+        i = self._check(i)
+        if self._traj is not None:
+            return self._traj[i]
+        return read(StringIO(self._frame_bytes(i).decode()), format='extxyz')
+
+    def iter_frames(self, start=0, stop=None, step=1):
+        for i in range(*slice(start, stop, step).indices(len(self))):
+            yield self.get_frame(i)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.iter_frames(key.start or 0, key.stop, key.step or 1)
+        return self.get_frame(key)
+
+    def __iter__(self):
+        return self.iter_frames()
+
+    def close(self):
+        if self._traj is not None:
+            self._traj.close()
+        else:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#========================#
+#       OBSERVABLES      #
+#========================#
+
+class EnergyDrift:
+    '''
+    Definition
+    ----------
+    Total energy drift: first/last total energy, maximum deviation and the
+    least-squares slope (eV per frame, or eV/ps per atom with timestep in fs and
+    the frame stride). Frames without energies or momenta are skipped.
+    '''
+
+    name = 'energy_drift'
+
+    def __init__(self, timestep=None, stride=1):
+        self.timestep = timestep
+        self.stride = stride
+        self.n = 0
+        self.sums = np.zeros(4)    # t, E, tE, t^2
+        self.e0 = None
+        self.e_last = None
+        self.max_dev = 0.
+        self.n_atoms = 0
+
+    def update(self, atoms):
+        # without momenta get_kinetic_energy() is 0, not missing
+        if not atoms.has('momenta'):
+            return
+        try:
+            e = atoms.get_potential_energy() + atoms.get_kinetic_energy()
+        except RuntimeError:
+            return
+        t = float(self.n)
+        if self.e0 is None:
+            self.e0 = e
+        self.e_last = e
+        self.max_dev = max(self.max_dev, abs(e - self.e0))
+        self.sums += [t, e, t * e, t * t]
+        self.n += 1
+        self.n_atoms = len(atoms)
+
+    def result(self):
+        if self.n < 2:
+            return {'n_frames': self.n, 'slope': np.nan}
+        st, se, ste, stt = self.sums
+        slope = (self.n * ste - st * se) / (self.n * stt - st * st)
+        out = {'n_frames': self.n, 'e_first': self.e0, 'e_last': self.e_last, 'max_deviation': self.max_dev, 'slope_per_frame': slope}
+        if self.timestep is not None:
+            # eV/ps/atom
+            out['drift_per_ps_atom'] = slope / (self.timestep * self.stride * 1e-3) / self.n_atoms
+        return out
+
+
+class Temperature:
+    '''
+    Running mean, standard deviation and extremes of the instantaneous temperature (K).
+    '''
+
+    name = 'temperature'
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, atoms):
+        if atoms.get_momenta() is None or not atoms.has('momenta'):
+            return
+        temperature = atoms.get_temperature()
+        # Welford update
+        self.n += 1
+        delta = temperature - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (temperature - self.mean)
+        self.min = min(self.min, temperature)
+        self.max = max(self.max, temperature)
+
+    def result(self):
+        std = np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.nan
+        return {'n_frames': self.n, 'mean': self.mean, 'std': std, 'min': self.min, 'max': self.max}
+
+
+class RDF:
+    '''
+    Definition
+    ----------
+    Radial distribution function g(r) up to rmax (Å), accumulated as a
+    histogram over frames. elements=(A, B) restricts it to A-B pairs.
+    Periodic systems use the cell volume; otherwise volume (Å^3) must be given.
+    '''
+
+    name = 'rdf'
+
+    def __init__(self, rmax, nbins=200, elements=None, volume=None):
+        self.rmax = rmax
+        self.nbins = nbins
+        self.elements = elements
+        self.volume = volume
+        self.edges = np.linspace(0., rmax, nbins + 1)
+        self.counts = np.zeros(nbins)
+        self.norm = 0.
+
+    def update(self, atoms):
+        symbols = np.array(atoms.get_chemical_symbols())
+        if self.elements is None:
+            sel_a = sel_b = np.ones(len(atoms), dtype=bool)
+        else:
+            sel_a, sel_b = symbols == self.elements[0], symbols == self.elements[1]
+
+        i, j, d = neighbor_list('ijd', atoms, self.rmax)
+        keep = sel_a[i] & sel_b[j]
+        self.counts += np.histogram(d[keep], bins=self.edges)[0]
+
+        volume = atoms.get_volume() if atoms.pbc.all() else self.volume
+        if volume is None:
+            raise ValueError('RDF of a non periodic system needs a volume')
+        n_a, n_b = sel_a.sum(), sel_b.sum()
+        same = self.elements is None or self.elements[0] == self.elements[1]
+        self.norm += n_a * (n_b - same) / volume
+
+    def result(self):
+        r = 0.5 * (self.edges[1:] + self.edges[:-1])
+        shells = 4. / 3. * np.pi * (self.edges[1:]**3 - self.edges[:-1]**3)
+        g = self.counts / (self.norm * shells) if self.norm > 0 else np.zeros_like(r)
+        return {'r': r, 'g': g}
+
+
+class MSD:
+    '''
+    Definition
+    ----------
+    Mean square displacement (Å²) from the first streamed frame, for all atoms or
+    the given elements. Periodic jumps are unwrapped with the minimum image of
+    the frame-to-frame displacement, so frames must be close enough in time.
+    At most max_points values are kept: when full, neighbouring bins are
+    averaged together and the bin width (in frames) doubles.
+    '''
+
+    name = 'msd'
+
+    def __init__(self, elements=None, max_points=1024):
+        self.elements = elements
+        self.max_points = max_points
+        self.reference = None
+        self.previous = None
+        self.unwrapped = None
+        self.n_frames = 0
+        self.bin_width = 1
+        self.sums = []          # [msd sum, frame sum, count] per bin
+
+    def update(self, atoms):
+        positions = atoms.get_positions()
+        if self.reference is None:
+            self.reference = positions.copy()
+            self.unwrapped = positions.copy()
+            if self.elements is None:
+                self.selection = np.ones(len(atoms), dtype=bool)
+            else:
+                self.selection = np.isin(atoms.get_chemical_symbols(), self.elements)
+        else:
+            step = positions - self.previous
+            if atoms.pbc.any():
+                from ase.geometry import find_mic
+                step, _ = find_mic(step, atoms.get_cell(), atoms.pbc)
+            self.unwrapped += step
+        self.previous = positions
+        displacement = self.unwrapped[self.selection] - self.reference[self.selection]
+        msd = float((displacement**2).sum(axis=1).mean())
+
+        b = self.n_frames // self.bin_width
+        if b == len(self.sums):
+            self.sums.append([0., 0., 0])
+        self.sums[b][0] += msd
+        self.sums[b][1] += self.n_frames
+        self.sums[b][2] += 1
+        self.n_frames += 1
+
+        if len(self.sums) > self.max_points:
+            self.sums = [[sum(v) for v in zip(*self.sums[k:k + 2])] for k in range(0, len(self.sums), 2)]
+            self.bin_width *= 2
+
+    def result(self):
+        '''
+        MSD (Å²) per bin and the mean frame index (from the first streamed frame) of each bin.
+        '''
+        sums = np.array(self.sums, dtype=float).reshape(-1, 3)
+        return {'frame': sums[:, 1] / sums[:, 2], 'msd': sums[:, 0] / sums[:, 2]}
+
+
+def analyse(reader, observables, start=0, stop=None, step=1):
+    '''
+    Definition
+    ----------
+    Streams the frames start:stop:step of a TrajectoryReader (or any iterable
+    of Atoms) through the observables. Returns a dict name -> result.
+    '''
+
+    frames = reader.iter_frames(start, stop, step) if isinstance(reader, TrajectoryReader) else reader
+    for atoms in frames:
+        for observable in observables:
+            observable.update(atoms)
+    return {observable.name: observable.result() for observable in observables}
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# make `nnp_tools` importable as from the notebooks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
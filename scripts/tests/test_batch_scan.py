@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from ase.build import molecule
+from ase.calculators.emt import EMT
+
+from nnp_tools import batch_scan, conformers
+
+
+# H-C-C-H dihedral and C-C bond of ethane, C-C-H angle
+SCANS = [
+    ('dihedral', lambda mol, kw: batch_scan.evaluate_dihedral(mol, [2, 0, 1, 5], kw.pop('mask', None), [EMT()], ['EMT'], resolution=30, **kw)),
+    ('bond', lambda mol, kw: batch_scan.evaluate_bond(mol, [0, 1], kw.pop('mask', None), [EMT()], ['EMT'], search_space=[1.3, 2.0], resolution=8, **kw)),
+    ('angle', lambda mol, kw: batch_scan.evaluate_angle(mol, [0, 1, 5], [EMT()], ['EMT'], resolution=8, **kw)),
+]
+
+REBUILD = {
+    'dihedral': conformers.dihedral_scan,
+    'bond': conformers.bond_scan,
+    'angle': conformers.angle_scan,
+}
+
+
+@pytest.mark.parametrize('kind, scan', SCANS, ids=[kind for kind, _ in SCANS])
+def test_saved_scan_replays(tmp_path, kind, scan):
+    ethane = molecule('C2H6')
+    path = str(tmp_path / f'{kind}.npz')
+    scan(ethane, {'save_path': path})
+
+    saved = conformers.load_scan(path)
+    assert saved['kind'] == kind
+    assert saved['mask'].any()
+
+    replay = REBUILD[kind](ethane, saved['ids'], saved['values'], mask=saved['mask'])
+    np.testing.assert_allclose(replay, saved['positions'], atol=1e-10)
+
+
+def test_saved_scan_keeps_given_mask(tmp_path):
+    ethane = molecule('C2H6')
+    mask = [0, 1, 0, 0, 0, 1, 0, 0]    # rotate C1 and one of its hydrogens only
+    path = str(tmp_path / 'dihedral.npz')
+    batch_scan.evaluate_dihedral(ethane, [2, 0, 1, 5], mask, [EMT()], ['EMT'], resolution=30, save_path=path)
+
+    np.testing.assert_array_equal(conformers.load_scan(path)['mask'], mask)
@@ -0,0 +1,55 @@
+import numpy as np
+
+from nnp_tools.cache import CalculatorCache
+
+
+ENTRY_SIZE = 4 + 8 + 2 * 3 * 8     # 4-character key, energy, forces of 2 atoms
+
+
+def _forces(i):
+    return np.full((2, 3), float(i))
+
+
+def test_running_size(tmp_path):
+    cache = CalculatorCache(str(tmp_path / 'cache.sqlite'))
+    for i in range(10):
+        cache.put(f'k{i:03d}', float(i), _forces(i))
+    cache.put('k000', 0., _forces(0))   # replacing does not grow the cache
+    assert cache._size == cache.size() == 10 * ENTRY_SIZE
+
+    cache.clear()
+    assert cache._size == cache.size() == 0
+    cache.close()
+
+
+def test_hits_do_not_commit(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = CalculatorCache(path)
+    cache.put('k000', 1., _forces(1))
+    stored, = cache._db.execute('SELECT last_access FROM results').fetchone()
+    changes = cache._db.total_changes
+
+    energy, forces = cache.get('k000', forces=True)
+    assert energy == 1. and np.array_equal(forces, _forces(1))
+    assert cache._db.total_changes == changes and not cache._db.in_transaction
+
+    cache.close()
+    reopened = CalculatorCache(path)
+    last_access, = reopened._db.execute('SELECT last_access FROM results').fetchone()
+    assert last_access > stored
+    reopened.close()
+
+
+def test_lru_eviction(tmp_path):
+    cache = CalculatorCache(str(tmp_path / 'cache.sqlite'), max_size=10 * ENTRY_SIZE)
+    for i in range(10):
+        cache.put(f'k{i:03d}', float(i), _forces(i))
+    # k000 is the oldest entry but was just used
+    cache.get('k000')
+    cache.put('k010', 10., _forces(10))
+
+    assert cache.evictions == 2
+    assert cache._size == cache.size() <= 0.9 * cache.max_size
+    assert cache.get('k000') is not None
+    assert cache.get('k001') is None and cache.get('k002') is None
+    cache.close()
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from ase.units import Hartree, Bohr
+
+from nnp_tools.gaussian_logs import read_gaussian_log
+
+
+DASHES = ' ' + '-' * 69 + '\n'
+
+GEOMETRY = [
+    (8, 0.000000, 0.000000, 0.119262),
+    (1, 0.000000, 0.763239, -0.477047),
+    (1, 0.000000, -0.763239, -0.477047),
+    (6, 1.500000, 0.000000, 0.000000),
+]
+
+FORCES = [
+    (0.000000000, 0.000000000, -0.012345678),
+    (0.000000000, 0.004321000, 0.006172839),
+    (0.000000000, -0.004321000, 0.006172839),
+    (0.001000000, -0.002000000, 0.000000000),
+]
+
+
+def _orientation(title, geometry):
+    text = f'                          {title}:\n' + DASHES
+    text += ' Center     Atomic      Atomic             Coordinates (Angstroms)\n'
+    text += ' Number     Number       Type             X           Y           Z\n' + DASHES
+    for i, (z, x, y, zz) in enumerate(geometry):
+        text += f'{i + 1:7d}{z:11d}{0:12d}{x:16.6f}{y:12.6f}{zz:12.6f}\n'
+    return text + DASHES
+
+
+def _forces(forces):
+    text = DASHES
+    text += ' Center     Atomic                   Forces (Hartrees/Bohr)\n'
+    text += ' Number     Number              X              Y              Z\n' + DASHES
+    for i, ((z, *_), (fx, fy, fz)) in enumerate(zip(GEOMETRY, forces)):
+        text += f'{i + 1:7d}{z:9d}{fx:19.9f}{fy:15.9f}{fz:15.9f}\n'
+    return text + DASHES
+
+
+def _write_log(path, forces):
+    text = ' Charge =  0 Multiplicity = 1\n'
+    text += _orientation('Input orientation', GEOMETRY)
+    text += _orientation('Standard orientation', GEOMETRY)
+    text += ' SCF Done:  E(RB3LYP) =  -115.123456789     A.U. after   10 cycles\n'
+    text += _forces(forces)
+    text += ' Normal termination of Gaussian 16 at Mon Jan  1 00:00:00 2024.\n'
+    path.write_text(text)
+    return str(path)
+
+
+def test_forces_block(tmp_path):
+    log = read_gaussian_log(_write_log(tmp_path / 'h2o_c.log', FORCES))
+
+    assert log['forces'].shape == (len(GEOMETRY), 3)
+    np.testing.assert_allclose(log['forces'], np.array(FORCES) * Hartree / Bohr)
+    np.testing.assert_array_equal(log['numbers'], [z for z, *_ in GEOMETRY])
+    assert log['energy'] == pytest.approx(-115.123456789 * Hartree)
+    assert log['converged']
+
+
+def test_forces_size_mismatch(tmp_path):
+    with pytest.raises(ValueError):
+        read_gaussian_log(_write_log(tmp_path / 'broken.log', FORCES[:2]))
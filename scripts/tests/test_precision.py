@@ -0,0 +1,62 @@
+import numpy as np
+from ase import Atoms
+from ase.calculators.calculator import Calculator, all_changes
+
+from nnp_tools import batch_scan
+from nnp_tools.precision import AdaptivePrecisionCalculator, promotion_mask
+
+
+# total energy of a large molecule (COSAN with ANI is ~ -7e4 eV)
+OFFSET = -2e4
+BARRIER = 0.5
+
+
+def torsion_energy(phi):
+    return OFFSET + 0.5 * BARRIER * (1. - np.cos(phi))
+
+
+class TorsionCalculator(Calculator):
+    '''
+    Smooth 1D torsion profile along the x coordinate of atom 0, in a given precision.
+    '''
+
+    implemented_properties = ['energy', 'free_energy', 'forces']
+
+    def __init__(self, dtype, **kwargs):
+        Calculator.__init__(self, **kwargs)
+        self.dtype = dtype
+
+    def calculate(self, atoms=None, properties=['energy'], system_changes=all_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+        phi = np.deg2rad(self.atoms.positions[0, 0])
+        energy = float(self.dtype(torsion_energy(phi)))
+        forces = np.zeros((len(self.atoms), 3))
+        forces[0, 0] = -0.5 * BARRIER * np.sin(phi) * np.pi / 180.
+        self.results['energy'] = energy
+        self.results['free_energy'] = energy
+        self.results['forces'] = forces
+
+
+def test_fine_scan_promotes_minority():
+    phi = np.deg2rad(np.arange(0., 361., 1.))
+    energies = torsion_energy(phi).astype(np.float32).astype(float)
+
+    mask, reasons = promotion_mask(energies)
+    assert mask.mean() < 0.5
+    assert not reasons['curvature'].any()
+    # the extrema (0, 180 and 360 degrees) are the unresolved points
+    assert mask[0] and mask[180] and mask[-1]
+    assert not mask[90]
+
+
+def test_fine_scan_calculator():
+    atoms = Atoms('H2', positions=[[0., 0., 0.], [5., 0., 0.]])
+    positions = np.repeat(atoms.positions[None], 361, axis=0)
+    positions[:, 0, 0] = np.arange(0., 361., 1.)
+
+    calc = AdaptivePrecisionCalculator(TorsionCalculator(np.float32), TorsionCalculator(np.float64))
+    energies, _ = batch_scan.evaluate_batch(calc, atoms, positions)
+
+    assert 0 < calc.stats['promoted'] < 0.5 * calc.stats['points']
+    promoted = calc.last_promoted
+    np.testing.assert_allclose(energies[promoted], torsion_energy(np.deg2rad(positions[promoted, 0, 0])))
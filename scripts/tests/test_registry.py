@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+from ase.build import molecule
+
+torch = pytest.importorskip('torch')
+torchani = pytest.importorskip('torchani')
+
+from nnp_tools import registry
+
+
+@pytest.fixture
+def offline_ani(monkeypatch):
+    # untrained ANI architecture instead of the downloaded NeuroChem ensembles
+    def _ani_model(name):
+        torch.manual_seed(0)
+        return torchani.arch.simple_ani(['H', 'C', 'O'], lot='wb97x-631gd')
+
+    monkeypatch.setattr(registry, '_ani_model', _ani_model)
+    registry.clear_session()
+    yield
+    registry.clear_session()
+
+
+def _energy_forces(calc):
+    atoms = molecule('CH3OH')
+    atoms.calc = calc
+    return atoms.get_potential_energy(), atoms.get_forces()
+
+
+def test_ani_without_artifacts(offline_ani):
+    calc = registry.get_calculator('ANI-2x', use_artifacts=False)
+    energy, forces = _energy_forces(calc)
+
+    assert np.isfinite(energy) and forces.shape == (6, 3)
+    assert registry.STARTUP_TIMES[('ANI-2x', 'cpu', 'float32')]['source'] == 'built'
+    assert registry.get_calculator('ANI-2x', use_artifacts=False) is calc
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float64'])
+def test_ani_artifact_roundtrip(offline_ani, tmp_path, dtype):
+    built = registry.get_calculator('ANI-2x', dtype=dtype, artifact_dir=str(tmp_path))
+    key = ('ANI-2x', 'cpu', dtype)
+    assert registry.STARTUP_TIMES[key]['source'] == 'built'
+    assert os.path.isfile(tmp_path / f'ANI-2x_{dtype}.pt')
+
+    registry.clear_session()
+    loaded = registry.get_calculator('ANI-2x', dtype=dtype, artifact_dir=str(tmp_path))
+    assert registry.STARTUP_TIMES[key]['source'] == 'artifact'
+    assert isinstance(loaded.model, torch.jit.ScriptModule)
+
+    energy, forces = _energy_forces(built)
+    loaded_energy, loaded_forces = _energy_forces(loaded)
+    assert loaded_energy == pytest.approx(energy)
+    np.testing.assert_allclose(loaded_forces, forces, atol=1e-5)
@@ -0,0 +1,51 @@
+import numpy as np
+from ase import Atoms, units
+from ase.calculators.lj import LennardJones
+from ase.constraints import FixBondLengths
+from ase.md.verlet import VelocityVerlet
+
+from nnp_tools.replica_md import ReplicaMD
+
+
+BOND = 3.8
+
+
+def _rigid_dimers():
+    # 8 argon dimers with fixed bond lengths in a periodic box
+    positions = []
+    for corner in np.ndindex(2, 2, 2):
+        center = 7. * np.array(corner)
+        positions += [center, center + [BOND, 0., 0.]]
+    atoms = Atoms('Ar16', positions=positions, cell=[14., 14., 14.], pbc=True)
+    atoms.set_constraint(FixBondLengths([(2 * i, 2 * i + 1) for i in range(8)]))
+    return atoms
+
+
+def _calc():
+    return LennardJones(epsilon=0.0104, sigma=3.4, rc=6.5)
+
+
+def test_constrained_nve_matches_ase():
+    atoms = _rigid_dimers()
+    md = ReplicaMD(atoms, _calc(), n_replicas=1, temperatures=60., timestep=5 * units.fs, fixcm=False)
+
+    reference = md.get_atoms(0)
+    reference.calc = _calc()
+    VelocityVerlet(reference, timestep=5 * units.fs).run(50)
+    md.run(50, verbose=False)
+
+    np.testing.assert_allclose(md.positions[0], reference.positions, atol=1e-10)
+    np.testing.assert_allclose(md.momenta[0], reference.get_momenta(), atol=1e-10)
+    assert md.instantaneous_temperatures()[0] == reference.get_temperature()
+
+
+def test_constrained_langevin_keeps_bonds():
+    md = ReplicaMD(_rigid_dimers(), _calc(), n_replicas=3, temperatures=[30., 60., 90.], timestep=5 * units.fs, friction=0.02 / units.fs)
+    md.run(50, verbose=False)
+
+    bonds = np.linalg.norm(md.positions[:, 1::2] - md.positions[:, 0::2], axis=2)
+    np.testing.assert_allclose(bonds, BOND, atol=1e-8)
+    # no velocity component along the rigid bonds
+    directions = (md.positions[:, 1::2] - md.positions[:, 0::2]) / bonds[..., None]
+    relative = md.momenta[:, 1::2] - md.momenta[:, 0::2]
+    np.testing.assert_allclose((relative * directions).sum(axis=2), 0., atol=1e-8)
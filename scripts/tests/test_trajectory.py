@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from ase import Atoms
+from ase.calculators.singlepoint import SinglePointCalculator
+
+from nnp_tools.trajectory import EnergyDrift
+
+
+TOTAL_ENERGY = -10.
+
+
+def _frame(velocity, momenta=True):
+    atoms = Atoms('H2', positions=[[0., 0., 0.], [0.74, 0., 0.]])
+    ekin = 0.
+    if momenta:
+        atoms.set_momenta(velocity * atoms.get_masses()[:, None] * [[1., 0., 0.], [-1., 0., 0.]])
+        ekin = atoms.get_kinetic_energy()
+    atoms.calc = SinglePointCalculator(atoms, energy=TOTAL_ENERGY - ekin)
+    return atoms
+
+
+def test_energy_drift_skips_frames_without_momenta():
+    drift = EnergyDrift()
+    for i, velocity in enumerate([0.01, 0.02, 0.03, 0.04, 0.05]):
+        # a frame written without velocities, e.g. by an .xyz writer
+        drift.update(_frame(velocity, momenta=(i != 2)))
+    result = drift.result()
+
+    assert result['n_frames'] == 4
+    assert result['e_first'] == pytest.approx(TOTAL_ENERGY)
+    assert result['max_deviation'] == pytest.approx(0., abs=1e-12)
+    assert result['slope_per_frame'] == pytest.approx(0., abs=1e-12)